@@ -1,251 +1,1121 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
-from fastapi.encoders import jsonable_encoder
-from typing import List, Dict, Any
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import List, Dict, Any, Optional
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+from functools import partial
 from pathlib import Path
-import io, os, re, time
+import asyncio, hashlib, io, ipaddress, json, logging, os, socket, threading, time, urllib.parse, urllib.request
 
 import numpy as np
 import cv2
 from PIL import Image
-from paddleocr import PaddleOCR
 
-app = FastAPI(title='check_api')
+from archive import ArchiveWriter
+from highlight import highlight_filter, highlight_regions
+from ingest import BodyLimitMiddleware, IngestStats, MemoryLedger, Upload, UploadTooLargeError, probe_size, read_upload
+from jobs import JobStore
+from ocr_cache import OCRCache
+from ocr_phash import PHashIndex, dhash, thumb_diff, thumbnail
+from layout import LayoutTemplates
+from metrics import Metrics, StageTimer
+from backends import BACKENDS, make_backend, make_recognizer
+from ocr_engine import (crop_quad, parse_predict_result, predict_batch, read_image_to_bgr, recognize_batch,
+                        warmup, warmup_rec)
+from ocr_pool import DeadlineExceededError, InferenceExecutor, QueueFullError
+from ocr_shards import ShardedExecutor, stage_models, staged_path
+from prescale import prescale, unscale_lines
+from profiler import PROFILE_HEADER, Profiler
+from scheduler import PRIORITIES, parse_mapping
+from serialize import SCHEMAS, FastJSONResponse, dumps, shape_payload
+from tiling import merge_tiles, plan_tiles, should_tile
 
-# Сохраняем именно в ./downloads рядом с файлом
+# Момент старта процесса — от него считаем время до готовности моделей
+PROCESS_STARTED = time.perf_counter()
+log = logging.getLogger("uvicorn.error")
+
+# Метрики (GET /metrics, формат Prometheus): время этапов, счётчики картинок/байт/строк, запросы в работе.
+# OCR_RESPONSE_TIMINGS=1 — блок timings в каждом ответе (для запроса — поле формы timings)
+METRICS = Metrics()
+OCR_RESPONSE_TIMINGS = os.getenv("OCR_RESPONSE_TIMINGS") == "1"
+
+# Профилирование (profiler.py), только при OCR_PROFILE=1: сэмплер стеков всего процесса. В OCR_PROFILE_DIR
+# сохраняются запросы /ocr дольше OCR_SLOW_MS, доля OCR_PROFILE_RATE и запросы с заголовком X-OCR-Profile: 1;
+# список — GET /profiles. OCR_PROFILE_SAVE_INPUT=1 — сохранять и картинку (байты держатся до конца запроса)
+OCR_PROFILE = os.getenv("OCR_PROFILE") == "1"
+OCR_PROFILE_SAVE_INPUT = os.getenv("OCR_PROFILE_SAVE_INPUT") == "1"
+PROFILER = Profiler(
+    Path(os.getenv("OCR_PROFILE_DIR") or Path(__file__).parent / "profiles"),
+    interval_ms=float(os.getenv("OCR_PROFILE_INTERVAL_MS", "10")),
+    window_s=float(os.getenv("OCR_PROFILE_WINDOW_S", "120")),
+    slow_ms=float(os.getenv("OCR_SLOW_MS", "2000")),
+    rate=float(os.getenv("OCR_PROFILE_RATE", "0")),
+    keep=int(os.getenv("OCR_PROFILE_KEEP", "200")),
+)
+
+# Архив загрузок в ./downloads рядом с файлом: пишется в фоне и не держит ответ.
+# Файлы — downloads/ab/cd/<sha256>.<ext>, повторы не пишутся, индекс — downloads/index.sqlite3 (GET /archive).
+# OCR_ARCHIVE_FORMAT: original | jpeg | png; OCR_ARCHIVE_SAMPLE: доля запросов (0 — выключен);
+# OCR_ARCHIVE_MAX_MB — потолок размера (0 — без потолка), сверх него удаляются давно не виденные файлы;
+# OCR_ARCHIVE_MAX_AGE_DAYS — удалять файлы, не виденные дольше (0 — не удалять)
 DOWNLOAD_DIR = Path(__file__).parent / "downloads"
-DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+ARCHIVE = ArchiveWriter(
+    DOWNLOAD_DIR,
+    fmt=os.getenv("OCR_ARCHIVE_FORMAT", "original"),
+    sample_rate=float(os.getenv("OCR_ARCHIVE_SAMPLE", "1.0")),
+    queue_size=int(os.getenv("OCR_ARCHIVE_QUEUE", "64")),
+    on_timing=lambda stage, seconds: METRICS.observe("stage_seconds", seconds, stage=stage),
+    max_bytes=int(float(os.getenv("OCR_ARCHIVE_MAX_MB", "0")) * 1024 * 1024),
+    max_age_s=float(os.getenv("OCR_ARCHIVE_MAX_AGE_DAYS", "0")) * 86400,
+    sweep_s=float(os.getenv("OCR_ARCHIVE_SWEEP_S", "300")),
+)
+
+# Пул инференса: N воркеров, у каждого свой PaddleOCR, очередь ограничена.
+# OCR_SERVING=threads — потоки в этом процессе; processes — отдельные процессы-шарды,
+# каждый на своих OCR_THREADS_PER_WORKER ядрах (подбор сплита — benchmarks/bench_workers.py)
+OCR_SERVING = os.getenv("OCR_SERVING", "threads")
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "1"))
+OCR_THREADS_PER_WORKER = int(os.getenv("OCR_THREADS_PER_WORKER", "0"))
+OCR_QUEUE_SIZE = int(os.getenv("OCR_QUEUE_SIZE", "8"))
+OCR_RETRY_AFTER = int(os.getenv("OCR_RETRY_AFTER", "2"))
+# Микро-батчинг: ждём до N мс или до M картинок и зовём predict один раз
+OCR_BATCH_MAX_SIZE = int(os.getenv("OCR_BATCH_MAX_SIZE", "4"))
+OCR_BATCH_MAX_WAIT_MS = float(os.getenv("OCR_BATCH_MAX_WAIT_MS", "10"))
+# Планировщик очереди (scheduler.py): класс high | normal | low и источник (поле формы source, например id
+# канала). Без поля priority класс берётся по источнику (OCR_SOURCE_PRIORITY="chan1=high,...") или по focus
+# (OCR_FOCUS_PRIORITY). OCR_PRIORITY_WEIGHTS — веса классов; OCR_SOURCE_SHARE — доля очереди на один источник
+# (считаются только запросы с source; 1.0 — без ограничения, например 0.5 — не больше половины очереди);
+# OCR_QUEUE_DEADLINE_MS — сколько запрос может ждать инференса (0 — сколько угодно; для запроса — deadline_ms)
+OCR_PRIORITY_WEIGHTS = {k: float(v) for k, v in parse_mapping(os.getenv("OCR_PRIORITY_WEIGHTS")).items()
+                        if k in PRIORITIES}
+OCR_SOURCE_PRIORITY = parse_mapping(os.getenv("OCR_SOURCE_PRIORITY"))
+# По умолчанию все focus в normal: бот шлёт focus=both, понижать его класс — только явной настройкой
+OCR_FOCUS_PRIORITY = parse_mapping(os.getenv("OCR_FOCUS_PRIORITY", "full=normal,highlight=normal,both=normal"))
+OCR_SOURCE_SHARE = float(os.getenv("OCR_SOURCE_SHARE", "1.0"))
+OCR_QUEUE_DEADLINE_MS = float(os.getenv("OCR_QUEUE_DEADLINE_MS", "0"))
+
+# Настройки OCR (входят и в ключ кэша)
+OCR_LANG = os.getenv("OCR_LANG", "ru")
+OCR_DET_LIMIT_SIDE_LEN = int(os.getenv("OCR_DET_LIMIT_SIDE_LEN", "1200"))
+OCR_SCORE_THRESH = float(os.getenv("OCR_SCORE_THRESH", "0.5"))
+# Уменьшение перед детекцией по размеру и плотности текста (prescale.py); 0 — отдавать как есть.
+# Для одного запроса — поле формы det_side (0 — без уменьшения, N — длинная сторона N)
+OCR_PRESCALE = os.getenv("OCR_PRESCALE", "1") == "1"
+OCR_PRESCALE_MIN_SIDE = int(os.getenv("OCR_PRESCALE_MIN_SIDE", "640"))
+# Тайлы для длинных скриншотов (tiling.py): режем, если длинная сторона больше OCR_TILE_SIDE и
+# не меньше чем в OCR_TILE_MIN_ASPECT раз больше короткой (0 — только по запросу, поле формы tiling=on).
+# Большие фото обычных пропорций не режутся — их уменьшает prescale
+OCR_TILE_SIDE = int(os.getenv("OCR_TILE_SIDE", str(OCR_DET_LIMIT_SIDE_LEN)))
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "160"))
+OCR_TILE_MIN_ASPECT = float(os.getenv("OCR_TILE_MIN_ASPECT", "3.0"))
+TILING_MODES = ("auto", "on", "off")
+# Локальные модели (подкаталоги det/rec/cls); OCR_MODEL_SHM=1 — скопировать в /dev/shm для шардов
+OCR_MODEL_DIR = os.getenv("OCR_MODEL_DIR") or None
+OCR_MODEL_SHM = os.getenv("OCR_MODEL_SHM") == "1"
+# Движок инференса (backends.py): paddle — PaddleOCR; onnx — модели PP-OCR в ONNX на onnxruntime
+# из OCR_ONNX_DIR (det.onnx, rec.onnx, dict.txt); OCR_ONNX_INT8=1 — INT8-квантованные веса.
+# Сравнение задержки, памяти и точности — benchmarks/bench_backends.py
+OCR_BACKEND = os.getenv("OCR_BACKEND", "paddle")
+if OCR_BACKEND not in BACKENDS:
+    raise RuntimeError(f"OCR_BACKEND: ожидается одно из {BACKENDS}, получено {OCR_BACKEND!r}")
+OCR_ONNX_DIR = os.getenv("OCR_ONNX_DIR") or None
+OCR_ONNX_INT8 = os.getenv("OCR_ONNX_INT8") == "1"
+
+# Прогрев: сколько раз прогнать синтетическую картинку через каждый воркер (0 — без прогрева)
+OCR_WARMUP_RUNS = int(os.getenv("OCR_WARMUP_RUNS", "1"))
+
+def _make_pool():
+    model_dir = staged_path(OCR_MODEL_DIR) if (OCR_MODEL_DIR and OCR_MODEL_SHM) else OCR_MODEL_DIR
+    factory = partial(make_backend, OCR_BACKEND, lang=OCR_LANG, det_limit_side_len=OCR_DET_LIMIT_SIDE_LEN,
+                      cpu_threads=OCR_THREADS_PER_WORKER or None, model_dir=model_dir,
+                      onnx_dir=OCR_ONNX_DIR, int8=OCR_ONNX_INT8)
+    if OCR_SERVING == "processes":
+        return ShardedExecutor(factory, predict_batch, workers=OCR_WORKERS,
+                               threads_per_worker=OCR_THREADS_PER_WORKER or 1, queue_size=OCR_QUEUE_SIZE,
+                               max_batch=OCR_BATCH_MAX_SIZE, max_wait_ms=OCR_BATCH_MAX_WAIT_MS,
+                               weights=OCR_PRIORITY_WEIGHTS, source_share=OCR_SOURCE_SHARE)
+    return InferenceExecutor(factory, predict_batch, workers=OCR_WORKERS, queue_size=OCR_QUEUE_SIZE,
+                             max_batch=OCR_BATCH_MAX_SIZE, max_wait_ms=OCR_BATCH_MAX_WAIT_MS,
+                             weights=OCR_PRIORITY_WEIGHTS, source_share=OCR_SOURCE_SHARE)
+
+OCR_POOL = _make_pool()
+MODEL_LOAD_ERROR = None
+
+def load_models():
+    """Создаёт модели и прогревает их; вызывается в фоне из lifespan."""
+    global MODEL_LOAD_ERROR
+    t0 = time.perf_counter()
+    try:
+        if OCR_MODEL_DIR and OCR_MODEL_SHM:
+            stage_models(OCR_MODEL_DIR)
+        OCR_POOL.start(warmup=partial(warmup, runs=OCR_WARMUP_RUNS, batch_size=OCR_BATCH_MAX_SIZE)
+                       if OCR_WARMUP_RUNS > 0 else None)
+    except Exception as e:
+        MODEL_LOAD_ERROR = f"{type(e).__name__}: {e}"
+        log.exception("OCR: не удалось загрузить модели")
+        return
+    if REC_POOL is not None:
+        # Без распознавателя просто нет быстрого пути по шаблонам — сервис при этом готов
+        try:
+            REC_POOL.start(warmup=partial(warmup_rec, runs=OCR_WARMUP_RUNS) if OCR_WARMUP_RUNS > 0 else None)
+        except Exception:
+            log.exception("OCR: не удалось загрузить распознаватель для шаблонов раскладки")
+    log.info("OCR: модели готовы за %.2f с (воркеров %d, прогрев %d), от старта процесса %.2f с",
+             time.perf_counter() - t0, OCR_POOL.workers, OCR_WARMUP_RUNS,
+             time.perf_counter() - PROCESS_STARTED)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Модели грузятся в фоне: /check отвечает сразу, /ready — только после прогрева
+    threading.Thread(target=load_models, name="ocr-model-loader", daemon=True).start()
+    if OCR_PROFILE:
+        PROFILER.start()
+    tasks = [asyncio.create_task(job_worker(i)) for i in range(OCR_JOBS_CONCURRENCY)]
+    tasks.append(asyncio.create_task(jobs_maintenance()))
+    yield
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await run_in_threadpool(OCR_POOL.shutdown)
+    if REC_POOL is not None:
+        await run_in_threadpool(REC_POOL.shutdown)
+    await run_in_threadpool(ARCHIVE.flush)
+    PROFILER.stop()
+
+app = FastAPI(title='check_api', lifespan=lifespan)
 
-OCR = PaddleOCR(
-    use_angle_cls=True,
-    lang='ru',
-    
-    det_limit_side_len=1200
+# Кэш результатов по sha256 картинки: LRU в памяти + (опционально) каталог на диске
+OCR_CACHE = OCRCache(
+    max_entries=int(os.getenv("OCR_CACHE_SIZE", "1024")),
+    ttl_s=float(os.getenv("OCR_CACHE_TTL_S", str(24 * 3600))),
+    disk_dir=os.getenv("OCR_CACHE_DIR") or None,
+    settings={'backend': OCR_BACKEND, 'int8': OCR_ONNX_INT8, 'lang': OCR_LANG, 'det_limit_side_len': OCR_DET_LIMIT_SIDE_LEN, 'score_thresh': OCR_SCORE_THRESH,
+              'prescale': OCR_PRESCALE, 'prescale_min_side': OCR_PRESCALE_MIN_SIDE,
+              'tile_side': OCR_TILE_SIDE, 'tile_overlap': OCR_TILE_OVERLAP, 'tile_min_aspect': OCR_TILE_MIN_ASPECT},
 )
 
-def _safe_stem(name: str) -> str:
-    base = os.path.basename(name) if name else "upload"
-    stem = Path(base).stem
-    return re.sub(r'[^A-Za-z0-9._-]+', '_', stem) or "upload"
+# Почти-дубликаты (пережатые репосты): dHash + поиск по Хэммингу. По умолчанию выключено (-1).
+# Любое расстояние > 0 для шаблонных каналов само по себе небезопасно: тот же шаблон с другими цифрами
+# отличается от оригинала на 0-2 бита dHash. Поэтому кандидат отдаётся, только если совпали пропорции
+# и серые миниатюры 32x32 расходятся не больше OCR_PHASH_MAX_THUMB_DIFF по яркости клетки (пережатие
+# даёт единицы, дописанный текст — десятки). Правки мельче клетки миниатюры (~1/32 стороны) проверка
+# не видит — для таких каналов держите выключенным
+OCR_PHASH_MAX_DIST = int(os.getenv("OCR_PHASH_MAX_DIST", "-1"))
+OCR_PHASH_MAX_THUMB_DIFF = int(os.getenv("OCR_PHASH_MAX_THUMB_DIFF", "16"))
+PHASH_INDEX = PHashIndex(Path(OCR_CACHE.disk_dir) / "phash.idx" if OCR_CACHE.disk_dir else None)
 
-def read_image_to_bgr(file_bytes: bytes):
-    arr = np.frombuffer(file_bytes, np.uint8)
-    img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-    if img is None:
-        raise ValueError("Не удалось декодировать изображение")
+# Лимиты приёма: размер файла и пикселей кадра (декомпрессионные бомбы и мегапанорамы) — 413 до декода
+OCR_MAX_UPLOAD_MB = float(os.getenv("OCR_MAX_UPLOAD_MB", "20"))
+OCR_MAX_UPLOAD_BYTES = int(OCR_MAX_UPLOAD_MB * 1024 * 1024)
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", str(50_000_000)))
+INGEST = IngestStats()
+
+# Шаблоны раскладки (layout.py): та же вёрстка — боксы из прошлого OCR, дальше только распознавание.
+# OCR_LAYOUT_MAX_DIST — порог dHash (-1 — выключено); OCR_LAYOUT_MIN_CONF — средняя уверенность,
+# OCR_LAYOUT_MIN_LINE_CONF — уверенность худшей строки: ниже любой из них шаблон считается не подошедшим
+# и делается полный OCR (одна строка из съехавшего бокса почти не сдвигает среднее по посту)
+OCR_LAYOUT_MAX_DIST = int(os.getenv("OCR_LAYOUT_MAX_DIST", "-1"))
+OCR_LAYOUT_MIN_CONF = float(os.getenv("OCR_LAYOUT_MIN_CONF", "0.85"))
+OCR_LAYOUT_MIN_LINE_CONF = float(os.getenv("OCR_LAYOUT_MIN_LINE_CONF", "0.6"))
+OCR_REC_MODEL = os.getenv("OCR_REC_MODEL") or None
+OCR_REC_WORKERS = int(os.getenv("OCR_REC_WORKERS", "1"))
+LAYOUTS = LayoutTemplates(OCR_CACHE, OCR_LAYOUT_MAX_DIST,
+                          Path(OCR_CACHE.disk_dir) / "layout.idx" if OCR_CACHE.disk_dir else None)
+REC_POOL = InferenceExecutor(
+    partial(make_recognizer, OCR_BACKEND, lang=OCR_LANG, cpu_threads=OCR_THREADS_PER_WORKER or None,
+            model_dir=OCR_MODEL_DIR, model_name=OCR_REC_MODEL, onnx_dir=OCR_ONNX_DIR, int8=OCR_ONNX_INT8),
+    recognize_batch, workers=OCR_REC_WORKERS, queue_size=OCR_QUEUE_SIZE,
+    max_batch=OCR_BATCH_MAX_SIZE, max_wait_ms=OCR_BATCH_MAX_WAIT_MS, name="rec",
+    weights=OCR_PRIORITY_WEIGHTS, source_share=OCR_SOURCE_SHARE) if LAYOUTS.enabled else None
+
+# Асинхронные задачи (jobs.py): POST /ocr/jobs -> job_id, результат — GET /ocr/jobs/{id} и/или callback_url.
+# Очередь — SQLite в OCR_JOBS_DIR, её могут разбирать несколько процессов; OCR_JOBS_CONCURRENCY —
+# сколько задач одновременно берёт этот процесс (0 — только принимает)
+OCR_JOBS_DIR = Path(os.getenv("OCR_JOBS_DIR") or Path(__file__).parent / "jobs")
+OCR_JOBS_CONCURRENCY = int(os.getenv("OCR_JOBS_CONCURRENCY", "2"))
+OCR_JOBS_POLL_S = float(os.getenv("OCR_JOBS_POLL_S", "0.5"))
+OCR_JOBS_CALLBACK_TIMEOUT_S = float(os.getenv("OCR_JOBS_CALLBACK_TIMEOUT_S", "10"))
+# Куда можно слать callback: OCR_JOBS_CALLBACK_HOSTS="bot,hooks.example.com" — только эти хосты (любые адреса,
+# в том числе внутренние); без списка — любой хост, который резолвится только в публичные адреса
+# (не loopback / частные / link-local, в том числе 169.254.169.254 метаданных облака). Редиректы не выполняются
+OCR_JOBS_CALLBACK_HOSTS = {h.strip().lower() for h in os.getenv("OCR_JOBS_CALLBACK_HOSTS", "").split(",") if h.strip()}
+JOBS = JobStore(OCR_JOBS_DIR, lease_s=float(os.getenv("OCR_JOBS_LEASE_S", "300")),
+                ttl_s=float(os.getenv("OCR_JOBS_TTL_S", str(24 * 3600))))
+# Будит воркеры этого процесса сразу после постановки задачи, не дожидаясь опроса
+JOBS_WAKEUP = asyncio.Event()
+
+# /ocr/batch: сколько картинок в одном запросе (альбом Telegram — до 10) и сколько ждать места в очереди
+OCR_BATCH_MAX_IMAGES = int(os.getenv("OCR_BATCH_MAX_IMAGES", "10"))
+OCR_BATCH_QUEUE_WAIT_S = float(os.getenv("OCR_BATCH_QUEUE_WAIT_S", "30"))
+
+# Маска обводки считается дешевле: длинная сторона не больше OCR_HIGHLIGHT_MAX_SIDE (0 — полный размер)
+# и только внутри прямоугольника строк (OCR_HIGHLIGHT_ROI); точность — benchmarks/bench_highlight.py --mode mask
+OCR_HIGHLIGHT_MAX_SIDE = int(os.getenv("OCR_HIGHLIGHT_MAX_SIDE", "1280"))
+OCR_HIGHLIGHT_ROI = os.getenv("OCR_HIGHLIGHT_ROI", "1") == "1"
+# focus=highlight: сначала найти пометки и распознавать только их (нет пометок или текста в них — полный OCR).
+# Выключено по умолчанию: с ним full_text ответа — только текст внутри пометок, а не всей картинки
+OCR_HIGHLIGHT_FIRST = os.getenv("OCR_HIGHLIGHT_FIRST", "0") == "1"
+
+# full — только текст; highlight/both — плюс текст внутри обводки (одна инференс-операция)
+FOCUS_MODES = ("full", "highlight", "both")
+
+def decode_upload(content, ledger: Optional[MemoryLedger] = None) -> np.ndarray:
+    # cv2 с фоллбеком на PIL; ошибки — 400 для клиента, слишком большой кадр — 413
+    size = probe_size(content)
+    if size is not None and OCR_MAX_PIXELS and size[0] * size[1] > OCR_MAX_PIXELS:
+        raise HTTPException(status_code=413, detail=f"Картинка {size[0]}x{size[1]} больше {OCR_MAX_PIXELS} пикселей")
+    if ledger is not None and size is not None:
+        ledger.hold("decoded", size[0] * size[1] * 3)
+    try:
+        img = read_image_to_bgr(content)
+    except Exception as e:
+        try:
+            with Image.open(io.BytesIO(content)) as im:
+                if ledger is not None:
+                    ledger.hold("fallback", len(content) + im.size[0] * im.size[1] * 3)
+                img = np.array(im.convert("RGB"))
+            # RGB -> BGR на месте, без ещё одной копии кадра
+            cv2.cvtColor(img, cv2.COLOR_RGB2BGR, dst=img)
+        except Exception:
+            raise HTTPException(status_code=400, detail=f"Не удалось декодировать изображение: {e}")
+        finally:
+            if ledger is not None:
+                ledger.release("fallback")
+    if ledger is not None:
+        ledger.hold("decoded", img.nbytes)
     return img
 
-def mask_highlight(img_bgr: np.ndarray) -> np.ndarray:
-    hsv = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV)
-    red1 = cv2.inRange(hsv, (0, 120, 70), (10, 255, 255))
-    red2 = cv2.inRange(hsv, (170, 120, 70), (180, 255, 255))
-    blue = cv2.inRange(hsv, (90, 80, 50), (130, 255, 255))
-    green = cv2.inRange(hsv, (36, 80, 50), (86, 255, 255))
-    mask_color = cv2.bitwise_or(cv2.bitwise_or(red1, red2), cv2.bitwise_or(blue, green))
-    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
-    grad = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, np.ones((3,3), np.uint8))
-    _, th = cv2.threshold(grad, 0, 255, cv2.THRESH_OTSU)
-    thick = cv2.dilate(th, np.ones((3,3), np.uint8), iterations=1)
-    mask = cv2.bitwise_or(mask_color, thick)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((7,7), np.uint8), iterations=2)
-    mask = cv2.dilate(mask, np.ones((5,5), np.uint8), iterations=1)
-    return mask
-
-def iou_with_mask(box: List[List[float]], mask: np.ndarray) -> float:
-    poly = np.array(box, dtype=np.int32)
-    x_min, y_min = np.min(poly[:, 0]), np.min(poly[:, 1])
-    x_max, y_max = np.max(poly[:, 0]), np.max(poly[:, 1])
-    roi = np.zeros_like(mask)
-    cv2.fillPoly(roi, [poly], 255)
-    inter = cv2.bitwise_and(roi, mask)
-    inter_area = int(np.sum(inter > 0))
-    box_area = max((x_max - x_min + 1) * (y_max - y_min + 1), 1)
-    return inter_area / box_area
-
-def _to_py(obj):
-    # Рекурсивно переводит numpy-типы в чистые Python-типы
-    if isinstance(obj, np.ndarray):
-        return obj.tolist()
-    if isinstance(obj, (np.integer, np.floating)):
-        return obj.item()
-    if isinstance(obj, list):
-        return [_to_py(x) for x in obj]
-    if isinstance(obj, tuple):
-        return [_to_py(x) for x in obj]
-    if isinstance(obj, dict):
-        return {k: _to_py(v) for k, v in obj.items()}
-    return obj
-
-def parse_predict_result(pred, score_thresh: float = 0.5):
-    """
-    Извлекает текст/боксы/скор из результата predict, предпочитая поля rec_*.
-    Собирает full_text из rec_texts с фильтрацией пустых строк и низких скорингов.
-    """
-    lines: List[Dict[str, Any]] = []
-    full_text_parts: List[str] = []
-    if not pred:
-        return lines, ""
-
-    res = pred[0] if isinstance(pred, list) else pred
-
-    # 1) Пытаемся взять новые поля rec_*
-    rec_texts = getattr(res, "rec_texts", None)
-    rec_scores = getattr(res, "rec_scores", None)
-    rec_polys = getattr(res, "rec_polys", None)
-
-    # Если это OCRResult с to_dict()
-    if (rec_texts is None or rec_scores is None or rec_polys is None) and hasattr(res, "to_dict"):
-        d = res.to_dict()
-        rec_texts = rec_texts or d.get("rec_texts")
-        rec_scores = rec_scores or d.get("rec_scores")
-        rec_polys = rec_polys or d.get("rec_polys")
-
-    # Если это dict
-    if rec_texts is None and isinstance(res, dict):
-        rec_texts = res.get("rec_texts")
-        rec_scores = rec_scores or res.get("rec_scores")
-        rec_polys = rec_polys or res.get("rec_polys")
-
-    # 2) Фоллбек на старые имена
-    texts = rec_texts or getattr(res, "texts", None) or (res.get("texts") if isinstance(res, dict) else None)
-    scores = rec_scores or getattr(res, "scores", None) \
-             or (res.get("rec_scores") if isinstance(res, dict) else None) \
-             or (res.get("scores") if isinstance(res, dict) else None)
-    boxes = rec_polys or getattr(res, "dt_polys", None) or getattr(res, "boxes", None) \
-            or (res.get("rec_polys") if isinstance(res, dict) else None) \
-            or (res.get("dt_polys") if isinstance(res, dict) else None) \
-            or (res.get("boxes") if isinstance(res, dict) else None)
-
-    if not texts:
-        return lines, ""
-
-    # Приводим боксы к чистым Python-типам (без numpy)
-    out_boxes = None
-    if boxes is not None:
-        out_boxes = _to_py(boxes)
-        # Дополнительная нормализация формы [8] -> [[x,y]x4]
-        norm_boxes = []
-        for b in out_boxes:
-            if isinstance(b, list) and len(b) == 8 and all(isinstance(x, (int, float)) for x in b):
-                norm_boxes.append([[b[0], b[1]], [b[2], b[3]], [b[4], b[5]], [b[6], b[7]]])
-            else:
-                norm_boxes.append(b)
-        out_boxes = norm_boxes
-
-    # Собираем строки с фильтрацией
-    n = len(texts)
-    for i in range(n):
-        txt = texts[i] if texts[i] is not None else ""
-        if isinstance(txt, bytes):
-            try:
-                txt = txt.decode("utf-8", "ignore")
-            except Exception:
-                txt = str(txt)
-        t = str(txt).strip()
-        sc = float(scores[i]) if (scores is not None and i < len(scores) and scores[i] is not None) else None
+async def ingest_upload(image: UploadFile) -> Upload:
+    """Копирует файл загрузки в память с лимитом OCR_MAX_UPLOAD_MB; ключ кэша считается по ходу чтения."""
+    try:
+        return await read_upload(image, OCR_MAX_UPLOAD_BYTES, OCR_CACHE.key_for)
+    except UploadTooLargeError as e:
+        INGEST.rejected()
+        raise HTTPException(status_code=413, detail=f"Файл больше {OCR_MAX_UPLOAD_MB:g} МБ ({e.args[0]} байт)")
+
+def _scale_lines(lines, sx: float, sy: float):
+    for ln in lines:
+        if ln.get("box") is not None:
+            ln["box"] = [[round(x * sx), round(y * sy)] for x, y in ln["box"]]
+    return lines
 
-        if t and (sc is None or sc >= score_thresh):
-            box_i = out_boxes[i] if (out_boxes is not None and i < len(out_boxes)) else None
-            lines.append({"box": box_i, "text": t, "conf": sc if sc is not None else 1.0})
-            full_text_parts.append(t)
+def near_duplicate_entry(img_bgr: np.ndarray, ph):
+    """
+    Ищет уже распознанную почти такую же картинку. Возвращает (entry, distance)
+    с боксами, пересчитанными под размер текущей картинки, или (None, None).
+    Кандидаты из индекса перебираются от ближайшего; ключи, чьи записи уже
+    вытеснены из кэша, из индекса убираются.
+    """
+    if ph is None or OCR_PHASH_MAX_DIST < 0:
+        return None, None
+    height, width = img_bgr.shape[:2]
+    for key, distance in PHASH_INDEX.search(ph, OCR_PHASH_MAX_DIST):
+        entry = OCR_CACHE.get(key)
+        if entry is None:
+            PHASH_INDEX.discard(key)
+            continue
+        sx, sy = width / entry['width'], height / entry['height']
+        # dHash не видит пропорций — другая обрезка не считается дублем;
+        # записи без миниатюры (из старого кэша) сверить нечем
+        if abs(sx - sy) > 0.02 * max(sx, sy) or not entry.get('thumb'):
+            continue
+        if thumb_diff(img_bgr, entry['thumb']) > OCR_PHASH_MAX_THUMB_DIFF:
+            continue
+        return _rescaled(entry, width, height, sx, sy), distance
+    return None, None
 
-    return lines, " ".join(full_text_parts).strip()
+def _rescaled(entry: dict, width: int, height: int, sx: float, sy: float) -> dict:
+    if sx != 1.0 or sy != 1.0:
+        _scale_lines(entry['lines'], sx, sy)
+        if entry.get('highlight'):
+            _scale_lines(entry['highlight']['lines'], sx, sy)
+        entry['width'], entry['height'] = width, height
+    return entry
+
+def _upload_body_limit(scope) -> int:
+    # Лимит всего тела запроса с загрузкой: по Content-Length сразу, иначе — по мере приёма (ingest.BodyLimitMiddleware)
+    if scope["method"] != "POST" or scope["path"] not in ("/ocr", "/ocr/batch", "/ocr/jobs") or not OCR_MAX_UPLOAD_BYTES:
+        return 0
+    parts = OCR_BATCH_MAX_IMAGES if scope["path"] == "/ocr/batch" else 1
+    # +64 КБ на заголовки multipart и поля формы
+    return OCR_MAX_UPLOAD_BYTES * parts + 64 * 1024
+
+app.add_middleware(BodyLimitMiddleware, limit_for=_upload_body_limit,
+                   detail=f"Файл больше {OCR_MAX_UPLOAD_MB:g} МБ", on_reject=INGEST.rejected)
+
+@app.middleware("http")
+async def track_requests(request, call_next):
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        with METRICS.inflight("inflight_requests"):
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Метка — шаблон маршрута (/ocr/jobs/{job_id}), а не путь: иначе по серии на каждую задачу.
+        # У NDJSON-ответа /ocr/batch это время до начала потока, картинки — в ocr_stage_seconds
+        endpoint = getattr(request.scope.get("route"), "path", "other")
+        METRICS.inc("requests_total", endpoint=endpoint, method=request.method, status=str(status))
+        METRICS.observe("request_seconds", time.perf_counter() - t0, endpoint=endpoint)
 
 @app.get('/check')
 def check():
     return {'status': 'ok'}
 
-@app.post('/ocr')
-async def ocr(image: UploadFile = File(...), focus: str = Form('full')):
-    if not image.content_type or not image.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail='Field "image" должен быть картинкой (image/*)')
+@app.get('/ready')
+def ready():
+    if OCR_POOL.ready:
+        return {'status': 'ready', 'ready_s': OCR_POOL.ready_s, 'workers': OCR_POOL.workers}
+    status = 'error' if MODEL_LOAD_ERROR else 'loading'
+    return JSONResponse(status_code=503, headers={"Retry-After": str(OCR_RETRY_AFTER)},
+                        content={'status': status, 'error': MODEL_LOAD_ERROR})
 
-    content = await image.read()
-    if not content:
-        raise HTTPException(status_code=400, detail="Файл пустой")
+def make_sched(focus: str, priority: Optional[str] = None, source: Optional[str] = None,
+               deadline_ms: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Параметры планировщика для pool.submit(): класс приоритета, источник и дедлайн
+    (отсчитывается от прихода запроса). 400 на неизвестный priority.
+    """
+    if priority and priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f'Field "priority" должен быть одним из: {", ".join(PRIORITIES)}')
+    if deadline_ms is not None and deadline_ms < 0:
+        raise HTTPException(status_code=400, detail='Field "deadline_ms" не может быть отрицательным')
+    source = (source or "").strip()[:64] or None
+    priority = priority or OCR_SOURCE_PRIORITY.get(source or "") or OCR_FOCUS_PRIORITY.get(focus) or "normal"
+    if deadline_ms is None:
+        deadline_ms = OCR_QUEUE_DEADLINE_MS
+    return {
+        'priority': priority if priority in PRIORITIES else "normal",
+        'source': source,
+        'deadline': time.perf_counter() + deadline_ms / 1000.0 if deadline_ms else None,
+    }
 
-    # Имя и путь для сохранения (PNG в ./downloads)
-    safe_stem = _safe_stem(image.filename or "upload")
-    ts = int(time.time() * 1000)
-    filename = f"{safe_stem}_{ts}.png"
-    save_path = DOWNLOAD_DIR / filename
+async def submit_ocr(img_bgr, queue_wait_s: float = 0.0, pool=None, sched: Optional[Dict[str, Any]] = None):
+    """
+    Ставит картинку в пул (по умолчанию OCR_POOL); 503 с Retry-After, если модели
+    не готовы или очередь полна. queue_wait_s > 0 — при полной очереди подождать места
+    (но не дольше дедлайна запроса). sched — из make_sched().
+    """
+    pool = pool or OCR_POOL
+    sched = sched or {}
+    if not pool.ready:
+        raise HTTPException(status_code=503, detail="Модели OCR ещё загружаются",
+                            headers={"Retry-After": str(OCR_RETRY_AFTER)})
+    deadline = time.perf_counter() + queue_wait_s
+    if sched.get('deadline') is not None:
+        deadline = min(deadline, sched['deadline'])
+    while True:
+        try:
+            return pool.submit(img_bgr, **sched)
+        except QueueFullError:
+            if time.perf_counter() >= deadline:
+                raise HTTPException(status_code=503, detail="OCR перегружен, повторите позже",
+                                    headers={"Retry-After": str(OCR_RETRY_AFTER)})
+        await asyncio.sleep(0.02)
 
-    # Декод и размеры
+async def submit_tiles(img_bgr: np.ndarray, tiles, queue_wait_s: float, sched: Optional[Dict[str, Any]] = None):
+    """Все тайлы картинки в пул; если места не хватило — уже поставленные отменяются."""
+    tickets = []
     try:
-        img_bgr = read_image_to_bgr(content)
-        h, w = img_bgr.shape[:2]
-        width, height = w, h
-    except Exception as e:
-        try:
-            im = Image.open(io.BytesIO(content)).convert("RGB")
-            width, height = im.size
-            img_bgr = cv2.cvtColor(np.array(im), cv2.COLOR_RGB2BGR)
-        except Exception:
-            raise HTTPException(status_code=400, detail=f"Не удалось декодировать изображение: {e}")
+        for x0, y0, x1, y1 in tiles:
+            tickets.append(await submit_ocr(np.ascontiguousarray(img_bgr[y0:y1, x0:x1]), queue_wait_s, sched=sched))
+    except BaseException:
+        for t in tickets:
+            t.future.cancel()
+        raise
+    return tickets
 
-    # Сохраняем PNG в ./downloads
-    ok, buf = cv2.imencode('.png', img_bgr)
-    if not ok:
-        raise HTTPException(status_code=500, detail="Не удалось перекодировать в PNG")
+async def await_tickets(tickets, timer: Optional[StageTimer] = None, stage: str = "infer"):
+    """
+    Результаты задач пула; снятые планировщиком (дедлайн, вытеснение) — 503 с Retry-After.
+    В timer — ожидание в очереди и инференс по замерам пула (худший из тикетов).
+    """
     try:
-        with open(save_path, "wb") as f:
-            f.write(buf.tobytes())
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Не удалось сохранить PNG: {e}")
+        preds = await asyncio.gather(*(asyncio.wrap_future(t.future) for t in tickets))
+    except (DeadlineExceededError, QueueFullError) as e:
+        for t in tickets:
+            t.future.cancel()
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(OCR_RETRY_AFTER)})
+    if timer is not None:
+        timer.add("queue_wait", max(t.wait_ms or 0.0 for t in tickets) / 1000.0)
+        timer.add(stage, max(t.infer_ms or 0.0 for t in tickets) / 1000.0)
+    return preds
+
+METRICS.describe("stage_seconds", "histogram", "Время этапа обработки картинки (stage: ingest, decode, infer, ...)")
+METRICS.describe("request_seconds", "histogram", "Время HTTP-запроса по маршрутам")
+METRICS.describe("images_total", "counter", "Картинки по пути получения результата (result) и focus")
+METRICS.describe("image_bytes_total", "counter", "Байты принятых картинок")
+METRICS.describe("lines_total", "counter", "Строки текста в ответах")
+METRICS.describe("response_bytes_total", "counter", "Байты тел ответов /ocr и /ocr/batch по схеме (schema)")
+METRICS.describe("inflight_requests", "gauge", "HTTP-запросы в работе")
+METRICS.describe("inflight_images", "gauge", "Картинки в обработке")
+
+@METRICS.collector
+def _collect_service():
+    # Значения, которые и так считают пулы/кэш/очереди, — берутся из их stats() в момент опроса
+    rows = [("models_ready", "gauge", int(OCR_POOL.ready), None),
+            ("models_ready_seconds", "gauge", OCR_POOL.ready_s, None)]
+    for pool in (OCR_POOL, REC_POOL):
+        if pool is None:
+            continue
+        st = pool.stats()
+        lbl = {'pool': pool.name}
+        rows += [("pool_queue_depth", "gauge", st['queue_depth'], lbl),
+                 ("pool_batches_total", "counter", st['batches'], lbl),
+                 ("pool_images_total", "counter", st['images'], lbl)]
+        for prio, c in st['scheduler']['classes'].items():
+            cl = dict(lbl, priority=prio)
+            rows.append(("queue_class_depth", "gauge", c['depth'], cl))
+            rows += [(f"queue_{k}_total", "counter", c[k], cl)
+                     for k in ("enqueued", "served", "rejected", "evicted", "expired")]
+            if c['p95_wait_ms'] is not None:
+                rows.append(("queue_wait_p95_seconds", "gauge", c['p95_wait_ms'] / 1000.0, cl))
+    cache = OCR_CACHE.stats()
+    rows += [("cache_entries", "gauge", cache['entries'], None)]
+    rows += [(f"cache_{k}_total", "counter", cache[k], None) for k in ("hits", "misses", "disk_hits", "evictions")]
+    ingest = INGEST.stats()
+    rows += [("uploads_too_large_total", "counter", ingest['too_large'], None),
+             ("upload_peak_bytes_max", "gauge", ingest['peak_bytes_max'], None)]
+    archive = ARCHIVE.stats()
+    rows += [(f"archive_{k}", "gauge", archive[k], None) for k in ("queue_depth", "files", "bytes")]
+    rows += [(f"archive_{k}_total", "counter", archive[k], None)
+             for k in ("written", "deduplicated", "evicted", "dropped", "errors")]
+    layout = LAYOUTS.stats()
+    rows += [(f"layout_{k}_total", "counter", layout[k], None) for k in ("hits", "misses", "fallbacks")]
+    for status, n in JOBS.stats()['counts'].items():
+        rows.append(("jobs", "gauge", n, {'status': status}))
+    return rows
+
+@app.get('/metrics')
+def metrics():
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get('/archive')
+def archive_lookup(digest: Optional[str] = None, filename: Optional[str] = None, limit: int = 50):
+    """Файлы архива загрузок по sha256 содержимого или по исходному имени файла."""
+    if not digest and not filename:
+        raise HTTPException(status_code=400, detail='Нужен параметр "digest" или "filename"')
+    files = ARCHIVE.lookup(digest, filename, limit)
+    for f in files:
+        f['saved_relpath'] = str(Path("downloads") / f['path'])
+    return {'status': 'ok', 'files': files}
 
-    # Путь к файлу для PaddleOCR.predict
-    image_path_for_predict = save_path.as_posix()
+@app.get('/stats')
+def stats():
+    return {'status': 'ok', 'backend': {'name': OCR_BACKEND, 'int8': OCR_ONNX_INT8},
+            'pool': OCR_POOL.stats(), 'cache': OCR_CACHE.stats(), 'ingest': INGEST.stats(),
+            'phash': {'entries': len(PHASH_INDEX), 'max_dist': OCR_PHASH_MAX_DIST,
+                      'max_thumb_diff': OCR_PHASH_MAX_THUMB_DIFF},
+            'layout': dict(LAYOUTS.stats(), rec_pool=REC_POOL.stats() if REC_POOL is not None else None),
+            'archive': ARCHIVE.stats(), 'jobs': JOBS.stats(), 'profiler': PROFILER.stats()}
+
+async def process_image(upload: Upload, focus: str, queue_wait_s: float = 0.0,
+                        det_side: Optional[int] = None, tiling: str = "auto",
+                        sched: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Весь путь одной картинки: кэш -> декод -> уменьшение или тайлы -> инференс -> разбор -> обводка.
+    Возвращает payload ответа /ocr (его же построчно отдаёт /ocr/batch).
+    Байты загрузки и кадр отпускаются, как только перестают быть нужны.
+    det_side — длинная сторона для детекции из запроса (None — как настроен сервер);
+    tiling — auto | on | off, с тайлами det_side не используется;
+    sched — приоритет, источник и дедлайн для очереди пула (make_sched).
+    """
+    result = "error"
     try:
-        pred = OCR.predict(input=image_path_for_predict)
-    except Exception:
-        pred = OCR.predict(img_bgr)
+        with METRICS.inflight("inflight_images"):
+            payload = await _process_image(upload, focus, queue_wait_s, det_side, tiling, sched)
+        result = _image_result(payload)
+        METRICS.inc("lines_total", len(payload['ocr']['boxes']))
+        return payload
+    finally:
+        upload.release()
+        INGEST.record(upload.ledger)
+        METRICS.inc("images_total", result=result, focus=focus)
+        METRICS.inc("image_bytes_total", upload.size)
+        METRICS.record(upload.timer)
+
+def _image_result(payload: Dict[str, Any]) -> str:
+    # Каким путём получен результат — метка для ocr_images_total
+    if payload['cached']:
+        return "near_duplicate" if payload['phash_distance'] is not None else "cached"
+    if payload.get('layout'):
+        return "layout"
+    if payload.get('regions'):
+        return "regions"
+    return "tiled" if payload.get('tiles', 1) > 1 else "ocr"
 
-    lines, full_text = parse_predict_result(pred)
+def validate_options(focus: str, det_side: Optional[int], tiling: str, response_schema: str = "full"):
+    if focus not in FOCUS_MODES:
+        raise HTTPException(status_code=400, detail=f'Field "focus" должен быть одним из: {", ".join(FOCUS_MODES)}')
+    if det_side is not None and 0 < det_side < 64:
+        raise HTTPException(status_code=400, detail='Field "det_side": 0 (без уменьшения) или не меньше 64')
+    if tiling not in TILING_MODES:
+        raise HTTPException(status_code=400, detail=f'Field "tiling" должен быть одним из: {", ".join(TILING_MODES)}')
+    if response_schema not in SCHEMAS:
+        raise HTTPException(status_code=400, detail=f'Field "response_schema" должен быть одним из: {", ".join(SCHEMAS)}')
 
+def _queue_info(tickets) -> Dict[str, Any]:
+    # Для тайлов — худший из тайлов: ответ готов, когда готов последний
+    return {
+        'depth': tickets[0].queue_depth,
+        'wait_ms': max(t.wait_ms or 0.0 for t in tickets),
+        'infer_ms': max(t.infer_ms or 0.0 for t in tickets),
+        'batch_size': max(t.batch_size or 0 for t in tickets),
+        'priority': tickets[0].priority,
+        'source': tickets[0].source,
+        'workers': OCR_POOL.workers,
+        'tiles': len(tickets)
+    }
+
+async def region_ocr(upload: Upload, img_bgr: np.ndarray, queue_wait_s: float, sched: Optional[Dict[str, Any]]):
+    """
+    Режим «сначала обводка»: OCR только вырезок с пометками, одним заходом в пул.
+    Возвращает (entry, queue_info); пустой entry['regions'] — пометок или текста в них
+    нет, нужен полный OCR (такая запись тоже кэшируется, чтобы не искать снова).
+    """
+    height, width = img_bgr.shape[:2]
+    entry = {'width': width, 'height': height, 'regions': []}
+    with upload.timer.stage("regions"):
+        regions = await run_in_threadpool(highlight_regions, img_bgr, OCR_HIGHLIGHT_MAX_SIDE)
+    if not regions:
+        return entry, None
+    tickets = await submit_tiles(img_bgr, regions, max(queue_wait_s, OCR_BATCH_QUEUE_WAIT_S), sched)
+    preds = await await_tickets(tickets, upload.timer)
+    with upload.timer.stage("parse"):
+        lines, full_text = merge_tiles([
+            (parse_predict_result([pred], score_thresh=OCR_SCORE_THRESH)[0], x0, y0)
+            for pred, (x0, y0, _, _) in zip(preds, regions)])
+    if not lines:
+        return entry, None
+    entry.update({
+        'saved_filename': ARCHIVE.submit(upload.data, img_bgr, upload.filename, upload.content_type, upload.digest),
+        'det_side': max(max(x1 - x0, y1 - y0) for x0, y0, x1, y1 in regions),
+        'tiles': len(regions),
+        'regions': [list(r) for r in regions],
+        'lines': lines,
+        'full_text': full_text,
+        # Весь распознанный текст и есть выделенный
+        'highlight': {'highlighted_text': full_text, 'mask_present': True, 'lines': lines},
+    })
+    return entry, _queue_info(tickets)
+
+async def layout_ocr(img_bgr: np.ndarray, ph: Optional[int], queue_wait_s: float, sched: Optional[Dict[str, Any]],
+                     timer: StageTimer):
+    """
+    Быстрый путь по шаблону раскладки: строки режутся по боксам шаблона, работает
+    только распознаватель. Возвращает (ticket, lines, full_text, layout) или None —
+    шаблона нет, распознаватель занят или снял задачу (дедлайн, вытеснение), средняя
+    уверенность ниже OCR_LAYOUT_MIN_CONF или худшая строка ниже OCR_LAYOUT_MIN_LINE_CONF.
+    """
+    height, width = img_bgr.shape[:2]
+    tpl = LAYOUTS.match(ph, width, height)
+    if tpl is None:
+        return None
+    tkey, boxes, dist = tpl
+    with timer.stage("layout_crop"):
+        crops = await run_in_threadpool(lambda: [crop_quad(img_bgr, b) for b in boxes])
+    try:
+        ticket = await submit_ocr(crops, queue_wait_s, pool=REC_POOL, sched=sched)
+        texts, scores = (await await_tickets([ticket], timer, "rec"))[0]
+    except HTTPException:
+        return None
+    mean_conf = float(np.mean(scores)) if scores else 0.0
+    min_conf = float(np.min(scores)) if scores else 0.0
+    if mean_conf < OCR_LAYOUT_MIN_CONF or min_conf < OCR_LAYOUT_MIN_LINE_CONF:
+        LAYOUTS.rejected()
+        return None
+    lines, full_text = parse_predict_result([{'rec_texts': texts, 'rec_scores': scores, 'rec_polys': boxes}],
+                                            score_thresh=OCR_SCORE_THRESH)
+    return ticket, lines, full_text, {'template': tkey[:16], 'distance': dist, 'mean_conf': round(mean_conf, 4),
+                                      'min_conf': round(min_conf, 4)}
+
+async def _process_image(upload: Upload, focus: str, queue_wait_s: float,
+                         det_side: Optional[int], tiling: str, sched: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # Свои параметры из запроса — другой результат, поэтому и своя запись кэша (в индекс dHash не идёт)
+    params = {}
+    if det_side is not None:
+        params['det_side'] = max(det_side, 0)
+    if tiling != "auto":
+        params['tiling'] = tiling
+    key = OCR_CACHE.variant(upload.key, **params) if params else upload.key
+    ledger = upload.ledger
+    timer = upload.timer
+    need_highlight = focus in ("highlight", "both")
+    entry = None
+    cached = False
+    img_bgr = None
+    ph = None
+    thumb = None
+    phash_distance = None
+    queue_info = None
+    saved_filename = None
+
+    if focus == "highlight" and OCR_HIGHLIGHT_FIRST and tiling != "on":
+        rkey = OCR_CACHE.variant(upload.key, regions=True, **params)
+        with timer.stage("cache"):
+            rentry = OCR_CACHE.get(rkey)
+        rcached = rentry is not None
+        if rentry is None:
+            with timer.stage("decode"):
+                img_bgr = decode_upload(upload.data, ledger)
+            rentry, queue_info = await region_ocr(upload, img_bgr, queue_wait_s, sched)
+            OCR_CACHE.put(rkey, rentry)
+        if rentry['regions']:
+            entry, cached = rentry, rcached
+            saved_filename = None if rcached else rentry.get('saved_filename')
+
+    if entry is None:
+        with timer.stage("cache"):
+            entry = OCR_CACHE.get(key)
+        if entry is None:
+            if img_bgr is None:
+                with timer.stage("decode"):
+                    img_bgr = decode_upload(upload.data, ledger)
+            height, width = img_bgr.shape[:2]
+            if OCR_PHASH_MAX_DIST >= 0 and not params:
+                with timer.stage("phash"):
+                    ph = dhash(img_bgr)
+                    entry, phash_distance = near_duplicate_entry(img_bgr, ph)
+                    # Миниатюра для сверки будущих почти-дубликатов — пока кадр ещё в памяти
+                    thumb = thumbnail(img_bgr) if ph is not None and entry is None else None
+                if entry is not None:
+                    OCR_CACHE.put(key, entry)
+        cached = entry is not None
+
+    if entry is None:
+        tiles = None
+        fast = None
+        use_layout = not params and LAYOUTS.enabled and REC_POOL.ready
+        with timer.stage("phash"):
+            lph = (ph if ph is not None else dhash(img_bgr)) if use_layout else None
+        if tiling == "on" or (tiling == "auto" and should_tile(height, width, OCR_TILE_SIDE, OCR_TILE_MIN_ASPECT)):
+            # Тайлы в родном разрешении; ждать места в очереди — как батчу, тайлов больше, чем её размер
+            tiles = plan_tiles(height, width, OCR_TILE_SIDE, OCR_TILE_OVERLAP)
+            tickets = await submit_tiles(img_bgr, tiles, max(queue_wait_s, OCR_BATCH_QUEUE_WAIT_S), sched)
+            det_side_used = max(max(x1 - x0, y1 - y0) for x0, y0, x1, y1 in tiles)
+        else:
+            if use_layout:
+                fast = await layout_ocr(img_bgr, lph, queue_wait_s, sched, timer)
+        if fast is not None:
+            tickets = [fast[0]]
+            det_side_used = None
+        elif tiles is None:
+            side = det_side if det_side is not None else (None if OCR_PRESCALE else 0)
+            with timer.stage("prescale"):
+                det_img, _ = prescale(img_bgr, OCR_DET_LIMIT_SIDE_LEN, side, OCR_PRESCALE_MIN_SIDE)
+            if det_img is not img_bgr:
+                ledger.hold("prescaled", det_img.nbytes)
+            det_h, det_w = det_img.shape[:2]
+            det_side_used = max(det_w, det_h)
+            # Инференс в пуле воркеров, event loop не блокируется
+            tickets = [await submit_ocr(det_img, queue_wait_s, sched=sched)]
+            det_img = None
+
+        with timer.stage("archive_submit"):
+            saved_filename = ARCHIVE.submit(upload.data, img_bgr, upload.filename, upload.content_type,
+                                            upload.digest)
+        upload.release()
+        if not need_highlight:
+            # Кадр остался только у пула — после инференса он освободится
+            img_bgr = None
+        preds = await await_tickets(tickets, timer) if fast is None else None
+        ledger.release("prescaled")
+        if img_bgr is None:
+            ledger.release("decoded")
+        queue_info = _queue_info(tickets)
+
+        with timer.stage("parse"):
+            if fast is not None:
+                _, lines, full_text, _ = fast
+            elif tiles:
+                lines, full_text = merge_tiles([
+                    (parse_predict_result([pred], score_thresh=OCR_SCORE_THRESH)[0], x0, y0)
+                    for pred, (x0, y0, _, _) in zip(preds, tiles)])
+            else:
+                lines, full_text = parse_predict_result([preds[0]], score_thresh=OCR_SCORE_THRESH)
+                # Боксы — в координатах загруженной картинки
+                unscale_lines(lines, det_w / width, det_h / height)
+        entry = {
+            'saved_filename': saved_filename,
+            'width': width,
+            'height': height,
+            'det_side': det_side_used,
+            'tiles': len(tickets),
+            'layout': fast[3] if fast is not None else None,
+            'lines': lines,
+            'full_text': full_text,
+        }
+        if thumb is not None:
+            entry['thumb'] = thumb
+        OCR_CACHE.put(key, entry)
+        if ph is not None:
+            PHASH_INDEX.add(ph, key)
+        if use_layout and fast is None and tiles is None:
+            # Полный OCR без тайлов — его боксы становятся шаблоном для похожих картинок
+            LAYOUTS.add(lph, OCR_CACHE.variant(key, layout=True), width, height,
+                        [ln['box'] for ln in lines if ln['box'] is not None])
+    elif cached:
+        # Повтор (кэш или почти-дубликат): в архиве отмечается именно эта загрузка — last_seen, hits и имя
+        # для LRU, а в ответ идёт её путь, а не сохранённый в записи путь первой загрузки (или другой картинки)
+        with timer.stage("archive_submit"):
+            saved_filename = ARCHIVE.submit(upload.data, img_bgr, upload.filename, upload.content_type,
+                                            upload.digest)
+
+    lines = entry['lines']
     highlighted_text = ""
     mask_present = False
-    if focus == "highlight" and lines:
-        mask = mask_highlight(img_bgr)
-        mask_present = bool(np.any(mask > 0))
-        filtered = []
-        for ln in lines:
-            if ln["box"] is None:
-                continue
-            ov = iou_with_mask(ln["box"], mask)
-            if ov >= 0.28:
-                ln["overlap"] = ov
-                filtered.append(ln)
-        if not filtered and mask_present:
-            ys, xs = np.where(mask > 0)
-            if len(xs):
-                m_center = np.array([np.mean(xs), np.mean(ys)])
-                def center(bx):
-                    p = np.array(bx); return np.mean(p, axis=0)
-                filtered = sorted(
-                    [ln for ln in lines if ln["box"] is not None],
-                    key=lambda ln: np.linalg.norm(center(ln["box"]) - m_center)
-                )[:1]
-        highlighted_text = " ".join([ln["text"] for ln in filtered]).strip()
+    if need_highlight and lines:
+        hl = entry.get('highlight')
+        if hl is None:
+            if img_bgr is None:
+                with timer.stage("decode"):
+                    img_bgr = await run_in_threadpool(decode_upload, upload.data, ledger)
+                upload.release()
+            # highlight_filter дописывает строкам overlap — на копиях, строки entry['lines'] отдаёт и focus=full
+            lines = [dict(ln) for ln in lines]
+            highlighted_text, mask_present = await run_in_threadpool(
+                highlight_filter, img_bgr, lines, OCR_HIGHLIGHT_MAX_SIDE, OCR_HIGHLIGHT_ROI, timer)
+            # Результат обводки дописываем в запись — повтор с highlight тоже будет мгновенным
+            entry['highlight'] = {'highlighted_text': highlighted_text, 'mask_present': mask_present, 'lines': lines}
+            OCR_CACHE.put(key, entry)
+        else:
+            highlighted_text, mask_present, lines = hl['highlighted_text'], hl['mask_present'], hl['lines']
 
     payload = {
         'status': 'ok',
-        'filename': image.filename,
-        'saved_filename': filename,
-        'saved_relpath': str(Path("downloads") / filename),
-        'content_type': "image/png",
-        'size_bytes': (save_path.stat().st_size if save_path.exists() else None),
-        'width': width,
-        'height': height,
+        'filename': upload.filename,
+        'saved_filename': saved_filename,
+        'saved_relpath': str(Path("downloads") / saved_filename) if saved_filename else None,
+        'content_type': upload.content_type,
+        'size_bytes': upload.size,
+        'width': entry['width'],
+        'height': entry['height'],
         'focus': focus,
+        'det_side': entry.get('det_side'),
+        'tiles': entry.get('tiles', 1),
+        'regions': entry.get('regions'),
+        'layout': entry.get('layout'),
+        'cached': cached,
+        'phash_distance': phash_distance,
         'ocr': {
-            'full_text': full_text,
+            'full_text': entry['full_text'],
             'highlighted_text': highlighted_text,
             'mask_present': mask_present,
             'boxes': lines
-        }
+        },
+        'queue': queue_info,
+        'memory': ledger.as_dict()
     }
-    return JSONResponse(content=jsonable_encoder(payload))
+    return payload
+
+@app.post('/ocr')
+async def ocr(request: Request, image: UploadFile = File(...), focus: str = Form('full'),
+              det_side: Optional[int] = Form(None), tiling: str = Form('auto'), priority: Optional[str] = Form(None),
+              source: Optional[str] = Form(None), deadline_ms: Optional[float] = Form(None),
+              timings: Optional[bool] = Form(None), response_schema: str = Form('full'),
+              include_boxes: bool = Form(True)):
+    started = time.perf_counter()
+    reason = PROFILER.reason(request.headers.get(PROFILE_HEADER))
+    if not image.content_type or not image.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail='Field "image" должен быть картинкой (image/*)')
+    validate_options(focus, det_side, tiling, response_schema)
+    sched = make_sched(focus, priority, source, deadline_ms)
+
+    upload = await ingest_upload(image)
+    if not upload.size:
+        raise HTTPException(status_code=400, detail="Файл пустой")
+
+    # Для сохранения входа ссылка на байты держится до конца запроса, хотя пайплайн их уже отпустил
+    content = upload.data if (PROFILER.enabled and OCR_PROFILE_SAVE_INPUT) else None
+    payload = await process_image(upload, focus, det_side=det_side, tiling=tiling, sched=sched)
+    if OCR_RESPONSE_TIMINGS if timings is None else timings:
+        payload['timings'] = upload.timer.as_dict()
+    t0 = time.perf_counter()
+    response = FastJSONResponse(content=shape_payload(payload, response_schema, include_boxes))
+    METRICS.observe("stage_seconds", time.perf_counter() - t0, stage="serialize")
+    METRICS.inc("response_bytes_total", len(response.body), schema=response_schema)
+
+    finished = time.perf_counter()
+    if reason or PROFILER.is_slow((finished - started) * 1000):
+        options = {'focus': focus, 'det_side': det_side, 'tiling': tiling,
+                   'priority': sched['priority'], 'source': sched['source'],
+                   'response_schema': response_schema, 'include_boxes': include_boxes}
+        cid = await run_in_threadpool(PROFILER.capture, started, finished, reason or "slow",
+                                      capture_meta(upload, payload, options), content,
+                                      Path(upload.filename or "").suffix.lstrip(".").lower() or "bin")
+        response.headers["X-OCR-Profile-Id"] = cid
+    return response
+
+def capture_meta(upload: Upload, payload: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
+    """Что сохранить о запросе рядом с профилем: чем воспроизвести и где искать время."""
+    return {
+        'endpoint': '/ocr',
+        # sha256 самих байтов (имя в архиве, /archive?digest=); upload.key — ключ кэша, солёный настройками
+        'digest': upload.digest,
+        'filename': upload.filename,
+        'content_type': upload.content_type,
+        'size_bytes': upload.size,
+        'saved_relpath': payload['saved_relpath'],
+        'width': payload['width'],
+        'height': payload['height'],
+        'lines': len(payload['ocr']['boxes']),
+        'cached': payload['cached'],
+        'tiles': payload['tiles'],
+        'options': options,
+        'timings': upload.timer.as_dict(),
+        'queue': payload['queue'],
+        'memory': payload['memory'],
+    }
+
+@app.get('/profiles')
+def profiles(limit: int = 50):
+    """Последние сохранённые запросы (медленные, по доле и по заголовку), новые — первыми."""
+    return {'status': 'ok', 'profiler': PROFILER.stats(), 'captures': PROFILER.recent(limit)}
+
+@app.get('/profiles/{capture_id}')
+def profile_folded(capture_id: str):
+    """Профиль в формате collapsed stacks (flamegraph.pl, speedscope)."""
+    path = PROFILER.folded_path(capture_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return PlainTextResponse(path.read_text(encoding="utf-8"))
+
+async def _read_part(image: UploadFile):
+    # Ошибку чтения части (413) отдаём строкой этой части, а не всему запросу
+    try:
+        return await ingest_upload(image)
+    except HTTPException as e:
+        return e
+
+async def _batch_item(index: int, part, filename: Optional[str], content_type: Optional[str],
+                      focus: str, det_side: Optional[int], tiling: str, sched: Dict[str, Any],
+                      timings: bool, schema: str, include_boxes: bool) -> bytes:
+    try:
+        if isinstance(part, HTTPException):
+            raise part
+        if not content_type or not content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail='Часть "image" должна быть картинкой (image/*)')
+        if not part.size:
+            raise HTTPException(status_code=400, detail="Файл пустой")
+        payload = await process_image(part, focus, OCR_BATCH_QUEUE_WAIT_S, det_side, tiling, sched)
+        if timings:
+            payload['timings'] = part.timer.as_dict()
+    except HTTPException as e:
+        payload = {'status': 'error', 'status_code': e.status_code, 'detail': e.detail, 'filename': filename}
+    except Exception as e:
+        log.exception("OCR: ошибка при обработке %s", filename)
+        payload = {'status': 'error', 'status_code': 500, 'detail': f"{type(e).__name__}: {e}",
+                   'filename': filename}
+    finally:
+        if isinstance(part, Upload):
+            part.release()
+    payload['index'] = index
+    t0 = time.perf_counter()
+    body = dumps(shape_payload(payload, schema, include_boxes) if payload['status'] == 'ok' else payload) + b"\n"
+    METRICS.observe("stage_seconds", time.perf_counter() - t0, stage="serialize")
+    METRICS.inc("response_bytes_total", len(body), schema=schema)
+    return body
+
+@app.post('/ocr/batch')
+async def ocr_batch(image: List[UploadFile] = File(...), focus: str = Form('full'),
+                    det_side: Optional[int] = Form(None), tiling: str = Form('auto'),
+                    priority: Optional[str] = Form(None), source: Optional[str] = Form(None),
+                    deadline_ms: Optional[float] = Form(None), timings: Optional[bool] = Form(None),
+                    response_schema: str = Form('full'), include_boxes: bool = Form(True)):
+    """
+    Альбом одним запросом: несколько частей "image". Картинки уходят в пул
+    разом (и склеиваются в батчи), ответ — NDJSON, по строке на картинку в
+    порядке готовности; "index" — номер части в запросе. Ошибка одной
+    картинки не роняет остальные: её строка со status='error'.
+    """
+    validate_options(focus, det_side, tiling, response_schema)
+    sched = make_sched(focus, priority, source, deadline_ms)
+    with_timings = OCR_RESPONSE_TIMINGS if timings is None else timings
+    if len(image) > OCR_BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"Не больше {OCR_BATCH_MAX_IMAGES} картинок за запрос")
+
+    # Читаем части до начала ответа: после return файлы формы закрываются
+    parts = [(await _read_part(im), im.filename, im.content_type) for im in image]
+
+    async def stream():
+        tasks = [asyncio.ensure_future(_batch_item(i, p, fn, ct, focus, det_side, tiling, sched, with_timings,
+                                                   response_schema, include_boxes))
+                 for i, (p, fn, ct) in enumerate(parts)]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post('/ocr/jobs')
+async def ocr_job(image: UploadFile = File(...), focus: str = Form('full'), det_side: Optional[int] = Form(None),
+                  tiling: str = Form('auto'), callback_url: Optional[str] = Form(None),
+                  priority: Optional[str] = Form(None), source: Optional[str] = Form(None)):
+    """
+    Ставит картинку в очередь и сразу отвечает 202 с job_id. Результат (тот же
+    payload, что у /ocr) — GET /ocr/jobs/{job_id}; если задан callback_url, туда
+    POST-ом придёт то же самое, когда задача закончится.
+    """
+    if not image.content_type or not image.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail='Field "image" должен быть картинкой (image/*)')
+    validate_options(focus, det_side, tiling)
+    make_sched(focus, priority, source)
+    if callback_url:
+        try:
+            await run_in_threadpool(check_callback_url, callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f'Field "callback_url": {e}')
+
+    upload = await ingest_upload(image)
+    if not upload.size:
+        raise HTTPException(status_code=400, detail="Файл пустой")
+    options = {'focus': focus, 'det_side': det_side, 'tiling': tiling, 'priority': priority, 'source': source}
+    job_id = await run_in_threadpool(JOBS.enqueue, upload.data, upload.filename, upload.content_type,
+                                     options, callback_url or None)
+    upload.release()
+    JOBS_WAKEUP.set()
+    return JSONResponse(status_code=202, content={'status': 'queued', 'job_id': job_id,
+                                                  'status_url': f"/ocr/jobs/{job_id}"})
+
+@app.get('/ocr/jobs/{job_id}')
+def ocr_job_status(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+def check_callback_url(url: str):
+    """ValueError, если на url нельзя слать callback (см. OCR_JOBS_CALLBACK_HOSTS). Резолвит хост — блокирует."""
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("должен быть http(s) URL")
+    host = parts.hostname.lower()
+    if OCR_JOBS_CALLBACK_HOSTS:
+        if host not in OCR_JOBS_CALLBACK_HOSTS:
+            raise ValueError(f"хост {host} не входит в OCR_JOBS_CALLBACK_HOSTS")
+        return
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (ValueError, OSError) as e:
+        raise ValueError(f"хост {host} не резолвится: {e}")
+    for info in infos:
+        addr = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not addr.is_global:
+            raise ValueError(f"хост {host} указывает на внутренний адрес {addr}")
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Редирект мог бы увести callback на внутренний адрес в обход check_callback_url — 3xx считаем ошибкой
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+_CALLBACK_OPENER = urllib.request.build_opener(_NoRedirect)
+
+def _post_json(url: str, body: dict, timeout: float) -> int:
+    # Адрес проверяется ещё раз перед отправкой: DNS хоста мог поменяться с момента постановки задачи
+    check_callback_url(url)
+    req = urllib.request.Request(url, data=json.dumps(body, ensure_ascii=False).encode("utf-8"),
+                                 headers={'Content-Type': 'application/json'}, method='POST')
+    with _CALLBACK_OPENER.open(req, timeout=timeout) as r:
+        return r.status
+
+async def notify_callback(job_id: str, url: str, attempts: int = 3):
+    view = await run_in_threadpool(JOBS.get, job_id)
+    status = None
+    for i in range(attempts):
+        try:
+            status = str(await run_in_threadpool(_post_json, url, view, OCR_JOBS_CALLBACK_TIMEOUT_S))
+            break
+        except ValueError as e:
+            # Адрес запрещён — повтор не поможет
+            status = f"отклонён: {e}"
+            break
+        except Exception as e:
+            status = f"{type(e).__name__}: {e}"
+            if i + 1 < attempts:
+                await asyncio.sleep(2 ** i)
+    if not (status or "").isdigit():
+        log.warning("OCR: callback задачи %s не доставлен: %s", job_id, status)
+    await run_in_threadpool(JOBS.set_callback_status, job_id, status)
+
+# Ссылки на фоновые отправки callback: без них задачу может собрать сборщик мусора посреди отправки
+CALLBACK_TASKS = set()
+
+def _callback_done(task: asyncio.Task):
+    CALLBACK_TASKS.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        log.error("OCR: ошибка отправки callback", exc_info=task.exception())
+
+async def run_job(job: dict):
+    opts = job['options']
+    retry = False
+    # False — пока задача шла, аренда истекла и её забрал другой воркер: результат и callback — его
+    owned = True
+    try:
+        data = await run_in_threadpool(JOBS.read_data, job['id'])
+        digest = hashlib.sha256(data).hexdigest()
+        upload = Upload(bytearray(data), OCR_CACHE.key_for(digest), job['filename'], job['content_type'],
+                        MemoryLedger(), digest=digest)
+        del data
+        # Задача и так ждала в очереди задач — дедлайна у неё нет
+        sched = make_sched(opts['focus'], opts.get('priority'), opts.get('source'), 0)
+        payload = await process_image(upload, opts['focus'], OCR_BATCH_QUEUE_WAIT_S,
+                                      opts.get('det_side'), opts.get('tiling', 'auto'), sched)
+        owned = await run_in_threadpool(JOBS.finish, job, dumps(payload).decode("utf-8"))
+    except asyncio.CancelledError:
+        # Сервис останавливается — задачу обратно в очередь, её доделает следующий запуск.
+        # SQLite — не в event loop, как и остальные вызовы JOBS
+        await run_in_threadpool(JOBS.fail, job, "прервано остановкой сервиса", True)
+        raise
+    except HTTPException as e:
+        # 503 (модели грузятся, очередь полна) — временно, задача вернётся в очередь
+        retry = e.status_code == 503
+        owned = await run_in_threadpool(JOBS.fail, job, str(e.detail), retry)
+    except Exception as e:
+        log.exception("OCR: ошибка задачи %s", job['id'])
+        owned = await run_in_threadpool(JOBS.fail, job, f"{type(e).__name__}: {e}")
+    if not owned:
+        log.warning("OCR: задачу %s за время работы забрал другой воркер, результат отброшен", job['id'])
+        return
+    if retry:
+        await asyncio.sleep(OCR_RETRY_AFTER)
+    if job['callback_url']:
+        view = await run_in_threadpool(JOBS.get, job['id'])
+        if view and view['status'] in ("done", "error"):
+            task = asyncio.ensure_future(notify_callback(job['id'], job['callback_url']))
+            CALLBACK_TASKS.add(task)
+            task.add_done_callback(_callback_done)
+
+async def job_worker(idx: int):
+    worker = f"{os.getpid()}-{idx}"
+    while True:
+        job = await run_in_threadpool(JOBS.claim, worker) if OCR_POOL.ready else None
+        if job is None:
+            JOBS_WAKEUP.clear()
+            try:
+                await asyncio.wait_for(JOBS_WAKEUP.wait(), OCR_JOBS_POLL_S)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await run_job(job)
+
+async def jobs_maintenance(period_s: float = 60.0):
+    while True:
+        try:
+            requeued = await run_in_threadpool(JOBS.requeue_stale)
+            if requeued:
+                log.warning("OCR: %d зависших задач возвращено в очередь", requeued)
+                JOBS_WAKEUP.set()
+            await run_in_threadpool(JOBS.purge)
+        except Exception:
+            log.exception("OCR: обслуживание очереди задач")
+        await asyncio.sleep(period_s)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("test_ocr:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # reload перезапускает процесс с загрузкой моделей на каждое сохранение — только по запросу
+    uvicorn.run("WK:app", host="0.0.0.0", port=8000, reload=os.getenv("OCR_RELOAD") == "1")
\ No newline at end of file
@@ -0,0 +1,386 @@
+"""
+Фоновый архив загруженных картинок.
+
+Запись в downloads/ не должна тормозить ответ /ocr: submit() только кладёт
+задачу в ограниченную очередь, кодирование и запись делает отдельный поток.
+Если очередь забита, картинка не архивируется (счётчик dropped) — ответ
+важнее архива.
+
+Файлы адресуются содержимым: имя — sha256 исходных байтов, раскладка по
+подкаталогам ab/cd/<sha256>.<ext>, чтобы ни в одном каталоге не копились
+миллионы файлов. Повтор той же картинки (репост) не пишется второй раз —
+у записи только обновляется last_seen. Индекс — index.sqlite3 рядом (WAL):
+поиск по хэшу и по исходному имени файла за один запрос по индексу.
+
+max_bytes — потолок размера архива: при превышении удаляются давно не
+виденные файлы (LRU по last_seen) до 90% потолка. max_age_s — файлы, не
+виденные дольше, удаляются при периодической уборке (раз в sweep_s).
+
+Форматы: original — исходные байты как пришли (без перекодирования),
+jpeg / png — перекодированный декодированный кадр.
+sample_rate — доля запросов, которые вообще попадают в архив.
+
+Старый плоский downloads/ ({stem}_{ts}.png) переносится в дерево командой
+    python archive.py downloads
+"""
+import hashlib
+import mimetypes
+import os
+import queue
+import random
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy as np
+import cv2
+
+ARCHIVE_FORMATS = ("original", "jpeg", "png")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    digest TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS files_last_seen ON files (last_seen);
+CREATE TABLE IF NOT EXISTS names (
+    filename TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (filename, digest)
+);
+CREATE INDEX IF NOT EXISTS names_digest ON names (digest);
+"""
+
+# Сигнатуры форматов: расширение по содержимому, а не по имени — у одних байтов всегда одно имя
+_MAGIC = ((b"\xff\xd8\xff", "jpg"), (b"\x89PNG\r\n\x1a\n", "png"), (b"GIF8", "gif"),
+          (b"BM", "bmp"), (b"II*\x00", "tif"), (b"MM\x00*", "tif"))
+
+
+def _original_ext(filename: Optional[str], content_type: Optional[str]) -> str:
+    ext = Path(filename).suffix.lower().lstrip(".") if filename else ""
+    if not ext and content_type:
+        guessed = mimetypes.guess_extension(content_type) or ""
+        ext = guessed.lstrip(".")
+    if ext in ("jpeg", "jpe"):
+        ext = "jpg"
+    return re.sub(r'[^a-z0-9]+', '', ext) or "bin"
+
+
+def _sniff_ext(content, filename: Optional[str], content_type: Optional[str]) -> str:
+    head = bytes(content[:12])
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for magic, ext in _MAGIC:
+        if head.startswith(magic):
+            return ext
+    return _original_ext(filename, content_type)
+
+
+def shard_path(digest: str, ext: str) -> str:
+    """Путь файла относительно корня архива: ab/cd/<digest>.<ext>."""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+
+
+class ArchiveWriter:
+    def __init__(self, root: Path, fmt: str = "original", sample_rate: float = 1.0,
+                 queue_size: int = 64, jpeg_quality: int = 90,
+                 on_timing: Optional[Callable[[str, float], None]] = None,
+                 max_bytes: int = 0, max_age_s: float = 0.0, sweep_s: float = 300.0):
+        """on_timing(stage, seconds) — время перекодирования и записи (для метрик)."""
+        if fmt not in ARCHIVE_FORMATS:
+            raise ValueError(f"Неизвестный формат архива: {fmt} (ожидается {', '.join(ARCHIVE_FORMATS)})")
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / "index.sqlite3"
+        self.fmt = fmt
+        self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+        self.jpeg_quality = int(jpeg_quality)
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_age_s = max(0.0, float(max_age_s))
+        self.sweep_s = max(1.0, float(sweep_s))
+        self._on_timing = on_timing
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._lock = threading.Lock()
+        # Своё соединение на поток: sqlite3 не любит делить его между потоками
+        self._local = threading.local()
+        with self._conn() as db:
+            db.executescript(_SCHEMA)
+        self.total_bytes, self.files = self._totals()
+        self.written = 0
+        self.deduplicated = 0
+        self.evicted = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._loop, name="archive-writer", daemon=True)
+        self._thread.start()
+
+    def _conn(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _totals(self):
+        row = self._conn().execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM files").fetchone()
+        return int(row[0]), int(row[1])
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def submit(self, content: bytes, img_bgr, filename: Optional[str],
+               content_type: Optional[str], digest: Optional[str] = None) -> Optional[str]:
+        """
+        Ставит картинку в очередь на запись. Возвращает путь файла относительно
+        корня архива (ab/cd/<sha256>.<ext>) или None, если картинка не попала в
+        выборку / очередь переполнена. digest — sha256 байтов, если уже посчитан.
+
+        Вызывается на каждую загрузку, и на попадания в кэш тоже: уже лежащему
+        файлу обновляются last_seen, hits и имена — иначе часто репостящиеся
+        картинки выглядели бы для LRU холодными. Выборка (sample_rate) решает
+        только, можно ли записать файл, которого ещё нет. img_bgr может быть None
+        (кадр не декодировали) — для jpeg/png он декодируется из байтов при записи.
+        """
+        if not self.enabled:
+            with self._lock:
+                self.skipped += 1
+            return None
+        if digest is None:
+            digest = hashlib.sha256(content).hexdigest()
+        ext = {"jpeg": "jpg", "png": "png"}.get(self.fmt) or _sniff_ext(content, filename, content_type)
+        name = shard_path(digest, ext)
+        sampled = random.random() < self.sample_rate
+        # В очереди держим только то, что нужно формату: исходные байты или кадр (вне выборки — ничего)
+        if not sampled:
+            content = img_bgr = None
+            with self._lock:
+                self.skipped += 1
+        elif self.fmt == "original":
+            img_bgr = None
+        elif img_bgr is not None:
+            content = None
+        try:
+            self._queue.put_nowait((digest, name, os.path.basename(filename or ""), content, img_bgr))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return None
+        return name if sampled else None
+
+    def _encode(self, content, img_bgr):
+        if self.fmt == "original":
+            return content
+        if img_bgr is None:
+            img_bgr = cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_COLOR)
+            if img_bgr is None:
+                raise ValueError("Не удалось декодировать картинку для архива")
+        if self.fmt == "jpeg":
+            ok, buf = cv2.imencode('.jpg', img_bgr, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        else:
+            ok, buf = cv2.imencode('.png', img_bgr)
+        if not ok:
+            raise ValueError(f"Не удалось перекодировать в {self.fmt}")
+        return buf
+
+    def _write(self, digest: str, name: str, filename: str, content, img_bgr):
+        db = self._conn()
+        now = time.time()
+        path = self.root / name
+        # Такой файл уже есть — только отмечаем, что его снова видели
+        touched = db.execute("UPDATE files SET last_seen = ?, hits = hits + 1 WHERE digest = ? AND path = ?",
+                             (now, digest, name)).rowcount
+        if touched and path.exists():
+            self._remember_name(db, filename, digest, now)
+            with self._lock:
+                self.deduplicated += 1
+            return
+        if content is None and img_bgr is None:
+            # Загрузка вне выборки, а файла нет — писать нечего
+            return
+        t0 = time.perf_counter()
+        data = self._encode(content, img_bgr)
+        t1 = time.perf_counter()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        if self._on_timing is not None:
+            if self.fmt != "original":
+                self._on_timing("archive_encode", t1 - t0)
+            self._on_timing("archive_write", time.perf_counter() - t1)
+        old = db.execute("SELECT path, size FROM files WHERE digest = ?", (digest,)).fetchone()
+        if old and old["path"] != name:
+            # Те же байты в другом формате архива — прежний файл больше не нужен
+            (self.root / old["path"]).unlink(missing_ok=True)
+        # Upsert, а не REPLACE: hits строки (если она была) сохраняются
+        db.execute("INSERT INTO files (digest, path, size, created_at, last_seen) VALUES (?, ?, ?, ?, ?) "
+                   "ON CONFLICT (digest) DO UPDATE SET path = excluded.path, size = excluded.size, "
+                   "last_seen = excluded.last_seen, hits = files.hits + ?",
+                   (digest, name, len(data), now, now, 0 if touched else 1))
+        self._remember_name(db, filename, digest, now)
+        with self._lock:
+            self.written += 1
+            self.files += 0 if old else 1
+            self.total_bytes += len(data) - (old["size"] if old else 0)
+
+    @staticmethod
+    def _remember_name(db, filename: str, digest: str, now: float):
+        if filename:
+            db.execute("INSERT INTO names (filename, digest, seen_at) VALUES (?, ?, ?) "
+                       "ON CONFLICT (filename, digest) DO UPDATE SET seen_at = excluded.seen_at",
+                       (filename, digest, now))
+
+    def _evict(self, where: str, args: tuple, until_bytes: Optional[int] = None) -> int:
+        """Удаляет файлы по условию, самые давно виденные — первыми; until_bytes — пока архив больше."""
+        db = self._conn()
+        removed = 0
+        while until_bytes is None or self.total_bytes > until_bytes:
+            rows = db.execute(f"SELECT digest, path, size FROM files WHERE {where} ORDER BY last_seen LIMIT 256",
+                              args).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                (self.root / row["path"]).unlink(missing_ok=True)
+                db.execute("DELETE FROM files WHERE digest = ?", (row["digest"],))
+                db.execute("DELETE FROM names WHERE digest = ?", (row["digest"],))
+                with self._lock:
+                    self.files -= 1
+                    self.total_bytes -= row["size"]
+                    self.evicted += 1
+                removed += 1
+                if until_bytes is not None and self.total_bytes <= until_bytes:
+                    break
+        return removed
+
+    def sweep(self):
+        """Уборка: файлы старше max_age_s и лишнее сверх max_bytes; итоги сверяются с индексом."""
+        # Индекс может быть общим у нескольких процессов — счётчики берём из него
+        total, files = self._totals()
+        with self._lock:
+            self.total_bytes, self.files = total, files
+        if self.max_age_s:
+            self._evict("last_seen < ?", (time.time() - self.max_age_s,))
+        if self.max_bytes and self.total_bytes > self.max_bytes:
+            self._evict("1", (), int(self.max_bytes * 0.9))
+
+    def _loop(self):
+        next_sweep = time.monotonic()
+        while True:
+            if time.monotonic() >= next_sweep:
+                try:
+                    self.sweep()
+                except Exception:
+                    with self._lock:
+                        self.errors += 1
+                next_sweep = time.monotonic() + self.sweep_s
+            try:
+                item = self._queue.get(timeout=self.sweep_s)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            try:
+                self._write(*item)
+                if self.max_bytes and self.total_bytes > self.max_bytes:
+                    self._evict("1", (), int(self.max_bytes * 0.9))
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        self._queue.join()
+
+    def _describe(self, row) -> dict:
+        names = self._conn().execute("SELECT filename FROM names WHERE digest = ? ORDER BY seen_at DESC",
+                                     (row["digest"],)).fetchall()
+        return {
+            'digest': row["digest"],
+            'path': row["path"],
+            'size': row["size"],
+            'created_at': row["created_at"],
+            'last_seen': row["last_seen"],
+            'hits': row["hits"],
+            'filenames': [n["filename"] for n in names],
+        }
+
+    def lookup(self, digest: Optional[str] = None, filename: Optional[str] = None, limit: int = 50) -> List[dict]:
+        """Файлы архива по sha256 или исходному имени (новые первыми)."""
+        db = self._conn()
+        if digest:
+            rows = db.execute("SELECT * FROM files WHERE digest = ?", (digest.lower(),)).fetchall()
+        else:
+            rows = db.execute("SELECT f.* FROM names n JOIN files f ON f.digest = n.digest "
+                              "WHERE n.filename = ? ORDER BY n.seen_at DESC LIMIT ?",
+                              (os.path.basename(filename or ""), max(0, limit))).fetchall()
+        return [self._describe(r) for r in rows]
+
+    def migrate_flat(self) -> int:
+        """Переносит файлы из корня (старый плоский архив) в дерево по sha256 и индексирует их."""
+        db = self._conn()
+        moved = 0
+        for path in self.root.iterdir():
+            if not path.is_file() or path.name.startswith((".", "index.sqlite3")):
+                continue
+            data = path.read_bytes()
+            digest = hashlib.sha256(data).hexdigest()
+            name = shard_path(digest, _sniff_ext(data, path.name, None))
+            target = self.root / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            mtime = path.stat().st_mtime
+            if target.exists():
+                path.unlink()
+            else:
+                os.replace(path, target)
+            cur = db.execute("INSERT OR IGNORE INTO files (digest, path, size, created_at, last_seen) "
+                             "VALUES (?, ?, ?, ?, ?)", (digest, name, len(data), mtime, mtime))
+            if not cur.rowcount:
+                db.execute("UPDATE files SET hits = hits + 1 WHERE digest = ?", (digest,))
+            db.execute("INSERT OR REPLACE INTO names (filename, digest, seen_at) VALUES (?, ?, ?)",
+                       (path.name, digest, mtime))
+            moved += 1
+        total, files = self._totals()
+        with self._lock:
+            self.total_bytes, self.files = total, files
+        return moved
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'format': self.fmt,
+                'sample_rate': self.sample_rate,
+                'queue_depth': self._queue.qsize(),
+                'files': self.files,
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'max_age_s': self.max_age_s,
+                'written': self.written,
+                'deduplicated': self.deduplicated,
+                'evicted': self.evicted,
+                'dropped': self.dropped,
+                'skipped': self.skipped,
+                'errors': self.errors,
+            }
+
+
+if __name__ == "__main__":
+    import sys
+
+    root = Path(sys.argv[1] if len(sys.argv) > 1 else Path(__file__).parent / "downloads")
+    writer = ArchiveWriter(root, sample_rate=0)
+    print(f"Перенесено файлов: {writer.migrate_flat()}; в архиве {writer.files} файлов, {writer.total_bytes} байт")
@@ -0,0 +1,261 @@
+"""
+Движки инференса OCR за одним интерфейсом.
+
+Пулы (ocr_pool, ocr_shards) и офлайн-прогон (bulk_ocr) знают про движок
+только то, что у него есть predict(images) -> [OCRResult] — по результату
+на картинку, в общем виде (ocr_engine.OCRResult). Движок выбирается
+настройкой OCR_BACKEND:
+
+  paddle — PaddleOCR как раньше; его выход приводится к OCRResult
+           (normalize_result) прямо в воркере;
+  onnx   — экспортированные в ONNX модели детекции и распознавания PP-OCR
+           на onnxruntime (CPU): DB-детектор, вырезки строк, CTC-распознаватель.
+           int8=True — динамическая INT8-квантизация весов (quantize_dynamic),
+           квантованная копия кэшируется рядом: <имя>.int8.onnx.
+
+Каталог ONNX-моделей (OCR_ONNX_DIR): det.onnx, rec.onnx и словарь
+распознавателя dict.txt (символ на строку; или inference.yml модели
+распознавания — словарь берётся из PostProcess.character_dict). Экспорт:
+    paddle2onnx --model_dir <det> --model_filename inference.json \\
+        --params_filename inference.pdiparams --save_file onnx/det.onnx
+(то же для rec). onnxruntime импортируется лениво — сервису с paddle он не нужен.
+
+Сравнение движков по задержке, памяти и точности — benchmarks/bench_backends.py.
+"""
+import math
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import cv2
+
+from ocr_engine import OCRResult, crop_quad, make_ocr, make_rec, normalize_result
+
+BACKENDS = ("paddle", "onnx")
+
+# Нормализация входа детектора PP-OCR (ImageNet, картинка BGR как есть)
+_DET_MEAN = np.array([0.485, 0.456, 0.406], np.float32) * 255
+_DET_STD = np.array([0.229, 0.224, 0.225], np.float32) * 255
+# Высота строки на входе распознавателя PP-OCRv4/v5 и минимальная ширина (соотношение 320/48)
+_REC_HEIGHT = 48
+_REC_MIN_RATIO = 320 / 48
+
+
+class PaddleBackend:
+    name = "paddle"
+
+    def __init__(self, lang: str = "ru", det_limit_side_len: int = 1200,
+                 cpu_threads: Optional[int] = None, model_dir: Optional[str] = None):
+        self.engine = make_ocr(lang, det_limit_side_len, cpu_threads, model_dir)
+
+    def predict(self, images) -> List[OCRResult]:
+        return [normalize_result(r) for r in self.engine.predict(images)]
+
+
+def quantize_int8(path: Path) -> Path:
+    """<имя>.int8.onnx рядом с моделью (создаётся один раз): веса INT8, активации — при исполнении."""
+    path = Path(path)
+    out = path.with_name(path.stem + ".int8.onnx")
+    if not out.exists() or out.stat().st_mtime < path.stat().st_mtime:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        tmp = out.with_name(out.name + ".tmp")
+        # ConvInteger на CPU умеет только uint8 x uint8
+        quantize_dynamic(str(path), str(tmp), weight_type=QuantType.QUInt8)
+        tmp.replace(out)
+    return out
+
+
+def _session(path: Path, cpu_threads: Optional[int], int8: bool):
+    import onnxruntime as ort
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if cpu_threads:
+        opts.intra_op_num_threads = int(cpu_threads)
+        opts.inter_op_num_threads = 1
+    src = quantize_int8(path) if int8 else path
+    return ort.InferenceSession(str(src), sess_options=opts, providers=["CPUExecutionProvider"])
+
+
+def load_charset(model_dir: Path) -> List[str]:
+    """Словарь распознавателя: dict.txt или PostProcess.character_dict из inference.yml."""
+    txt = model_dir / "dict.txt"
+    if txt.exists():
+        with open(txt, encoding="utf-8") as f:
+            chars = [ln.rstrip("\r\n") for ln in f]
+    else:
+        yml = model_dir / "inference.yml"
+        if not yml.exists():
+            raise FileNotFoundError(f"Нет словаря распознавателя: {txt} или {yml}")
+        import yaml
+        with open(yml, encoding="utf-8") as f:
+            chars = [str(c) for c in yaml.safe_load(f)["PostProcess"]["character_dict"]]
+    # Индекс 0 — blank CTC, в конце — пробел (use_space_char, как в PP-OCR)
+    return ["", *chars, " "]
+
+
+class _OnnxRec:
+    """CTC-распознаватель строк: вырезки -> (тексты, уверенности)."""
+
+    def __init__(self, model_dir: Path, cpu_threads: Optional[int], int8: bool, batch_size: int = 16):
+        self.session = _session(model_dir / "rec.onnx", cpu_threads, int8)
+        self.input = self.session.get_inputs()[0].name
+        self.charset = load_charset(model_dir)
+        self.batch_size = max(1, int(batch_size))
+
+    def _prepare(self, crops, width: int) -> np.ndarray:
+        batch = np.zeros((len(crops), 3, _REC_HEIGHT, width), np.float32)
+        for i, crop in enumerate(crops):
+            h, w = crop.shape[:2]
+            rw = min(width, max(1, int(math.ceil(_REC_HEIGHT * w / max(h, 1)))))
+            img = cv2.resize(crop, (rw, _REC_HEIGHT)).astype(np.float32)
+            batch[i, :, :, :rw] = ((img / 255.0 - 0.5) / 0.5).transpose(2, 0, 1)
+        return batch
+
+    def _decode(self, probs: np.ndarray) -> Tuple[str, float]:
+        idx = probs.argmax(axis=1)
+        conf = probs.max(axis=1)
+        keep = idx != 0
+        keep[1:] &= idx[1:] != idx[:-1]
+        chars = [self.charset[i] if i < len(self.charset) else "" for i in idx[keep]]
+        return "".join(chars), float(conf[keep].mean()) if keep.any() else 0.0
+
+    def recognize(self, crops) -> Tuple[List[str], List[float]]:
+        texts, scores = [""] * len(crops), [0.0] * len(crops)
+        # Похожие по ширине строки — в один батч, меньше паддинга
+        order = sorted(range(len(crops)), key=lambda i: crops[i].shape[1] / max(crops[i].shape[0], 1))
+        for start in range(0, len(order), self.batch_size):
+            ids = order[start:start + self.batch_size]
+            ratio = max([_REC_MIN_RATIO] + [crops[i].shape[1] / max(crops[i].shape[0], 1) for i in ids])
+            probs = self.session.run(None, {self.input: self._prepare([crops[i] for i in ids],
+                                                                      int(math.ceil(_REC_HEIGHT * ratio)))})[0]
+            for i, p in zip(ids, probs):
+                texts[i], scores[i] = self._decode(p)
+        return texts, scores
+
+
+def _order_quad(pts: np.ndarray) -> np.ndarray:
+    # Левый верхний, правый верхний, правый нижний, левый нижний
+    s = pts.sum(axis=1)
+    d = np.diff(pts, axis=1).ravel()
+    return np.array([pts[s.argmin()], pts[d.argmin()], pts[s.argmax()], pts[d.argmax()]], np.float32)
+
+
+def _reading_order(quads: List[np.ndarray]) -> List[np.ndarray]:
+    # Сверху вниз, в одной строке (разница по y меньше 10 px) — слева направо, как sorted_boxes в PP-OCR
+    quads = sorted(quads, key=lambda q: (q[0][1], q[0][0]))
+    for i in range(len(quads) - 1):
+        for j in range(i, -1, -1):
+            if abs(quads[j + 1][0][1] - quads[j][0][1]) < 10 and quads[j + 1][0][0] < quads[j][0][0]:
+                quads[j], quads[j + 1] = quads[j + 1], quads[j]
+            else:
+                break
+    return quads
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, model_dir: str, det_limit_side_len: int = 1200, cpu_threads: Optional[int] = None,
+                 int8: bool = False, det_thresh: float = 0.3, box_thresh: float = 0.6,
+                 unclip_ratio: float = 1.5, max_candidates: int = 1000, rec_batch_size: int = 16):
+        model_dir = Path(model_dir)
+        self.int8 = bool(int8)
+        self.det = _session(model_dir / "det.onnx", cpu_threads, self.int8)
+        self.det_input = self.det.get_inputs()[0].name
+        self.rec = _OnnxRec(model_dir, cpu_threads, self.int8, rec_batch_size)
+        self.det_limit_side_len = int(det_limit_side_len)
+        self.det_thresh = float(det_thresh)
+        self.box_thresh = float(box_thresh)
+        self.unclip_ratio = float(unclip_ratio)
+        self.max_candidates = int(max_candidates)
+
+    def _det_input(self, img: np.ndarray) -> Tuple[np.ndarray, float, float]:
+        h, w = img.shape[:2]
+        scale = min(1.0, self.det_limit_side_len / max(h, w)) if self.det_limit_side_len > 0 else 1.0
+        # Стороны — кратные 32 (страйд детектора)
+        rh = max(32, int(round(h * scale / 32)) * 32)
+        rw = max(32, int(round(w * scale / 32)) * 32)
+        x = cv2.resize(img, (rw, rh)).astype(np.float32)
+        x = ((x - _DET_MEAN) / _DET_STD).transpose(2, 0, 1)[None]
+        return np.ascontiguousarray(x), w / rw, h / rh
+
+    @staticmethod
+    def _score(prob: np.ndarray, contour: np.ndarray) -> float:
+        # Средняя вероятность внутри контура — только в его описанном прямоугольнике, не по всей карте
+        x, y, cw, ch = cv2.boundingRect(contour)
+        mask = np.zeros((ch, cw), np.uint8)
+        cv2.fillPoly(mask, [contour.reshape(-1, 2) - (x, y)], 1)
+        return float(cv2.mean(prob[y:y + ch, x:x + cw], mask)[0])
+
+    def detect(self, img: np.ndarray) -> List[np.ndarray]:
+        """Четырёхугольники строк (DB: порог карты, minAreaRect, оценка, расширение) в координатах img."""
+        x, sx, sy = self._det_input(img)
+        prob = self.det.run(None, {self.det_input: x})[0][0, 0]
+        bitmap = (prob > self.det_thresh).astype(np.uint8) * 255
+        contours, _ = cv2.findContours(bitmap, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        h, w = img.shape[:2]
+        quads = []
+        for c in contours[:self.max_candidates]:
+            (cx, cy), (bw, bh), angle = cv2.minAreaRect(c)
+            if min(bw, bh) < 3:
+                continue
+            if self._score(prob, c) < self.box_thresh:
+                continue
+            # Карта DB «ужата» относительно строки — расширяем на area * ratio / perimeter (unclip)
+            d = bw * bh * self.unclip_ratio / (2 * (bw + bh))
+            bw, bh = bw + 2 * d, bh + 2 * d
+            if min(bw, bh) < 5:
+                continue
+            pts = _order_quad(cv2.boxPoints(((cx, cy), (bw, bh), angle)))
+            pts[:, 0] = np.clip(pts[:, 0] * sx, 0, w - 1)
+            pts[:, 1] = np.clip(pts[:, 1] * sy, 0, h - 1)
+            quads.append(pts)
+        return _reading_order(quads)
+
+    def predict(self, images) -> List[OCRResult]:
+        quads = [self.detect(img) for img in images]
+        # Все строки всех картинок — через распознаватель батчами
+        crops = [crop_quad(img, q) for img, qs in zip(images, quads) for q in qs]
+        texts, scores = self.rec.recognize(crops) if crops else ([], [])
+        out, i = [], 0
+        for qs in quads:
+            n = len(qs)
+            out.append(OCRResult(texts[i:i + n], scores[i:i + n], [q.tolist() for q in qs]))
+            i += n
+        return out
+
+
+class OnnxRecognizer:
+    """Только распознавание (для быстрого пути по шаблонам); predict — как у TextRecognition PaddleOCR."""
+    name = "onnx"
+
+    def __init__(self, model_dir: str, cpu_threads: Optional[int] = None, int8: bool = False):
+        self.rec = _OnnxRec(Path(model_dir), cpu_threads, int8)
+
+    def predict(self, input, batch_size: int = 1) -> List[Dict[str, object]]:
+        texts, scores = self.rec.recognize(list(input))
+        return [{"rec_text": t, "rec_score": s} for t, s in zip(texts, scores)]
+
+
+def make_backend(name: str = "paddle", lang: str = "ru", det_limit_side_len: int = 1200,
+                 cpu_threads: Optional[int] = None, model_dir: Optional[str] = None,
+                 onnx_dir: Optional[str] = None, int8: bool = False):
+    """Движок детекция+распознавание по имени (OCR_BACKEND)."""
+    if name == "paddle":
+        return PaddleBackend(lang, det_limit_side_len, cpu_threads, model_dir)
+    if name == "onnx":
+        if not onnx_dir:
+            raise ValueError("Для OCR_BACKEND=onnx нужен каталог моделей OCR_ONNX_DIR")
+        return OnnxBackend(onnx_dir, det_limit_side_len, cpu_threads, int8)
+    raise ValueError(f"Неизвестный движок OCR: {name} (ожидается {', '.join(BACKENDS)})")
+
+
+def make_recognizer(name: str = "paddle", lang: str = "ru", cpu_threads: Optional[int] = None,
+                    model_dir: Optional[str] = None, model_name: Optional[str] = None,
+                    onnx_dir: Optional[str] = None, int8: bool = False):
+    """Только распознаватель строк того же движка (для LayoutTemplates / recognize_batch)."""
+    if name == "onnx":
+        if not onnx_dir:
+            raise ValueError("Для OCR_BACKEND=onnx нужен каталог моделей OCR_ONNX_DIR")
+        return OnnxRecognizer(onnx_dir, cpu_threads, int8)
+    return make_rec(lang, cpu_threads, model_dir, model_name)
@@ -0,0 +1,125 @@
+"""
+Сравнение движков инференса (backends.py): задержка, память, точность.
+
+Каждый вариант — paddle, onnx (fp32) и onnx-int8 — поднимается в отдельном
+процессе (ShardedExecutor на один шард: память движков не смешивается и
+RSS считается честно), прогревается и распознаёт примеры из репозитория
+--runs раз по одной картинке. Печатает время старта, p50/p95 задержки на
+картинку, RSS шарда после прогона и точность: похожесть full_text на эталон
+output/<имя>_res.json и долю строк эталона, найденных дословно (как
+в bench_service). Варианты, которые не поднялись (нет onnxruntime или
+моделей в --onnx-dir), пропускаются с причиной.
+
+    python benchmarks/bench_backends.py --onnx-dir models/onnx --runs 20
+    python benchmarks/bench_backends.py --variants paddle onnx-int8 --threads 4 --json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import cv2
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from backends import make_backend  # noqa: E402
+from bench_service import SAMPLES, reference_lines, similarity  # noqa: E402
+from ocr_engine import parse_predict_result, predict_batch, warmup  # noqa: E402
+from ocr_shards import ShardedExecutor  # noqa: E402
+
+# Вариант -> (движок, int8)
+VARIANTS = {'paddle': ("paddle", False), 'onnx': ("onnx", False), 'onnx-int8': ("onnx", True)}
+
+
+def run_variant(name: str, images, refs, args) -> dict:
+    backend, int8 = VARIANTS[name]
+    factory = partial(make_backend, backend, lang=args.lang, det_limit_side_len=args.det_limit_side_len,
+                      cpu_threads=args.threads, model_dir=args.model_dir, onnx_dir=args.onnx_dir, int8=int8)
+    ex = ShardedExecutor(factory, predict_batch, workers=1, threads_per_worker=args.threads,
+                         queue_size=4, max_batch=1, max_wait_ms=0, name=f"bench-{name}")
+    t0 = time.perf_counter()
+    try:
+        ex.start(warmup=partial(warmup, runs=1))
+    except Exception as e:
+        ex.shutdown()
+        return {'variant': name, 'error': str(e)}
+    startup_s = time.perf_counter() - t0
+    try:
+        lat, accuracy = [], {}
+        for i in range(args.runs * len(images)):
+            j = i % len(images)
+            t0 = time.perf_counter()
+            pred = ex.submit(images[j]).future.result()
+            lat.append((time.perf_counter() - t0) * 1000)
+            if j not in accuracy:
+                accuracy[j] = score(pred, refs[j], args.score_thresh)
+        stats = ex.stats()
+    finally:
+        ex.shutdown()
+    sims = [a['similarity'] for a in accuracy.values() if a]
+    exact = [a['lines_exact'] for a in accuracy.values() if a]
+    return {
+        'variant': name,
+        'startup_s': round(startup_s, 2),
+        'p50_ms': round(float(np.percentile(lat, 50)), 1),
+        'p95_ms': round(float(np.percentile(lat, 95)), 1),
+        'rss_mb': stats['shards'][0]['rss_mb'],
+        'similarity': round(statistics.mean(sims), 4) if sims else None,
+        'lines_exact': round(statistics.mean(exact), 4) if exact else None,
+        'per_image': {SAMPLES[j]: a for j, a in accuracy.items()},
+    }
+
+
+def score(pred, ref, score_thresh: float):
+    lines, text = parse_predict_result([pred], score_thresh)
+    if not ref:
+        return None
+    found = {ln['text'] for ln in lines}
+    return {
+        'similarity': round(similarity(text, " ".join(ref)), 4),
+        'lines_exact': round(sum(t in found for t in ref) / len(ref), 4),
+        'lines': len(lines),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--variants", nargs="+", choices=tuple(VARIANTS), default=list(VARIANTS))
+    ap.add_argument("--runs", type=int, default=10, help="прогонов каждого примера")
+    ap.add_argument("--threads", type=int, default=max(1, min(4, os.cpu_count() or 1)))
+    ap.add_argument("--lang", default=os.getenv("OCR_LANG", "ru"))
+    ap.add_argument("--det-limit-side-len", type=int, default=1200)
+    ap.add_argument("--score-thresh", type=float, default=float(os.getenv("OCR_SCORE_THRESH", "0.5")))
+    ap.add_argument("--model-dir", default=os.getenv("OCR_MODEL_DIR") or None)
+    ap.add_argument("--onnx-dir", default=os.getenv("OCR_ONNX_DIR") or None)
+    ap.add_argument("--json", action="store_true", help="вывод в JSON")
+    args = ap.parse_args()
+
+    images = [cv2.imread(str(ROOT / name)) for name in SAMPLES]
+    refs = [reference_lines(name) for name in SAMPLES]
+
+    rows = []
+    for name in args.variants:
+        rows.append(run_variant(name, images, refs, args))
+        r = rows[-1]
+        if args.json:
+            continue
+        if 'error' in r:
+            print(f"пропуск {name}: {r['error']}", file=sys.stderr)
+            continue
+        acc = (f"похожесть {r['similarity']:.4f}  строк дословно {r['lines_exact']:.2%}"
+               if r['similarity'] is not None else "нет эталона")
+        print(f"{name:>9}  p50={r['p50_ms']:8.1f} ms  p95={r['p95_ms']:8.1f} ms  rss={r['rss_mb'] or 0:.0f} MB  "
+              f"старт {r['startup_s']:.1f} с  {acc}")
+    if args.json:
+        print(json.dumps({'threads': args.threads, 'runs': args.runs, 'results': rows}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Бенчмарк поиска выделенного текста.
+
+--mode overlap: эталонный iou_with_mask (полигон на полном кадре на каждую
+строку) против векторного overlap_scores на «чеке» — картинка из репозитория
++ синтетические строки (осевые и слегка повёрнутые). Проверяет, что доли и
+отбор по порогу совпадают, и печатает ускорение.
+
+--mode mask: полноразмерная mask_highlight против highlight_mask на
+уменьшенной копии (--max-side) и/или внутри прямоугольника строк (roi).
+Точность — IoU масок (уменьшенная растягивается обратно) и доля строк,
+у которых решение «выделена / нет» совпало с полноразмерным.
+
+    python benchmarks/bench_highlight.py --lines 100 200 400
+    python benchmarks/bench_highlight.py --mode mask --upscale 3
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import cv2
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from highlight import (HIGHLIGHT_THRESH, highlight_mask, iou_with_mask,  # noqa: E402
+                       mask_highlight, overlap_scores)
+
+
+def synthetic_boxes(w: int, h: int, n: int, rotated_share: float, rng):
+    boxes = []
+    row_h = max(h // (n + 1), 4)
+    for i in range(n):
+        y = (i * row_h) % max(h - row_h, 1)
+        x = int(rng.integers(0, max(w // 4, 1)))
+        bw = int(rng.integers(w // 5, w // 2))
+        bh = max(int(row_h * 0.8), 3)
+        if rng.random() < rotated_share:
+            rect = ((x + bw / 2, y + bh / 2), (bw, bh), float(rng.uniform(-4, 4)))
+            boxes.append(cv2.boxPoints(rect).tolist())
+        else:
+            boxes.append([[x, y], [x + bw, y], [x + bw, y + bh], [x, y + bh]])
+    return boxes
+
+
+def timeit(fn, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def bench_overlap(img, args, rng):
+    mask = mask_highlight(img)
+    h, w = mask.shape[:2]
+    rows = []
+    for n in args.lines:
+        boxes = synthetic_boxes(w, h, n, args.rotated, rng)
+        ref = np.array([iou_with_mask(b, mask) for b in boxes])
+        new = overlap_scores(boxes, mask)
+        same = bool(np.array_equal(ref >= HIGHLIGHT_THRESH, new >= HIGHLIGHT_THRESH))
+        rows.append({
+            'lines': n,
+            'ref_ms': round(timeit(lambda: [iou_with_mask(b, mask) for b in boxes], args.repeat), 2),
+            'vec_ms': round(timeit(lambda: overlap_scores(boxes, mask), args.repeat), 2),
+            'max_abs_diff': float(np.max(np.abs(ref - new))) if n else 0.0,
+            'same_selection': same,
+        })
+        rows[-1]['speedup'] = round(rows[-1]['ref_ms'] / max(rows[-1]['vec_ms'], 1e-6), 1)
+    return rows
+
+
+def bench_mask(img, args, rng):
+    h, w = img.shape[:2]
+    # Строки занимают центральную часть кадра — как текст чека на фото
+    boxes = [[[x + w // 6, y + h // 8] for x, y in b]
+             for b in synthetic_boxes(w * 2 // 3, h * 3 // 4, max(args.lines), args.rotated, rng)]
+    full = mask_highlight(img)
+    full_sel = overlap_scores(boxes, full) >= HIGHLIGHT_THRESH
+    full_ms = timeit(lambda: mask_highlight(img), args.repeat)
+    rows = []
+    for max_side in args.max_side:
+        for roi in (False, True):
+            ms = timeit(lambda: highlight_mask(img, boxes, max_side, roi), args.repeat)
+            mask, scale, (ox, oy) = highlight_mask(img, boxes, max_side, roi)
+            # Растягиваем обратно и сравниваем в пределах посчитанной области
+            back = cv2.resize(mask, (mask.shape[1] and int(round(mask.shape[1] / scale)),
+                                     int(round(mask.shape[0] / scale))), interpolation=cv2.INTER_NEAREST)
+            ref = full[oy:oy + back.shape[0], ox:ox + back.shape[1]] > 0
+            back = back[:ref.shape[0], :ref.shape[1]] > 0
+            union = np.count_nonzero(ref | back)
+            mboxes = [((np.asarray(b, dtype=np.float64) - (ox, oy)) * scale).tolist() for b in boxes]
+            sel = overlap_scores(mboxes, mask) >= HIGHLIGHT_THRESH
+            rows.append({
+                'max_side': max_side,
+                'roi': roi,
+                'ms': round(ms, 2),
+                'full_ms': round(full_ms, 2),
+                'speedup': round(full_ms / max(ms, 1e-6), 1),
+                'mask_iou': round(np.count_nonzero(ref & back) / union, 4) if union else 1.0,
+                'selection_agreement': round(float(np.mean(sel == full_sel)), 4),
+            })
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--image", default=str(ROOT / "photo_1754050117342.jpg"))
+    ap.add_argument("--mode", choices=("overlap", "mask"), default="overlap")
+    ap.add_argument("--lines", type=int, nargs="+", default=[25, 100, 200, 400])
+    ap.add_argument("--rotated", type=float, default=0.3, help="доля повёрнутых боксов")
+    ap.add_argument("--max-side", type=int, nargs="+", default=[0, 1280, 960, 640],
+                    help="для --mode mask: длинная сторона маски (0 — полный размер)")
+    ap.add_argument("--upscale", type=float, default=1.0, help="увеличить картинку (имитация фото с телефона)")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--json", action="store_true", help="вывод в JSON")
+    args = ap.parse_args()
+
+    img = cv2.imread(args.image)
+    if args.upscale != 1.0:
+        img = cv2.resize(img, None, fx=args.upscale, fy=args.upscale, interpolation=cv2.INTER_CUBIC)
+    h, w = img.shape[:2]
+    rng = np.random.default_rng(0)
+    if args.mode == "overlap":
+        rows = bench_overlap(img, args, rng)
+        ok = all(r['same_selection'] for r in rows)
+    else:
+        rows = bench_mask(img, args, rng)
+        ok = True
+
+    if args.json:
+        print(json.dumps({'image': args.image, 'mode': args.mode, 'size': [w, h], 'results': rows},
+                         ensure_ascii=False))
+    elif args.mode == "overlap":
+        print(f"{Path(args.image).name} {w}x{h}, повёрнутых {args.rotated:.0%}")
+        for r in rows:
+            print(f"  lines={r['lines']:4d}  ref={r['ref_ms']:8.2f} ms  vec={r['vec_ms']:7.2f} ms  "
+                  f"x{r['speedup']:<6}  diff={r['max_abs_diff']:.2e}  same={r['same_selection']}")
+    else:
+        print(f"{Path(args.image).name} {w}x{h}, полная маска {rows[0]['full_ms']:.2f} ms")
+        for r in rows:
+            print(f"  max_side={r['max_side']:5d}  roi={str(r['roi']):5}  {r['ms']:8.2f} ms  x{r['speedup']:<5}  "
+                  f"iou={r['mask_iou']:.3f}  agree={r['selection_agreement']:.3f}")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Задержка и точность OCR в зависимости от уменьшения перед детекцией.
+
+Для каждой картинки-примера (и её увеличенной копии --upscale, как фото с
+телефона, и склейки --stack копий друг под другом, как длинный скриншот)
+прогоняет настоящий PaddleOCR в режимах:
+  native — как есть (det_side=0), auto — prescale по плотности текста,
+  фиксированные длинные стороны из --sides и tiled — тайлы (tiling.py)
+  одним батчем predict.
+Точность — похожесть full_text (difflib, по символам) на эталон: разметку
+из output/<имя>_res.json, если она есть, иначе результат native. Плюс доля
+строк эталона, найденных дословно.
+
+    python benchmarks/bench_resize.py --repeat 3
+    python benchmarks/bench_resize.py --sides 640 960 1200 --upscale 1 2.5 --json
+    python benchmarks/bench_resize.py --upscale 1 --stack 1 6 --tile-side 1200
+"""
+import argparse
+import difflib
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import cv2
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from WK import parse_predict_result  # noqa: E402
+from ocr_engine import make_ocr, predict_batch, to_plain, warmup  # noqa: E402
+from prescale import edge_density, prescale, unscale_lines  # noqa: E402
+from tiling import merge_tiles, plan_tiles  # noqa: E402
+
+SAMPLES = ("photo_1754050117342.jpg", "photo_1752238914536.png")
+
+
+def reference_lines(name: str):
+    path = ROOT / "output" / f"{Path(name).stem}_res.json"
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return [t.strip() for t in json.load(f).get("rec_texts", []) if t and t.strip()]
+
+
+def similarity(a: str, b: str) -> float:
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def run_tiled(engine, img, args):
+    h, w = img.shape[:2]
+    tiles = plan_tiles(h, w, args.tile_side, args.tile_overlap)
+    times = []
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        crops = [np.ascontiguousarray(img[y0:y1, x0:x1]) for x0, y0, x1, y1 in tiles]
+        preds = [to_plain(p) for p in predict_batch(engine, crops)]
+        times.append((time.perf_counter() - t0) * 1000)
+    lines, text = merge_tiles([(parse_predict_result([p], score_thresh=args.score_thresh)[0], x0, y0)
+                               for p, (x0, y0, _, _) in zip(preds, tiles)])
+    return args.tile_side, statistics.median(times), lines, text
+
+
+def run_mode(engine, img, side, args):
+    if side == "tiled":
+        return run_tiled(engine, img, args)
+    det_img, _ = prescale(img, args.det_limit_side_len, side, args.min_side)
+    times = []
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        det_img, _ = prescale(img, args.det_limit_side_len, side, args.min_side)
+        pred = to_plain(predict_batch(engine, [det_img])[0])
+        times.append((time.perf_counter() - t0) * 1000)
+    lines, text = parse_predict_result([pred], score_thresh=args.score_thresh)
+    unscale_lines(lines, det_img.shape[1] / img.shape[1], det_img.shape[0] / img.shape[0])
+    return max(det_img.shape[:2]), statistics.median(times), lines, text
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sides", type=int, nargs="+", default=[640, 960, 1200, 1600])
+    ap.add_argument("--upscale", type=float, nargs="+", default=[1.0, 2.5],
+                    help="множители размера примеров (2.5 — как фото с телефона)")
+    ap.add_argument("--stack", type=int, nargs="+", default=[1],
+                    help="сколько копий примера склеить по вертикали (длинный скриншот)")
+    ap.add_argument("--tile-side", type=int, default=1200)
+    ap.add_argument("--tile-overlap", type=int, default=160)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--lang", default="ru")
+    ap.add_argument("--det-limit-side-len", type=int, default=1200)
+    ap.add_argument("--min-side", type=int, default=640)
+    ap.add_argument("--score-thresh", type=float, default=0.5)
+    ap.add_argument("--json", action="store_true", help="вывод в JSON")
+    args = ap.parse_args()
+
+    engine = make_ocr(lang=args.lang, det_limit_side_len=args.det_limit_side_len)
+    warmup(engine)
+
+    modes = [("native", 0), ("auto", None)] + [(str(s), s) for s in args.sides] + [("tiled", "tiled")]
+    rows = []
+    for name in SAMPLES:
+        base = cv2.imread(str(ROOT / name))
+        ref = reference_lines(name)
+        variants = [(up, k) for up in args.upscale for k in args.stack]
+        for up, k in variants:
+            img = base if up == 1.0 else cv2.resize(base, None, fx=up, fy=up, interpolation=cv2.INTER_CUBIC)
+            if k > 1:
+                img = np.vstack([img] * k)
+            native_text = None
+            for mode, side in modes:
+                det_side, ms, lines, text = run_mode(engine, img, side, args)
+                if native_text is None:
+                    native_text = text
+                truth = " ".join(ref * k) if ref else native_text
+                found = {ln["text"] for ln in lines}
+                rows.append({
+                    'image': name,
+                    'upscale': up,
+                    'stack': k,
+                    'size': f"{img.shape[1]}x{img.shape[0]}",
+                    'edge_density': round(edge_density(img), 4),
+                    'mode': mode,
+                    'det_side': det_side,
+                    'ms': round(ms, 1),
+                    'lines': len(lines),
+                    'similarity': round(similarity(text, truth), 4),
+                    'lines_exact': round(sum(t in found for t in ref) / len(ref), 4) if ref else None,
+                    'truth': 'reference' if ref else 'native',
+                })
+                if not args.json:
+                    r = rows[-1]
+                    exact = f"{r['lines_exact']:.3f}" if r['lines_exact'] is not None else "  -  "
+                    print(f"{name:26} x{up:<4g} /{k:<2d} {r['size']:>10} {mode:>6} side={det_side:5d} "
+                          f"{r['ms']:8.1f} ms  строк={r['lines']:3d}  sim={r['similarity']:.3f}  "
+                          f"exact={exact}  ({r['truth']})")
+    if args.json:
+        print(json.dumps({'repeat': args.repeat, 'results': rows}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
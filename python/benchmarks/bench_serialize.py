@@ -0,0 +1,124 @@
+"""
+Бенчмарк разбора и сериализации ответа /ocr на плотном «чеке».
+
+Синтетический результат predict (rec_texts / rec_scores / rec_polys как
+numpy, --lines строк) проходит весь путь ответа: прежний — рекурсивный
+_to_py по боксам, jsonable_encoder и JSONResponse — и нынешний:
+parse_predict_result (polys_to_list) + FastJSONResponse в схемах full,
+compact и без боксов. Печатает время (лучшее из --repeat) и байты тела,
+проверяет, что full совпадает с прежним ответом после json.loads.
+
+    python benchmarks/bench_serialize.py --lines 50 200 800
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+import serialize  # noqa: E402
+from serialize import FastJSONResponse, polys_to_list, shape_payload  # noqa: E402
+
+
+def synthetic_pred(n: int, rng):
+    x0 = rng.integers(0, 200, n)
+    y0 = np.arange(n) * 24
+    w = rng.integers(80, 600, n)
+    polys = np.stack([np.stack([x0, y0], 1), np.stack([x0 + w, y0], 1),
+                      np.stack([x0 + w, y0 + 20], 1), np.stack([x0, y0 + 20], 1)], 1).astype(np.int16)
+    texts = [f"Позиция {i} ТОВАР {rng.integers(1, 999)} x{rng.integers(1, 9)} ={rng.integers(10, 99999) / 100:.2f}"
+             for i in range(n)]
+    return {'rec_texts': texts, 'rec_scores': rng.uniform(0.6, 1.0, n).astype(np.float32),
+            'rec_polys': list(polys)}
+
+
+def _to_py(obj):
+    # Прежний разбор боксов (до serialize.polys_to_list)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (np.integer, np.floating)):
+        return obj.item()
+    if isinstance(obj, (list, tuple)):
+        return [_to_py(x) for x in obj]
+    if isinstance(obj, dict):
+        return {k: _to_py(v) for k, v in obj.items()}
+    return obj
+
+
+def legacy_lines(pred):
+    boxes = _to_py(pred['rec_polys'])
+    boxes = [[[b[0], b[1]], [b[2], b[3]], [b[4], b[5]], [b[6], b[7]]]
+             if isinstance(b, list) and len(b) == 8 and all(isinstance(x, (int, float)) for x in b) else b
+             for b in boxes]
+    return [{'box': boxes[i], 'text': t, 'conf': float(pred['rec_scores'][i])}
+            for i, t in enumerate(pred['rec_texts'])]
+
+
+def new_lines(pred):
+    boxes = polys_to_list(pred['rec_polys'])
+    scores = pred['rec_scores']
+    return [{'box': boxes[i], 'text': t, 'conf': float(scores[i])} for i, t in enumerate(pred['rec_texts'])]
+
+
+def payload_for(lines):
+    return {'status': 'ok', 'width': 1080, 'height': 24 * len(lines), 'focus': 'full', 'cached': False,
+            'ocr': {'full_text': " ".join(ln['text'] for ln in lines), 'highlighted_text': "",
+                    'mask_present': False, 'boxes': lines},
+            'queue': {'depth': 0, 'wait_ms': 1.5, 'infer_ms': 250.0}}
+
+
+def timeit(fn, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000, out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, nargs="+", default=[50, 200, 800])
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--json", action="store_true", help="вывод в JSON")
+    args = ap.parse_args()
+    rng = np.random.default_rng(0)
+
+    rows = []
+    for n in args.lines:
+        pred = synthetic_pred(n, rng)
+        legacy_ms, legacy = timeit(lambda: JSONResponse(content=jsonable_encoder(payload_for(legacy_lines(pred)))),
+                                   args.repeat)
+        row = {'lines': n, 'encoder': 'orjson' if serialize.orjson is not None else 'json',
+               'legacy_ms': round(legacy_ms, 3), 'legacy_bytes': len(legacy.body)}
+        for name, schema, boxes in (("full", "full", True), ("compact", "compact", True),
+                                    ("text_only", "compact", False)):
+            ms, resp = timeit(lambda: FastJSONResponse(content=shape_payload(payload_for(new_lines(pred)),
+                                                                             schema, boxes)), args.repeat)
+            row[f'{name}_ms'] = round(ms, 3)
+            row[f'{name}_bytes'] = len(resp.body)
+            if name == "full":
+                row['same_as_legacy'] = json.loads(resp.body) == json.loads(legacy.body)
+        rows.append(row)
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False))
+        return
+    for r in rows:
+        print(f"строк={r['lines']:<5d} [{r['encoder']}]  прежний {r['legacy_ms']:8.3f} мс {r['legacy_bytes']:>8d} Б  "
+              f"full {r['full_ms']:7.3f} мс {r['full_bytes']:>8d} Б  "
+              f"compact {r['compact_ms']:7.3f} мс {r['compact_bytes']:>8d} Б  "
+              f"без боксов {r['text_only_ms']:7.3f} мс {r['text_only_bytes']:>8d} Б  "
+              f"совпадает={r['same_as_legacy']}")
+
+
+if __name__ == "__main__":
+    main()
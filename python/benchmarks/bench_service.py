@@ -0,0 +1,208 @@
+"""
+Задержка, пропускная способность и точность всего сервиса /ocr на примерах из репозитория.
+
+Поднимает WK.app в этом же процессе (TestClient, с lifespan — модели,
+пул, прогрев как в проде) и гоняет /ocr из --concurrency параллельных
+клиентов. Кэш, архив, dHash и шаблоны раскладки выключены — каждый запрос
+проходит полный путь. Сценарий — картинка × focus; картинки — примеры и
+их синтетические варианты: увеличенная копия (--upscale, как фото с
+телефона) и склейка копий по вертикали (--stack, длинный скриншот — режется
+на тайлы). Остальные настройки сервиса (OCR_WORKERS, OCR_SERVING, ...)
+берутся из окружения как есть.
+
+По каждому сценарию и уровню конкурентности: p50/p95/p99 задержки (от
+клиента), картинок в секунду, медианы этапов из блока timings ответа.
+Точность — похожесть full_text на эталон output/<имя>_res.json (difflib)
+и доля строк эталона, найденных дословно.
+
+--json / --out — результат в JSON; --baseline прошлый.json — сравнение:
+p95 хуже больше чем на --max-regress или похожесть ниже на --max-sim-drop —
+код возврата 1 (для CI).
+
+    python benchmarks/bench_service.py --requests 24 --concurrency 1 4
+    python benchmarks/bench_service.py --out bench.json --baseline main.json --max-regress 0.15
+"""
+import argparse
+import difflib
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import cv2
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+SAMPLES = ("photo_1754050117342.jpg", "photo_1752238914536.png")
+
+
+def reference_lines(name: str):
+    path = ROOT / "output" / f"{Path(name).stem}_res.json"
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return [t.strip() for t in json.load(f).get("rec_texts", []) if t and t.strip()]
+
+
+def similarity(a: str, b: str) -> float:
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def percentile(values, q: float) -> float:
+    return round(float(np.percentile(values, q)), 2) if values else 0.0
+
+
+def variants(args):
+    """(имя, байты, content_type, эталонные строки или None, "ШxВ")."""
+    out = []
+    for name in SAMPLES:
+        base = cv2.imread(str(ROOT / name))
+        ref = reference_lines(name)
+        ext = Path(name).suffix
+        for up in args.upscale:
+            for k in args.stack:
+                img = base if up == 1.0 else cv2.resize(base, None, fx=up, fy=up, interpolation=cv2.INTER_CUBIC)
+                if k > 1:
+                    img = np.vstack([img] * k)
+                if up == 1.0 and k == 1:
+                    data = (ROOT / name).read_bytes()
+                else:
+                    data = cv2.imencode(ext, img)[1].tobytes()
+                label = Path(name).stem + (f"_x{up:g}" if up != 1.0 else "") + (f"_stack{k}" if k > 1 else "")
+                ctype = "image/png" if ext == ".png" else "image/jpeg"
+                out.append((label, data, ctype, (ref * k) if ref else None, f"{img.shape[1]}x{img.shape[0]}"))
+    return out
+
+
+def run_level(client, data, ctype, focus, concurrency, requests):
+    def one(i):
+        t0 = time.perf_counter()
+        r = client.post('/ocr', data={'focus': focus, 'timings': 'true'},
+                        files={'image': (f"bench_{i}", data, ctype)})
+        ms = (time.perf_counter() - t0) * 1000
+        return r.status_code, ms, r.json() if r.status_code == 200 else None
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as ex:
+        results = list(ex.map(one, range(requests)))
+    wall = time.perf_counter() - t0
+    ok = [(ms, payload) for code, ms, payload in results if code == 200]
+    lat = [ms for ms, _ in ok]
+    stages = {}
+    for _, payload in ok:
+        for stage, v in payload['timings'].items():
+            stages.setdefault(stage, []).append(v)
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': len(results) - len(ok),
+        'p50_ms': percentile(lat, 50),
+        'p95_ms': percentile(lat, 95),
+        'p99_ms': percentile(lat, 99),
+        'images_per_s': round(len(ok) / wall, 2),
+        'stages_ms': {s: round(statistics.median(v), 2) for s, v in stages.items()},
+    }, (ok[0][1] if ok else None)
+
+
+def accuracy(payload, ref):
+    if payload is None or not ref:
+        return None
+    text = payload['ocr']['full_text']
+    found = {ln['text'] for ln in payload['ocr']['boxes']}
+    return {
+        'similarity': round(similarity(text, " ".join(ref)), 4),
+        'lines_exact': round(sum(t in found for t in ref) / len(ref), 4),
+        'lines': len(payload['ocr']['boxes']),
+    }
+
+
+def compare(results, baseline, max_regress: float, max_sim_drop: float):
+    """Список регрессий против baseline (те же сценарии и уровни)."""
+    old = {(r['scenario'], r['concurrency']): r for r in baseline['results']}
+    out = []
+    for r in results:
+        b = old.get((r['scenario'], r['concurrency']))
+        if b is None:
+            continue
+        if b['p95_ms'] and r['p95_ms'] > b['p95_ms'] * (1 + max_regress):
+            out.append(f"{r['scenario']} c={r['concurrency']}: p95 {b['p95_ms']} -> {r['p95_ms']} мс")
+        if r.get('errors', 0) > b.get('errors', 0):
+            out.append(f"{r['scenario']} c={r['concurrency']}: ошибок {b.get('errors', 0)} -> {r['errors']}")
+        ra, ba = r.get('accuracy'), b.get('accuracy')
+        if ra and ba and ra['similarity'] < ba['similarity'] - max_sim_drop:
+            out.append(f"{r['scenario']}: похожесть {ba['similarity']} -> {ra['similarity']}")
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=16, help="запросов на сценарий и уровень")
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    ap.add_argument("--focus", nargs="+", default=["full", "highlight"])
+    ap.add_argument("--upscale", type=float, nargs="+", default=[1.0, 2.5])
+    ap.add_argument("--stack", type=int, nargs="+", default=[1, 6])
+    ap.add_argument("--json", action="store_true", help="вывод в JSON")
+    ap.add_argument("--out", help="записать JSON с результатами в файл")
+    ap.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    ap.add_argument("--max-regress", type=float, default=0.2, help="допустимый рост p95 (доля)")
+    ap.add_argument("--max-sim-drop", type=float, default=0.01, help="допустимое падение похожести")
+    args = ap.parse_args()
+
+    # Каждый запрос — полный путь: без кэша, архива, почти-дубликатов и шаблонов
+    os.environ.update(OCR_CACHE_SIZE="0", OCR_ARCHIVE_SAMPLE="0", OCR_JOBS_CONCURRENCY="0",
+                      OCR_PHASH_MAX_DIST="-1", OCR_LAYOUT_MAX_DIST="-1", OCR_SOURCE_SHARE="1")
+    os.environ.pop("OCR_CACHE_DIR", None)
+    os.environ.setdefault("OCR_QUEUE_SIZE", str(max(8, 2 * max(args.concurrency))))
+
+    from fastapi.testclient import TestClient
+    import WK
+
+    rows = []
+    with TestClient(WK.app) as client:
+        if not WK.OCR_POOL.wait_ready(600):
+            raise SystemExit(f"Модели не загрузились: {WK.MODEL_LOAD_ERROR}")
+        for label, data, ctype, ref, size in variants(args):
+            for focus in args.focus:
+                scenario = f"{label}/{focus}"
+                acc = None
+                for c in args.concurrency:
+                    row, first = run_level(client, data, ctype, focus, c, args.requests)
+                    if acc is None:
+                        acc = accuracy(first, ref)
+                    row.update(scenario=scenario, image=label, size=size, focus=focus, accuracy=acc)
+                    rows.append(row)
+                    if not args.json:
+                        a = f"sim={acc['similarity']:.3f} exact={acc['lines_exact']:.3f}" if acc else "эталона нет"
+                        print(f"{scenario:38} {size:>10} c={c:<3d} p50={row['p50_ms']:8.1f} "
+                              f"p95={row['p95_ms']:8.1f} p99={row['p99_ms']:8.1f} мс  "
+                              f"{row['images_per_s']:7.2f} изобр/с  ошибок={row['errors']}  {a}")
+                        top = sorted(((v, s) for s, v in row['stages_ms'].items() if s != 'total_ms'), reverse=True)[:4]
+                        print(" " * 40 + "  ".join(f"{s}={v:.1f}" for v, s in top))
+
+    report = {
+        'config': {'requests': args.requests, 'concurrency': args.concurrency,
+                   'serving': WK.OCR_SERVING, 'workers': WK.OCR_WORKERS,
+                   'batch_max_size': WK.OCR_BATCH_MAX_SIZE, 'det_limit_side_len': WK.OCR_DET_LIMIT_SIDE_LEN},
+        'results': rows,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(rows, json.load(f), args.max_regress, args.max_sim_drop)
+        for line in regressions:
+            print("РЕГРЕССИЯ:", line, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
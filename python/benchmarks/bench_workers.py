@@ -0,0 +1,114 @@
+"""
+Подбор сплита «процессов × потоков на процесс» для OCR_SERVING=processes.
+
+Для каждого сплита WxT (W*T не больше числа ядер) поднимает ShardedExecutor
+с настоящим PaddleOCR, прогревает его и прогоняет --requests картинок
+конкурентно. Печатает пропускную способность, p50/p95 задержки и RSS
+шардов, в конце — лучший сплит (его и ставить в OCR_WORKERS /
+OCR_THREADS_PER_WORKER).
+
+    python benchmarks/bench_workers.py --requests 48
+    python benchmarks/bench_workers.py --splits 1x8 2x4 4x2 8x1 --json
+"""
+import argparse
+import json
+import sys
+import time
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import cv2
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from ocr_engine import make_ocr, predict_batch, warmup  # noqa: E402
+from ocr_shards import ShardedExecutor, available_cores  # noqa: E402
+
+SAMPLES = ("photo_1754050117342.jpg", "photo_1752238914536.png")
+
+
+def default_splits(cores: int):
+    out = []
+    w = 1
+    while w <= cores:
+        out.append((w, max(cores // w, 1)))
+        w *= 2
+    return out
+
+
+def parse_split(s: str):
+    w, t = s.lower().split("x")
+    return int(w), int(t)
+
+
+def run_split(workers: int, threads: int, images, args) -> dict:
+    factory = partial(make_ocr, lang=args.lang, det_limit_side_len=args.det_limit_side_len,
+                      cpu_threads=threads)
+    ex = ShardedExecutor(factory, predict_batch, workers=workers, threads_per_worker=threads,
+                         queue_size=args.requests, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+    t0 = time.perf_counter()
+    ex.start(warmup=partial(warmup, runs=1, batch_size=args.max_batch))
+    startup_s = time.perf_counter() - t0
+    try:
+        t0 = time.perf_counter()
+        tickets = [ex.submit(images[i % len(images)]) for i in range(args.requests)]
+        lat = []
+        for t in tickets:
+            t.future.result()
+            lat.append((time.perf_counter() - t.enqueued_at) * 1000)
+        wall = time.perf_counter() - t0
+        stats = ex.stats()
+    finally:
+        ex.shutdown()
+    return {
+        'split': f"{workers}x{threads}",
+        'workers': workers,
+        'threads_per_worker': threads,
+        'startup_s': round(startup_s, 2),
+        'images_per_s': round(args.requests / wall, 2),
+        'p50_ms': round(float(np.percentile(lat, 50)), 1),
+        'p95_ms': round(float(np.percentile(lat, 95)), 1),
+        'avg_batch': stats['avg_batch'],
+        'rss_mb_total': round(sum(s['rss_mb'] or 0 for s in stats['shards']), 1),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--splits", nargs="+", help="сплиты вида 2x4 (по умолчанию 1xN, 2xN/2, ...)")
+    ap.add_argument("--requests", type=int, default=32)
+    ap.add_argument("--max-batch", type=int, default=4)
+    ap.add_argument("--max-wait-ms", type=float, default=10)
+    ap.add_argument("--lang", default="ru")
+    ap.add_argument("--det-limit-side-len", type=int, default=1200)
+    ap.add_argument("--json", action="store_true", help="вывод в JSON")
+    args = ap.parse_args()
+
+    cores = len(available_cores())
+    splits = [parse_split(s) for s in args.splits] if args.splits else default_splits(cores)
+    images = [cv2.imread(str(ROOT / name)) for name in SAMPLES]
+
+    rows = []
+    for w, t in splits:
+        if w * t > cores:
+            print(f"пропуск {w}x{t}: ядер всего {cores}", file=sys.stderr)
+            continue
+        rows.append(run_split(w, t, images, args))
+        if not args.json:
+            r = rows[-1]
+            print(f"{r['split']:>6}  {r['images_per_s']:7.2f} img/s  p50={r['p50_ms']:8.1f} ms  "
+                  f"p95={r['p95_ms']:8.1f} ms  batch={r['avg_batch']:.2f}  rss={r['rss_mb_total']:.0f} MB  "
+                  f"старт {r['startup_s']:.1f} с")
+    best = max(rows, key=lambda r: r['images_per_s']) if rows else None
+    if args.json:
+        print(json.dumps({'cores': cores, 'requests': args.requests, 'results': rows,
+                          'best': best and best['split']}, ensure_ascii=False))
+    elif best:
+        print(f"лучший сплит: {best['split']} -> OCR_WORKERS={best['workers']} "
+              f"OCR_THREADS_PER_WORKER={best['threads_per_worker']}")
+
+
+if __name__ == "__main__":
+    main()
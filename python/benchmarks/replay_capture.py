@@ -0,0 +1,85 @@
+"""
+Повтор сохранённого медленного запроса (GET /profiles, каталог OCR_PROFILE_DIR) офлайн.
+
+Берёт <id>.json из каталога профилей, картинку — сохранённую рядом
+(OCR_PROFILE_SAVE_INPUT=1) или из архива загрузок (saved_relpath), и
+прогоняет её через сервис в этом же процессе (WK.app, без сети) с теми же
+параметрами --repeat раз. Кэш выключен, иначе повтор отдал бы готовый
+результат. Печатает время этапов исходного запроса рядом с повторами —
+видно, воспроизводится ли задержка и в каком этапе. С --profile повторы
+тоже профилируются, профили ложатся рядом с исходным.
+
+    python benchmarks/replay_capture.py profiles/20250101-120000-ab12cd34.json --repeat 3
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+
+def load_input(meta: dict, capture_dir: Path) -> bytes:
+    for path in ([capture_dir / meta['input']] if meta.get('input') else []) + \
+                ([ROOT / meta['saved_relpath']] if meta.get('saved_relpath') else []):
+        if path.is_file():
+            return path.read_bytes()
+    raise SystemExit(f"Нет картинки для {meta['id']}: ни {meta.get('input')}, ни {meta.get('saved_relpath')}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("capture", help="путь к <id>.json из каталога профилей")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--profile", action="store_true", help="профилировать и повторы")
+    ap.add_argument("--json", action="store_true", help="вывод в JSON")
+    args = ap.parse_args()
+
+    capture = Path(args.capture)
+    with open(capture, encoding="utf-8") as f:
+        meta = json.load(f)
+    content = load_input(meta, capture.parent)
+
+    os.environ["OCR_CACHE_SIZE"] = "0"
+    os.environ.pop("OCR_CACHE_DIR", None)
+    os.environ["OCR_ARCHIVE_SAMPLE"] = "0"
+    os.environ["OCR_JOBS_CONCURRENCY"] = "0"
+    if args.profile:
+        os.environ.update(OCR_PROFILE="1", OCR_PROFILE_DIR=str(capture.parent))
+
+    from fastapi.testclient import TestClient
+    import WK
+
+    opts = {k: v for k, v in meta['options'].items() if v is not None}
+    opts['timings'] = 'true'
+    headers = {"X-OCR-Profile": "1"} if args.profile else {}
+    runs = []
+    with TestClient(WK.app) as client:
+        WK.OCR_POOL.wait_ready()
+        for _ in range(args.repeat):
+            r = client.post('/ocr', data=opts, headers=headers,
+                            files={'image': (meta.get('filename') or 'image', content,
+                                             meta.get('content_type') or 'application/octet-stream')})
+            r.raise_for_status()
+            runs.append({'timings': r.json()['timings'], 'profile_id': r.headers.get('X-OCR-Profile-Id')})
+
+    if args.json:
+        print(json.dumps({'capture': meta['id'], 'original': meta['timings'], 'runs': runs}, ensure_ascii=False))
+        return
+    stages = list(meta['timings'])
+    for run in runs:
+        stages += [s for s in run['timings'] if s not in stages]
+    print(f"{meta['id']}  {meta['width']}x{meta['height']}  строк={meta['lines']}  {meta['options']}")
+    print(f"{'этап':16}{'исходный':>10} " + "".join(f"{'повтор ' + str(i + 1):>10} " for i in range(len(runs))))
+    for s in stages:
+        cells = [meta['timings'].get(s)] + [run['timings'].get(s) for run in runs]
+        print(f"{s:16}" + "".join(f"{c:>10.1f} " if c is not None else f"{'-':>10} " for c in cells))
+    for i, run in enumerate(runs):
+        if run['profile_id']:
+            print(f"профиль повтора {i + 1}: {capture.parent / (run['profile_id'] + '.folded')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Офлайн-прогон OCR по архиву (downloads/ или любому каталогу / списку файлов).
+
+После смены score_thresh или моделей архив надо распознать заново, а /ocr —
+по картинке на HTTP-запрос. Здесь картинки идут пачками (--batch) в пул
+процессов (--workers, у каждого свой движок --backend на --threads ядрах):
+процесс сам читает файлы, декодирует (read_image_to_bgr), уменьшает или режет
+на тайлы как сервис, делает один predict на пачку, разбирает результат
+(parse_predict_result) и для focus=highlight/both ищет обводку
+(highlight_filter поверх mask_highlight). Главный процесс только пишет
+готовые строки в JSONL — по строке на картинку, по мере готовности.
+
+Сам JSONL и есть чекпоинт: при повторном запуске с тем же --out уже
+записанные пути пропускаются, а недописанный хвост (прервали посреди
+строки) отрезается. Настройки прогона лежат рядом в <out>.meta.json —
+продолжить с другими настройками нельзя, только начать заново (--restart).
+
+    python bulk_ocr.py downloads --out reocr.jsonl --workers 4 --threads 2
+    python bulk_ocr.py files.txt --out reocr.jsonl --focus both --score-thresh 0.6
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff", ".gif"}
+LIST_EXTS = {".txt", ".lst"}
+
+_ENGINE = None
+_CFG: Dict[str, Any] = {}
+
+
+def list_inputs(inputs: Iterable[str]) -> List[str]:
+    """Каталоги (рекурсивно, только картинки), списки файлов (.txt — путь на строку) и отдельные файлы."""
+    out = []
+    for item in inputs:
+        p = Path(item)
+        if p.is_dir():
+            for root, dirs, files in os.walk(p):
+                dirs.sort()
+                out += [os.path.join(root, f) for f in sorted(files) if Path(f).suffix.lower() in IMAGE_EXTS]
+        elif p.suffix.lower() in LIST_EXTS:
+            with open(p, encoding="utf-8") as f:
+                out += [ln.strip() for ln in f if ln.strip()]
+        else:
+            out.append(str(p))
+    return out
+
+
+def load_done(out_path: Path, retry_errors: bool) -> set:
+    """Пути, уже записанные в JSONL; недописанная последняя строка отрезается."""
+    done = set()
+    if not out_path.exists():
+        return done
+    good = 0
+    with open(out_path, "rb") as f:
+        for raw in f:
+            try:
+                rec = json.loads(raw)
+            except ValueError:
+                break
+            if not raw.endswith(b"\n"):
+                break
+            good += len(raw)
+            if not (retry_errors and rec.get('status') == 'error'):
+                done.add(rec['path'])
+    if good < out_path.stat().st_size:
+        with open(out_path, "r+b") as f:
+            f.truncate(good)
+    return done
+
+
+def _init_worker(cfg: Dict[str, Any]):
+    global _ENGINE, _CFG
+    # OMP_NUM_THREADS и др. выставлены при запуске пула (ocr_shards.thread_env), здесь — потоки OpenCV
+    if cfg['threads']:
+        import cv2
+        cv2.setNumThreads(cfg['threads'])
+    from backends import make_backend
+    _CFG = cfg
+    _ENGINE = make_backend(cfg['backend'], cfg['lang'], cfg['det_limit_side_len'], cfg['threads'] or None,
+                           cfg['model_dir'], cfg['onnx_dir'], cfg['int8'])
+
+
+def _det_inputs(img: np.ndarray):
+    """Что уйдёт в predict для картинки: тайлы или (уменьшенная) картинка целиком."""
+    from prescale import prescale
+    from tiling import plan_tiles, should_tile
+    h, w = img.shape[:2]
+    if should_tile(h, w, _CFG['tile_side'], _CFG['tile_min_aspect']):
+        tiles = plan_tiles(h, w, _CFG['tile_side'], _CFG['tile_overlap'])
+        return [np.ascontiguousarray(img[y0:y1, x0:x1]) for x0, y0, x1, y1 in tiles], tiles
+    det_img, _ = prescale(img, _CFG['det_limit_side_len'], None if _CFG['prescale'] else 0,
+                          _CFG['prescale_min_side'])
+    return [det_img], None
+
+
+def _result(img: np.ndarray, preds, inputs, tiles) -> Dict[str, Any]:
+    from highlight import highlight_filter
+    from ocr_engine import parse_predict_result
+    from prescale import unscale_lines
+    from tiling import merge_tiles
+    h, w = img.shape[:2]
+    thresh = _CFG['score_thresh']
+    if tiles:
+        lines, full_text = merge_tiles([(parse_predict_result([p], score_thresh=thresh)[0], x0, y0)
+                                        for p, (x0, y0, _, _) in zip(preds, tiles)])
+    else:
+        lines, full_text = parse_predict_result([preds[0]], score_thresh=thresh)
+        # Боксы — в координатах исходной картинки
+        dh, dw = inputs[0].shape[:2]
+        unscale_lines(lines, dw / w, dh / h)
+    rec = {'width': w, 'height': h, 'tiles': len(tiles) if tiles else 1, 'full_text': full_text}
+    if _CFG['focus'] in ("highlight", "both"):
+        highlighted_text, mask_present = highlight_filter(img, lines, _CFG['highlight_max_side'],
+                                                          _CFG['highlight_roi']) if lines else ("", False)
+        rec.update(highlighted_text=highlighted_text, mask_present=mask_present)
+    rec['boxes'] = lines
+    return rec
+
+
+def run_chunk(paths: List[str]) -> List[Tuple[bool, bytes]]:
+    """Пачка путей -> (ok, готовая строка JSONL) по каждому, в процессе пула."""
+    from ocr_engine import predict_batch, read_image_to_bgr
+    from serialize import dumps
+    t0 = time.perf_counter()
+    items, out = [], {}
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            img = read_image_to_bgr(data)
+            inputs, tiles = _det_inputs(img)
+            meta = {'digest': hashlib.sha256(data).hexdigest(), 'size_bytes': len(data)}
+            items.append((path, img, inputs, tiles, meta))
+        except Exception as e:
+            out[path] = {'path': path, 'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+    flat = [x for _, _, inputs, _, _ in items for x in inputs]
+    try:
+        preds = predict_batch(_ENGINE, flat) if flat else []
+        if len(preds) != len(flat):
+            raise RuntimeError(f"predict вернул {len(preds)} результатов на {len(flat)} картинок")
+    except Exception:
+        # Пачка упала целиком — по одной картинке, чтобы ошибка досталась только «своей»
+        preds = None
+    i = 0
+    for path, img, inputs, tiles, meta in items:
+        try:
+            part = preds[i:i + len(inputs)] if preds is not None else predict_batch(_ENGINE, inputs)
+            out[path] = dict({'path': path, 'status': 'ok'}, **meta, **_result(img, part, inputs, tiles))
+        except Exception as e:
+            out[path] = {'path': path, 'status': 'error', 'error': f"{type(e).__name__}: {e}", **meta}
+        i += len(inputs)
+    ms = round((time.perf_counter() - t0) * 1000 / max(len(paths), 1), 2)
+    return [(out[p]['status'] == 'ok', dumps(dict(out[p], ms=ms)) + b"\n") for p in paths]
+
+
+def _fmt_eta(seconds: float) -> str:
+    if seconds != seconds or seconds == float("inf"):
+        return "?"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def main():
+    from backends import BACKENDS
+    ap = argparse.ArgumentParser(description="Офлайн-прогон OCR по каталогу или списку файлов в JSONL")
+    ap.add_argument("inputs", nargs="+", help="каталоги, файлы картинок, списки путей (.txt)")
+    ap.add_argument("--out", required=True, help="JSONL с результатами (он же чекпоинт)")
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    ap.add_argument("--threads", type=int, default=int(os.getenv("OCR_THREADS_PER_WORKER", "1")),
+                    help="потоков на процесс")
+    ap.add_argument("--batch", type=int, default=int(os.getenv("OCR_BATCH_MAX_SIZE", "4")),
+                    help="картинок на один predict")
+    ap.add_argument("--focus", choices=("full", "highlight", "both"), default="full")
+    ap.add_argument("--lang", default=os.getenv("OCR_LANG", "ru"))
+    ap.add_argument("--det-side", type=int, default=int(os.getenv("OCR_DET_LIMIT_SIDE_LEN", "1200")))
+    ap.add_argument("--score-thresh", type=float, default=float(os.getenv("OCR_SCORE_THRESH", "0.5")))
+    ap.add_argument("--model-dir", default=os.getenv("OCR_MODEL_DIR") or None)
+    ap.add_argument("--backend", choices=BACKENDS, default=os.getenv("OCR_BACKEND", "paddle"))
+    ap.add_argument("--onnx-dir", default=os.getenv("OCR_ONNX_DIR") or None, help="модели для --backend onnx")
+    ap.add_argument("--int8", action="store_true", default=os.getenv("OCR_ONNX_INT8") == "1",
+                    help="INT8-квантованные веса (--backend onnx)")
+    ap.add_argument("--limit", type=int, default=0, help="не больше N картинок за запуск")
+    ap.add_argument("--restart", action="store_true", help="начать заново, не продолжая --out")
+    ap.add_argument("--retry-errors", action="store_true", help="повторить картинки, записанные с ошибкой")
+    ap.add_argument("--progress-s", type=float, default=5.0, help="как часто печатать прогресс")
+    args = ap.parse_args()
+
+    cfg = {
+        'backend': args.backend,
+        'onnx_dir': args.onnx_dir,
+        'int8': args.int8,
+        'lang': args.lang,
+        'det_limit_side_len': args.det_side,
+        'score_thresh': args.score_thresh,
+        'model_dir': args.model_dir,
+        'focus': args.focus,
+        'prescale': os.getenv("OCR_PRESCALE", "1") == "1",
+        'prescale_min_side': int(os.getenv("OCR_PRESCALE_MIN_SIDE", "640")),
+        'tile_side': int(os.getenv("OCR_TILE_SIDE", str(args.det_side))),
+        'tile_overlap': int(os.getenv("OCR_TILE_OVERLAP", "160")),
+        'tile_min_aspect': float(os.getenv("OCR_TILE_MIN_ASPECT", "3.0")),
+        'highlight_max_side': int(os.getenv("OCR_HIGHLIGHT_MAX_SIDE", "1280")),
+        'highlight_roi': os.getenv("OCR_HIGHLIGHT_ROI", "1") == "1",
+    }
+    out_path = Path(args.out)
+    meta_path = out_path.with_name(out_path.name + ".meta.json")
+    if args.restart:
+        out_path.unlink(missing_ok=True)
+    if out_path.exists() and meta_path.exists():
+        with open(meta_path, encoding="utf-8") as f:
+            prev = json.load(f)['settings']
+        if prev != cfg:
+            diff = {k: (prev.get(k), v) for k, v in cfg.items() if prev.get(k) != v}
+            raise SystemExit(f"{out_path} записан с другими настройками {diff}; --restart — начать заново")
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({'settings': cfg, 'inputs': args.inputs, 'started_at': time.time()}, f, ensure_ascii=False)
+
+    files = list_inputs(args.inputs)
+    done = load_done(out_path, args.retry_errors)
+    todo = [p for p in files if p not in done]
+    skipped = len(files) - len(todo)
+    if args.limit:
+        todo = todo[:args.limit]
+    total = len(todo)
+    print(f"картинок {len(files)}, уже готово {skipped}, в работе {total}; "
+          f"процессов {args.workers} x {args.threads} потоков, пачка {args.batch}", file=sys.stderr)
+    if not total:
+        return
+
+    chunks = [todo[i:i + args.batch] for i in range(0, total, args.batch)]
+    cfg['threads'] = args.threads
+    started = time.perf_counter()
+    last = started
+    n = errors = 0
+    from ocr_shards import thread_env
+    # Процессы пула получают ограничение потоков BLAS/OpenMP в окружении при старте, до своих импортов
+    with thread_env(args.threads):
+        pool = mp.get_context("spawn").Pool(args.workers, _init_worker, (cfg,))
+    try:
+        with open(out_path, "ab") as out:
+            for results in pool.imap_unordered(run_chunk, chunks):
+                out.writelines(line for _, line in results)
+                out.flush()
+                n += len(results)
+                errors += sum(not ok for ok, _ in results)
+                now = time.perf_counter()
+                if now - last >= args.progress_s or n == total:
+                    last = now
+                    os.fsync(out.fileno())
+                    rate = n / (now - started)
+                    print(f"{n}/{total} ({100 * n / total:.1f}%)  {rate:.2f} изобр/с  "
+                          f"ETA {_fmt_eta((total - n) / rate if rate else float('inf'))}  ошибок {errors}",
+                          file=sys.stderr)
+    except KeyboardInterrupt:
+        pool.terminate()
+        pool.join()
+        print(f"прервано на {n}/{total}; повторный запуск с тем же --out продолжит", file=sys.stderr)
+        sys.exit(130)
+    except BaseException:
+        pool.terminate()
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+    elapsed = time.perf_counter() - started
+    print(f"готово: {n} картинок за {elapsed:.1f} с ({n / elapsed:.2f} изобр/с), ошибок {errors}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
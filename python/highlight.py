@@ -0,0 +1,252 @@
+"""
+Поиск обведённого/выделенного текста: маска обводки и перекрытие строк с ней.
+
+iou_with_mask — исходная (эталонная) реализация: на каждую строку рисует
+полигон на кадре размера всей картинки, O(строк × пикселей).
+overlap_scores считает то же самое для всех строк сразу:
+  * одна таблица сумм (cv2.integral) по маске на весь кадр;
+  * осевые прямоугольники (большинство боксов PaddleOCR) — четыре чтения
+    из таблицы на бокс, векторно для всех;
+  * повёрнутые четырёхугольники — fillPoly только в пределах своего bbox.
+Результат совпадает с iou_with_mask до бита (порог 0.28 ведёт себя так же).
+
+Маска нужна только для грубого перекрытия с боксами, поэтому её можно
+считать дешевле (highlight_mask): на уменьшенной копии картинки
+(max_side) и/или только внутри общего прямоугольника всех строк (roi).
+Боксы переводятся в координаты маски, центр маски — обратно в исходные.
+
+highlight_regions — для режима «сначала обводка»: прямоугольники пометок
+(обвели маркером сумму, закрасили строку), чтобы распознавать только их,
+а не весь кадр. Маска тут своя, marker_mask: только яркие насыщенные
+пиксели любого оттенка (жёлтый маркер mask_highlight не ловит цветом), без
+градиентной части — та срабатывает на любой текст.
+"""
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+import cv2
+
+from metrics import stage_of
+
+HIGHLIGHT_THRESH = 0.28
+# Запас вокруг прямоугольника строк: обводка рисуется снаружи текста
+ROI_PAD = 0.04
+# Области пометок: минимальная площадь bbox (доля кадра; иконки интерфейса меньше),
+# запас вокруг, предел покрытия (больше — цветной фон, а не пометка) и число областей
+REGION_MIN_AREA = 0.004
+REGION_PAD = 0.015
+REGION_MAX_COVER = 0.5
+MAX_REGIONS = 8
+
+
+def _ksize(k: int, scale: float) -> Tuple[int, int]:
+    # Ядра морфологии масштабируются вместе с картинкой, чтобы покрывать ту же площадь
+    if scale >= 1.0:
+        return (k, k)
+    s = max(3, int(round(k * scale)) | 1)
+    return (s, s)
+
+
+def mask_highlight(img_bgr: np.ndarray, scale: float = 1.0) -> np.ndarray:
+    """Маска обводки; при scale < 1 считается на уменьшенной копии и возвращается в её размере."""
+    if scale < 1.0:
+        img_bgr = cv2.resize(img_bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV)
+    red1 = cv2.inRange(hsv, (0, 120, 70), (10, 255, 255))
+    red2 = cv2.inRange(hsv, (170, 120, 70), (180, 255, 255))
+    blue = cv2.inRange(hsv, (90, 80, 50), (130, 255, 255))
+    green = cv2.inRange(hsv, (36, 80, 50), (86, 255, 255))
+    mask_color = cv2.bitwise_or(cv2.bitwise_or(red1, red2), cv2.bitwise_or(blue, green))
+    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+    grad = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, np.ones(_ksize(3, scale), np.uint8))
+    _, th = cv2.threshold(grad, 0, 255, cv2.THRESH_OTSU)
+    thick = cv2.dilate(th, np.ones(_ksize(3, scale), np.uint8), iterations=1)
+    mask = cv2.bitwise_or(mask_color, thick)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones(_ksize(7, scale), np.uint8), iterations=2)
+    mask = cv2.dilate(mask, np.ones(_ksize(5, scale), np.uint8), iterations=1)
+    return mask
+
+
+def highlight_mask(img_bgr: np.ndarray, boxes: Optional[List] = None,
+                   max_side: int = 0, roi: bool = False):
+    """
+    Маска обводки в удешевлённом режиме.
+    max_side > 0 — считать на копии, у которой длинная сторона не больше max_side;
+    roi — только внутри общего прямоугольника боксов (с запасом ROI_PAD).
+    Возвращает (mask, scale, origin): точка p исходной картинки в маске — (p - origin) * scale.
+    """
+    h, w = img_bgr.shape[:2]
+    x0, y0, x1, y1 = 0, 0, w, h
+    if roi and boxes:
+        pts = np.concatenate([np.asarray(b, dtype=np.float64).reshape(-1, 2) for b in boxes])
+        pad = int(ROI_PAD * max(h, w))
+        x0 = int(max(0, np.floor(pts[:, 0].min()) - pad))
+        y0 = int(max(0, np.floor(pts[:, 1].min()) - pad))
+        x1 = int(min(w, np.ceil(pts[:, 0].max()) + 1 + pad))
+        y1 = int(min(h, np.ceil(pts[:, 1].max()) + 1 + pad))
+        if x1 <= x0 or y1 <= y0:
+            x0, y0, x1, y1 = 0, 0, w, h
+    crop = img_bgr[y0:y1, x0:x1]
+    side = max(crop.shape[:2])
+    scale = max_side / side if 0 < max_side < side else 1.0
+    return mask_highlight(crop, scale), scale, (x0, y0)
+
+
+def marker_mask(img_bgr: np.ndarray) -> np.ndarray:
+    """Яркие насыщенные пиксели (маркер, ручка) любого оттенка; тёмные и серые плашки интерфейса — нет."""
+    hsv = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV)
+    return cv2.inRange(hsv, (0, 110, 120), (180, 255, 255))
+
+
+def _merge_rects(rects: List[List[int]]) -> List[List[int]]:
+    # Сливаем пересекающиеся, пока есть что сливать (областей единицы — квадрат не страшен)
+    rects = [list(r) for r in rects]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rects[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
+
+
+def highlight_regions(img_bgr: np.ndarray, max_side: int = 0) -> List[Tuple[int, int, int, int]]:
+    """
+    Прямоугольники (x0, y0, x1, y1) пометок в координатах картинки, крупные — первыми.
+    Пусто, если пометок нет или они покрывают больше REGION_MAX_COVER кадра.
+    """
+    h, w = img_bgr.shape[:2]
+    side = max(h, w)
+    scale = max_side / side if 0 < max_side < side else 1.0
+    small = cv2.resize(img_bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else img_bgr
+    # Склеиваем штрихи одной обводки
+    mask = cv2.morphologyEx(marker_mask(small), cv2.MORPH_CLOSE, np.ones(_ksize(7, scale), np.uint8), iterations=2)
+    n, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    min_area = REGION_MIN_AREA * mask.shape[0] * mask.shape[1]
+    pad = int(REGION_PAD * side)
+    rects = []
+    for x, y, bw, bh, _ in stats[1:]:
+        if bw * bh < min_area:
+            continue
+        rects.append([max(0, int(x / scale) - pad), max(0, int(y / scale) - pad),
+                      min(w, int(np.ceil((x + bw) / scale)) + pad), min(h, int(np.ceil((y + bh) / scale)) + pad)])
+    rects = _merge_rects(rects)
+    if not rects or sum((r[2] - r[0]) * (r[3] - r[1]) for r in rects) > REGION_MAX_COVER * h * w:
+        return []
+    rects.sort(key=lambda r: -(r[2] - r[0]) * (r[3] - r[1]))
+    return [tuple(r) for r in rects[:MAX_REGIONS]]
+
+
+def iou_with_mask(box: List[List[float]], mask: np.ndarray) -> float:
+    poly = np.array(box, dtype=np.int32)
+    x_min, y_min = np.min(poly[:, 0]), np.min(poly[:, 1])
+    x_max, y_max = np.max(poly[:, 0]), np.max(poly[:, 1])
+    roi = np.zeros_like(mask)
+    cv2.fillPoly(roi, [poly], 255)
+    inter = cv2.bitwise_and(roi, mask)
+    inter_area = int(np.sum(inter > 0))
+    box_area = max((x_max - x_min + 1) * (y_max - y_min + 1), 1)
+    return inter_area / box_area
+
+
+def _axis_rect_mask(quads: np.ndarray, mins: np.ndarray, maxs: np.ndarray) -> np.ndarray:
+    """
+    quads (n, 4, 2): True там, где четыре точки — четыре угла осевого прямоугольника
+    по порядку обхода (у «бабочки» из тех же углов fillPoly закрашивает другое).
+    """
+    nxt = np.roll(quads, -1, axis=1)
+    cyclic = ((quads[:, :, 0] == nxt[:, :, 0]) ^ (quads[:, :, 1] == nxt[:, :, 1])).all(1)
+    on_x = (quads[:, :, 0] == mins[:, None, 0]) | (quads[:, :, 0] == maxs[:, None, 0])
+    on_y = (quads[:, :, 1] == mins[:, None, 1]) | (quads[:, :, 1] == maxs[:, None, 1])
+    corner = (quads[:, :, 0] == mins[:, None, 0]) * 2 + (quads[:, :, 1] == mins[:, None, 1])
+    distinct = np.sort(corner, axis=1) == np.arange(4)
+    return (cyclic & on_x.all(1) & on_y.all(1) & distinct.all(1)
+            & (mins[:, 0] < maxs[:, 0]) & (mins[:, 1] < maxs[:, 1]))
+
+
+def overlap_scores(boxes: List[List[List[float]]], mask: np.ndarray) -> np.ndarray:
+    """Доля bbox каждой строки, попавшая в маску (как iou_with_mask), одним проходом."""
+    n = len(boxes)
+    scores = np.zeros(n, dtype=np.float64)
+    if n == 0:
+        return scores
+    h, w = mask.shape[:2]
+    binary = (mask > 0).astype(np.uint8)
+    sat = cv2.integral(binary)  # (h+1, w+1), sat[y, x] = сумма binary[:y, :x]
+
+    polys = [np.array(b, dtype=np.int32).reshape(-1, 2) for b in boxes]
+    if all(len(p) == 4 for p in polys):
+        quads = np.stack(polys).astype(np.int64)
+        mins, maxs = quads.min(axis=1), quads.max(axis=1)
+        rect = _axis_rect_mask(quads, mins, maxs)
+    else:
+        mins = np.array([p.min(axis=0) for p in polys], dtype=np.int64)
+        maxs = np.array([p.max(axis=0) for p in polys], dtype=np.int64)
+        rect = np.array([len(p) == 4 and bool(_axis_rect_mask(p[None].astype(np.int64), mn[None], mx[None])[0])
+                         for p, mn, mx in zip(polys, mins, maxs)], dtype=bool)
+    areas = np.maximum((maxs[:, 0] - mins[:, 0] + 1) * (maxs[:, 1] - mins[:, 1] + 1), 1)
+
+    # Обрезка bbox по кадру (fillPoly за пределами кадра ничего не рисует)
+    x0 = np.clip(mins[:, 0], 0, w)
+    y0 = np.clip(mins[:, 1], 0, h)
+    x1 = np.clip(maxs[:, 0] + 1, 0, w)
+    y1 = np.clip(maxs[:, 1] + 1, 0, h)
+
+    inter = np.zeros(n, dtype=np.int64)
+    if rect.any():
+        r = np.nonzero(rect)[0]
+        inter[r] = (sat[y1[r], x1[r]] - sat[y0[r], x1[r]]
+                    - sat[y1[r], x0[r]] + sat[y0[r], x0[r]])
+    for i in np.nonzero(~rect)[0]:
+        if x1[i] <= x0[i] or y1[i] <= y0[i]:
+            continue
+        crop = binary[y0[i]:y1[i], x0[i]:x1[i]]
+        roi = np.zeros_like(crop)
+        cv2.fillPoly(roi, [polys[i] - np.array([x0[i], y0[i]], dtype=np.int32)], 1)
+        inter[i] = int(np.count_nonzero(roi & crop))
+
+    scores[:] = inter / areas
+    return scores
+
+
+def highlight_filter(img_bgr: np.ndarray, lines: List[Dict[str, Any]],
+                     max_side: int = 0, roi: bool = False, timer=None):
+    """
+    Оставляет строки, бокс которых перекрывается с маской обводки.
+    Возвращает (highlighted_text, mask_present). timer — metrics.StageTimer для
+    этапов highlight_mask и highlight_iou.
+    """
+    boxed = [ln for ln in lines if ln["box"] is not None]
+    with stage_of(timer, "highlight_mask"):
+        mask, scale, (ox, oy) = highlight_mask(img_bgr, [ln["box"] for ln in boxed], max_side, roi)
+        mask_present = bool(np.any(mask > 0))
+    if scale == 1.0 and ox == 0 and oy == 0:
+        mboxes = [ln["box"] for ln in boxed]
+    else:
+        mboxes = [((np.asarray(ln["box"], dtype=np.float64) - (ox, oy)) * scale).tolist() for ln in boxed]
+    filtered = []
+    with stage_of(timer, "highlight_iou"):
+        scores = overlap_scores(mboxes, mask)
+    for ln, ov in zip(boxed, scores):
+        if ov >= HIGHLIGHT_THRESH:
+            ln["overlap"] = float(ov)
+            filtered.append(ln)
+    if not filtered and mask_present and boxed:
+        # Фоллбек: строка, ближайшая к центру маски
+        m = cv2.moments(mask, binaryImage=True)
+        m_center = np.array([m["m10"] / m["m00"], m["m01"] / m["m00"]]) / scale + (ox, oy)
+        def center(bx):
+            p = np.array(bx); return np.mean(p, axis=0)
+        filtered = sorted(
+            boxed,
+            key=lambda ln: np.linalg.norm(center(ln["box"]) - m_center)
+        )[:1]
+    highlighted_text = " ".join([ln["text"] for ln in filtered]).strip()
+    return highlighted_text, mask_present
@@ -0,0 +1,219 @@
+"""
+Приём загрузки с предсказуемой памятью на запрос.
+
+Тело запроса Starlette разбирает сам: к вызову обработчика UploadFile уже
+лежит в SpooledTemporaryFile (в памяти до 1 МБ, дальше на диске). Поэтому
+лимит размера держится в двух местах:
+  * BodyLimitMiddleware считает байты прямо из receive() — слишком большое
+    тело (в том числе chunked без Content-Length) обрывается с 413, не
+    дочитываясь до конца и не попадая в спул целиком;
+  * read_upload проверяет размер каждого файла (UploadFile.size) до
+    копирования в память — часть /ocr/batch больше лимита отклоняется одна.
+Раньше image.read() делал полную копию в bytes, дальше шли декод и копии
+PIL-фоллбека — пик памяти на запрос был в разы больше файла и плавал от
+картинки к картинке. Здесь:
+  * тело копируется из спула кусками в один заранее выделенный bytearray
+    (единственная копия файла в памяти процесса), sha256
+    (имя в архиве, из него — ключ кэша) считается по тем же кускам —
+    второго прохода нет;
+  * размер кадра берётся из заголовка до декода (probe_size): слишком
+    большие по пикселям отклоняются, не выделяя память под кадр;
+  * MemoryLedger считает байты, которые держит запрос (тело, кадр, копии),
+    и их пик — он уходит в ответ и в /stats.
+"""
+import hashlib
+import io
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+from PIL import Image
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+
+from metrics import StageTimer
+
+CHUNK_SIZE = 256 * 1024
+# Сколько байт с начала файла отдаём PIL для чтения заголовка (EXIF в JPEG бывает до 64 КБ)
+PROBE_BYTES = 256 * 1024
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class BodyLimitMiddleware:
+    """
+    ASGI-middleware: обрывает тело запроса, как только оно больше limit_for(scope)
+    байт (0 — без лимита). Content-Length проверяется сразу, остальное — по
+    мере прихода кусков из receive(): превышение — HTTPException(413) из
+    receive(), посреди разбора формы его отдаёт обычный обработчик исключений,
+    а если оно дошло сюда — 413 отправляется здесь. on_reject() — счётчик.
+    """
+
+    def __init__(self, app, limit_for: Callable[[dict], int], detail: str = "Тело запроса слишком большое",
+                 on_reject: Optional[Callable[[], None]] = None):
+        self.app = app
+        self.limit_for = limit_for
+        self.detail = detail
+        self.on_reject = on_reject
+
+    def _reject(self):
+        if self.on_reject is not None:
+            self.on_reject()
+        return HTTPException(status_code=413, detail=self.detail)
+
+    async def _send_413(self, scope, receive, send):
+        await JSONResponse(status_code=413, content={'detail': self.detail})(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limit_for(scope) if scope["type"] == "http" else 0
+        if not limit:
+            return await self.app(scope, receive, send)
+        length = dict(scope.get("headers") or ()).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            self._reject()
+            return await self._send_413(scope, receive, send)
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise self._reject()
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except HTTPException as e:
+            if e.status_code != 413 or received <= limit or started:
+                raise
+            await self._send_413(scope, receive, send)
+
+
+class MemoryLedger:
+    """Учёт байтов, которые держит один запрос: сейчас и в пике."""
+    __slots__ = ("current", "peak", "items")
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self.items = {}
+
+    def hold(self, name: str, nbytes: int):
+        self.release(name)
+        self.items[name] = int(nbytes)
+        self.current += int(nbytes)
+        self.peak = max(self.peak, self.current)
+
+    def release(self, name: str):
+        self.current -= self.items.pop(name, 0)
+
+    def as_dict(self) -> dict:
+        return {'peak_bytes': self.peak}
+
+
+class Upload:
+    """
+    Тело загрузки + его ключ кэша; release() отпускает байты, как только они не нужны.
+    digest — sha256 тела (hex), имя файла в архиве; timer — время этапов
+    обработки этой загрузки (metrics.StageTimer).
+    """
+    __slots__ = ("data", "size", "key", "digest", "filename", "content_type", "ledger", "timer")
+
+    def __init__(self, data: bytearray, key: str, filename: Optional[str],
+                 content_type: Optional[str], ledger: MemoryLedger, timer: Optional[StageTimer] = None,
+                 digest: Optional[str] = None):
+        self.data = data
+        self.size = len(data)
+        self.key = key
+        self.digest = digest
+        self.filename = filename
+        self.content_type = content_type
+        self.ledger = ledger
+        self.timer = timer or StageTimer()
+        ledger.hold("upload", self.size)
+
+    def release(self):
+        self.data = None
+        self.ledger.release("upload")
+
+
+async def read_upload(upload, max_bytes: int, key_for: Callable[[str], str],
+                      chunk_size: int = CHUNK_SIZE) -> Upload:
+    """
+    Копирует UploadFile из спула кусками с лимитом max_bytes (0 — без лимита).
+    sha256 тела считается здесь же; key_for(digest) — ключ кэша (OCRCache.key_for).
+    """
+    hasher = hashlib.sha256()
+    timer = StageTimer()
+    t0 = time.perf_counter()
+    declared = getattr(upload, "size", None)
+    if max_bytes and declared is not None and declared > max_bytes:
+        raise UploadTooLargeError(declared)
+    buf = bytearray(declared) if declared else bytearray()
+    pos = 0
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        end = pos + len(chunk)
+        if max_bytes and end > max_bytes:
+            raise UploadTooLargeError(end)
+        if end <= len(buf):
+            buf[pos:end] = chunk
+        else:
+            del buf[pos:]
+            buf += chunk
+        hasher.update(chunk)
+        pos = end
+    if pos < len(buf):
+        del buf[pos:]
+    timer.add("ingest", time.perf_counter() - t0)
+    digest = hasher.hexdigest()
+    return Upload(buf, key_for(digest), upload.filename, upload.content_type, MemoryLedger(), timer, digest)
+
+
+def probe_size(data) -> Optional[Tuple[int, int]]:
+    """(width, height) из заголовка картинки без декода; None, если PIL формат не знает."""
+    try:
+        with Image.open(io.BytesIO(bytes(data[:PROBE_BYTES]))) as im:
+            return im.size
+    except Exception:
+        return None
+
+
+class IngestStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.too_large = 0
+        self.peak_bytes_max = 0
+        self._peak_bytes_sum = 0
+
+    def record(self, ledger: MemoryLedger):
+        with self._lock:
+            self.requests += 1
+            self.peak_bytes_max = max(self.peak_bytes_max, ledger.peak)
+            self._peak_bytes_sum += ledger.peak
+
+    def rejected(self):
+        with self._lock:
+            self.too_large += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'too_large': self.too_large,
+                'peak_bytes_max': self.peak_bytes_max,
+                'peak_bytes_avg': round(self._peak_bytes_sum / self.requests) if self.requests else 0,
+            }
@@ -0,0 +1,235 @@
+"""
+Очередь асинхронных задач OCR в SQLite.
+
+POST /ocr/jobs кладёт картинку в очередь и сразу отвечает job_id, клиент
+не держит запрос открытым, пока идёт OCR. Очередь — файл SQLite (WAL) и
+каталог с байтами загрузок рядом: задачи переживают рестарт, а разбирать
+их могут несколько процессов сервиса сразу — claim() забирает задачу в
+транзакции BEGIN IMMEDIATE, так что одну задачу получает один воркер.
+
+Воркер, который упал посреди задачи, её не отпустит: задачи в статусе
+running дольше lease_s возвращаются в очередь (requeue_stale), пока не
+кончились попытки (max_attempts, считаются в claim) — иначе error, чтобы
+задача, роняющая процесс, не крутилась вечно. finish / fail действуют
+только для текущего владельца (worker и attempts из claim): воркер, у
+которого задачу забрали по истечении аренды, не перезапишет результат
+нового и не удалит его данные. Готовые задачи и их файлы удаляются через
+ttl_s (purge).
+
+По каждой задаче пишутся моменты created/started/finished: queue_ms
+(ожидание в очереди) и run_ms (сама обработка).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+JOB_STATUSES = ("queued", "running", "done", "error")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    filename TEXT,
+    content_type TEXT,
+    options TEXT NOT NULL,
+    callback_url TEXT,
+    callback_status TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+
+class JobStore:
+    def __init__(self, root: Path, lease_s: float = 300.0, ttl_s: float = 24 * 3600, max_attempts: int = 3):
+        self.root = Path(root)
+        self.data_dir = self.root / "data"
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.root / "jobs.sqlite3"
+        self.lease_s = float(lease_s)
+        self.ttl_s = float(ttl_s)
+        self.max_attempts = max(1, int(max_attempts))
+        # Своё соединение на поток: sqlite3 не любит делить его между потоками
+        self._local = threading.local()
+        with self._conn() as db:
+            db.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _data_path(self, job_id: str) -> Path:
+        return self.data_dir / f"{job_id}.bin"
+
+    def enqueue(self, content, filename: Optional[str], content_type: Optional[str],
+                options: dict, callback_url: Optional[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        path = self._data_path(job_id)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+        self._conn().execute(
+            "INSERT INTO jobs (id, status, created_at, filename, content_type, options, callback_url) "
+            "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+            (job_id, time.time(), filename, content_type, json.dumps(options), callback_url))
+        return job_id
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """Забирает самую старую задачу из очереди (атомарно между процессами)."""
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            now = time.time()
+            db.execute("UPDATE jobs SET status = 'running', started_at = ?, worker = ?, attempts = attempts + 1 "
+                       "WHERE id = ?", (now, worker, row["id"]))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        job = dict(row)
+        job.update(status="running", started_at=now, worker=worker, attempts=row["attempts"] + 1)
+        job["options"] = json.loads(job["options"])
+        return job
+
+    def read_data(self, job_id: str) -> bytes:
+        with open(self._data_path(job_id), "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _owned(job: dict):
+        # Условие «задача всё ещё у этого воркера в этой попытке»
+        return ("id = ? AND status = 'running' AND worker = ? AND attempts = ?",
+                (job["id"], job["worker"], job["attempts"]))
+
+    def finish(self, job: dict, result: str) -> bool:
+        """
+        job — из claim(); result — уже сериализованный JSON ответа (serialize.dumps).
+        False — задачу уже забрал другой воркер (аренда истекла), ничего не изменено.
+        """
+        where, args = self._owned(job)
+        if not self._conn().execute(f"UPDATE jobs SET status = 'done', finished_at = ?, result = ? WHERE {where}",
+                                    (time.time(), result, *args)).rowcount:
+            return False
+        self._data_path(job["id"]).unlink(missing_ok=True)
+        return True
+
+    def fail(self, job: dict, error: str, retry: bool = False) -> bool:
+        """Ошибка задачи; retry — вернуть в очередь, если попытки ещё остались. False — задача уже не наша."""
+        where, args = self._owned(job)
+        db = self._conn()
+        if retry and job["attempts"] < self.max_attempts:
+            return bool(db.execute("UPDATE jobs SET status = 'queued', started_at = NULL, worker = NULL, error = ? "
+                                   f"WHERE {where}", (error, *args)).rowcount)
+        if not db.execute(f"UPDATE jobs SET status = 'error', finished_at = ?, error = ? WHERE {where}",
+                          (time.time(), error, *args)).rowcount:
+            return False
+        self._data_path(job["id"]).unlink(missing_ok=True)
+        return True
+
+    def set_callback_status(self, job_id: str, status: str):
+        self._conn().execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (status, job_id))
+
+    def requeue_stale(self) -> int:
+        """
+        Задачи, зависшие в running дольше lease_s (воркер умер), — обратно в очередь;
+        те, что исчерпали max_attempts, — в error. Возвращает число возвращённых в очередь.
+        """
+        db = self._conn()
+        now = time.time()
+        cutoff = now - self.lease_s
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            dead = [r["id"] for r in db.execute(
+                "SELECT id FROM jobs WHERE status = 'running' AND started_at < ? AND attempts >= ?",
+                (cutoff, self.max_attempts))]
+            db.execute("UPDATE jobs SET status = 'error', finished_at = ?, worker = NULL, "
+                       "error = 'воркер не завершил задачу (попыток: ' || attempts || ')' "
+                       "WHERE status = 'running' AND started_at < ? AND attempts >= ?",
+                       (now, cutoff, self.max_attempts))
+            cur = db.execute("UPDATE jobs SET status = 'queued', started_at = NULL, worker = NULL "
+                             "WHERE status = 'running' AND started_at < ?", (cutoff,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        for job_id in dead:
+            self._data_path(job_id).unlink(missing_ok=True)
+        return cur.rowcount
+
+    def purge(self) -> int:
+        if self.ttl_s <= 0:
+            return 0
+        db = self._conn()
+        cutoff = time.time() - self.ttl_s
+        ids = [r["id"] for r in db.execute(
+            "SELECT id FROM jobs WHERE status IN ('done', 'error') AND finished_at < ?", (cutoff,))]
+        for job_id in ids:
+            self._data_path(job_id).unlink(missing_ok=True)
+        db.execute("DELETE FROM jobs WHERE status IN ('done', 'error') AND finished_at < ?", (cutoff,))
+        return len(ids)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return job_view(dict(row)) if row is not None else None
+
+    def stats(self) -> dict:
+        db = self._conn()
+        counts = {s: 0 for s in JOB_STATUSES}
+        for row in db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row["status"]] = row["n"]
+        lat = db.execute(
+            "SELECT AVG(started_at - created_at) AS q, AVG(finished_at - started_at) AS r, COUNT(*) AS n FROM "
+            "(SELECT * FROM jobs WHERE status = 'done' ORDER BY finished_at DESC LIMIT 1000)").fetchone()
+        return {
+            'path': str(self.path),
+            'counts': counts,
+            'recent_done': lat["n"],
+            'avg_queue_ms': round(lat["q"] * 1000, 2) if lat["q"] is not None else None,
+            'avg_run_ms': round(lat["r"] * 1000, 2) if lat["r"] is not None else None,
+        }
+
+
+def _ms(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    return round((b - a) * 1000, 2) if a is not None and b is not None else None
+
+
+def job_view(row: dict) -> dict:
+    """Строка таблицы -> ответ GET /ocr/jobs/{id} (и тело callback)."""
+    options = row["options"]
+    return {
+        'job_id': row["id"],
+        'status': row["status"],
+        'filename': row["filename"],
+        'options': json.loads(options) if isinstance(options, str) else options,
+        'created_at': row["created_at"],
+        'started_at': row["started_at"],
+        'finished_at': row["finished_at"],
+        'queue_ms': _ms(row["created_at"], row["started_at"]),
+        'run_ms': _ms(row["started_at"], row["finished_at"]),
+        'attempts': row["attempts"],
+        'callback_status': row["callback_status"],
+        'result': json.loads(row["result"]) if row.get("result") else None,
+        'error': row["error"],
+    }
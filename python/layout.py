@@ -0,0 +1,85 @@
+"""
+Кэш шаблонов раскладки: повторное использование боксов детекции.
+
+Многие посты канала — один и тот же шаблон (та же вёрстка, другие цифры),
+а детекция в predict каждый раз заново находит те же dt_polys. Здесь
+раскладка картинки снимается отпечатком (dHash — у одного шаблона с
+разными цифрами он почти не меняется, потому для почти-дубликатов его
+и держат выключенным) и ищется в своём PHashIndex. Шаблон — боксы строк
+после полного OCR, лежит записью в OCRCache (с её LRU/TTL и диском).
+
+При совпадении WK режет строки по боксам шаблона (crop_quad) и гонит
+только распознаватель; если средняя уверенность или уверенность худшей
+строки ниже порога — шаблон не подошёл, делается полный OCR и из него
+сохраняется новый шаблон.
+"""
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+from ocr_phash import PHashIndex
+
+
+class LayoutTemplates:
+    def __init__(self, cache, max_dist: int = -1, index_path: Optional[Path] = None):
+        """cache — OCRCache, в нём шаблоны; max_dist < 0 — выключено."""
+        self.cache = cache
+        self.max_dist = int(max_dist)
+        self.index = PHashIndex(index_path)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.added = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_dist >= 0
+
+    def match(self, ph: Optional[int], width: int, height: int):
+        """
+        Шаблон для картинки width x height: (template_key, боксы в её координатах, distance) или None.
+        Пропорции должны совпадать — другая обрезка это уже другая раскладка.
+        Кандидаты перебираются от ближайшего, вытесненные из кэша — убираются из индекса.
+        """
+        found = self.index.search(ph, self.max_dist) if (self.enabled and ph is not None) else []
+        for key, dist in found:
+            tpl = self.cache.get(key)
+            if tpl is None:
+                self.index.discard(key)
+                continue
+            sx, sy = width / tpl['width'], height / tpl['height']
+            if abs(sx - sy) > 0.02 * max(sx, sy) or not tpl['boxes']:
+                continue
+            with self._lock:
+                self.hits += 1
+            boxes = [[[round(x * sx), round(y * sy)] for x, y in b] for b in tpl['boxes']]
+            return key, boxes, dist
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def add(self, ph: Optional[int], key: str, width: int, height: int, boxes: List):
+        """Сохраняет боксы строк полного OCR как шаблон под ключом key (sha256-hex)."""
+        if not self.enabled or ph is None or not boxes:
+            return
+        self.cache.put(key, {'width': width, 'height': height, 'boxes': boxes})
+        self.index.add(ph, key)
+        with self._lock:
+            self.added += 1
+
+    def rejected(self):
+        """Шаблон нашёлся, но распознавание по нему не прошло проверку."""
+        with self._lock:
+            self.fallbacks += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'max_dist': self.max_dist,
+                'templates': len(self.index),
+                'hits': self.hits,
+                'misses': self.misses,
+                'fallbacks': self.fallbacks,
+                'added': self.added,
+            }
@@ -0,0 +1,171 @@
+"""
+Метрики сервиса в текстовом формате Prometheus (GET /metrics).
+
+Без prometheus_client: счётчики, гистограммы и «ленивые» gauge (считаются
+в момент опроса из stats() пулов, кэша, очереди задач) — словари под одним
+локом, наблюдение — пара сложений, так что метрики можно не выключать.
+
+Время по этапам запроса пишет StageTimer: этап — контекст stage(name) или
+add(name, seconds) для времени, измеренного в другом месте (ожидание в
+очереди и инференс — из тикета пула, они идут в другом потоке/процессе).
+В конце запроса Metrics.record(timer) раскладывает этапы по гистограмме
+ocr_stage_seconds{stage=...}; timer.as_dict() — блок timings в ответе.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+# Границы бакетов, секунды: от 1 мс (разбор, кэш) до 30 с (тайлы огромной картинки в очереди)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for k, v in labels.items())
+    return "{" + body + "}"
+
+
+def _num(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class StageTimer:
+    """Время этапов одного запроса."""
+    __slots__ = ("stages", "started")
+
+    def __init__(self):
+        self.stages = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def as_dict(self) -> dict:
+        out = {k: round(v * 1000, 2) for k, v in self.stages.items()}
+        out['total_ms'] = round((time.perf_counter() - self.started) * 1000, 2)
+        return out
+
+
+class Metrics:
+    def __init__(self, namespace: str = "ocr", buckets=DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._gauges = {}
+        self._hists = {}
+        self._collectors = []
+
+    def _name(self, name: str) -> str:
+        return f"{self.namespace}_{name}"
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._help[self._name(name)] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge_add(self, name: str, value: float, **labels):
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if seconds <= b:
+                    h[0][i] += 1
+                    break
+            h[1] += seconds
+            h[2] += 1
+
+    def record(self, timer: StageTimer, **labels):
+        """Этапы запроса -> ocr_stage_seconds{stage=...}."""
+        for stage, seconds in timer.stages.items():
+            self.observe("stage_seconds", seconds, stage=stage, **labels)
+
+    def collector(self, fn: Callable[[], list]):
+        """fn() -> [(name, kind, value, labels)] — значения, которые считаются при опросе."""
+        self._collectors.append(fn)
+        return fn
+
+    @contextmanager
+    def inflight(self, name: str, **labels):
+        self.gauge_add(name, 1, **labels)
+        try:
+            yield
+        finally:
+            self.gauge_add(name, -1, **labels)
+
+    def render(self) -> str:
+        series = {}
+        with self._lock:
+            for (name, labels), v in self._counters.items():
+                series.setdefault(name, ("counter", []))[1].append((name, dict(labels), v))
+            for (name, labels), v in self._gauges.items():
+                series.setdefault(name, ("gauge", []))[1].append((name, dict(labels), v))
+            hists = [(name, dict(labels), list(h[0]), h[1], h[2]) for (name, labels), h in self._hists.items()]
+        for fn in self._collectors:
+            try:
+                rows = fn()
+            except Exception:
+                continue
+            for name, kind, value, labels in rows:
+                if value is None:
+                    continue
+                full = self._name(name)
+                series.setdefault(full, (kind, []))[1].append((full, labels or {}, value))
+        for name, labels, counts, total, n in hists:
+            rows = series.setdefault(name, ("histogram", []))[1]
+            acc = 0
+            for b, c in zip(self.buckets, counts):
+                acc += c
+                rows.append((name + "_bucket", dict(labels, le=repr(b)), acc))
+            rows.append((name + "_bucket", dict(labels, le="+Inf"), n))
+            rows.append((name + "_sum", labels, total))
+            rows.append((name + "_count", labels, n))
+
+        out = []
+        for name in sorted(series):
+            kind, rows = series[name]
+            help_text = self._help.get(name, (kind, ""))[1]
+            if help_text:
+                out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for sample, labels, value in rows:
+                out.append(f"{sample}{_labels(labels)} {_num(value)}")
+        return "\n".join(out) + "\n"
+
+
+def stage_of(timer: Optional[StageTimer], name: str):
+    """timer.stage(name) или пустой контекст, если таймера нет."""
+    return timer.stage(name) if timer is not None else _NULL_STAGE
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
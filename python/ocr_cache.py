@@ -0,0 +1,136 @@
+"""
+Кэш результатов OCR по содержимому картинки.
+
+Ключ — sha256 от настроек OCR (язык, det_limit_side_len, score_thresh) и
+sha256 байтов загрузки (тот же, что имя файла в архиве): поменяли настройки —
+старые записи просто перестают совпадать.
+Два уровня: LRU в памяти (ограничение по числу записей и TTL) и необязательный
+каталог на диске, который переживает рестарт.
+"""
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+
+class OCRCache:
+    def __init__(self, max_entries: int = 1024, ttl_s: float = 24 * 3600,
+                 disk_dir: Optional[Path] = None, settings: Optional[dict] = None):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+        # Настройки входят в ключ в каноничном виде
+        self._salt = json.dumps(settings or {}, sort_keys=True).encode("utf-8")
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    def key_for(self, digest: str) -> str:
+        """Ключ по sha256 содержимого (hex), посчитанному при чтении загрузки."""
+        h = hashlib.sha256(self._salt)
+        h.update(digest.encode("ascii"))
+        return h.hexdigest()
+
+    def key(self, content: bytes) -> str:
+        return self.key_for(hashlib.sha256(content).hexdigest())
+
+    def variant(self, key: str, **params) -> str:
+        """Ключ того же содержимого, распознанного с другими параметрами запроса."""
+        h = hashlib.sha256(key.encode("ascii"))
+        h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        return h.hexdigest()
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _expired(self, ts: float) -> bool:
+        return self.ttl_s > 0 and time.time() - ts > self.ttl_s
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                ts, value = item
+                if self._expired(ts):
+                    del self._mem[key]
+                else:
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(value)
+
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+        self._mem_put(key, value)
+        return copy.deepcopy(value)
+
+    def put(self, key: str, value: dict):
+        value = copy.deepcopy(value)
+        self._mem_put(key, value)
+        self._disk_put(key, value)
+
+    def _mem_put(self, key: str, value: dict):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._mem[key] = (time.time(), value)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+                self.evictions += 1
+
+    def _disk_get(self, key: str) -> Optional[dict]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if self._expired(path.stat().st_mtime):
+                path.unlink(missing_ok=True)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, key: str, value: dict):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Пишем через временный файл, чтобы не оставить обрезанный JSON
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._mem),
+                'max_entries': self.max_entries,
+                'ttl_s': self.ttl_s,
+                'disk_dir': str(self.disk_dir) if self.disk_dir else None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,242 @@
+"""
+Модель OCR и вызов predict без FastAPI и глобального состояния.
+
+Модуль лёгкий (paddleocr импортируется только внутри make_ocr), поэтому его
+можно импортировать в дочерних процессах (ocr_shards, bulk_ocr) и в
+бенчмарках, не поднимая всё приложение из WK.py. Здесь же декод картинки и
+разбор результата predict — общие для сервиса и офлайн-прогона.
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import cv2
+
+from serialize import polys_to_list
+
+# Поля результата, которые читает parse_predict_result; остальное (картинки
+# препроцессинга и т.п.) между процессами не возим
+RESULT_FIELDS = ("rec_texts", "rec_scores", "rec_polys", "dt_polys")
+
+# Модель распознавания для отдельного TextRecognition (быстрый путь по шаблону раскладки)
+# по языку; другой язык — задать OCR_REC_MODEL явно
+REC_MODELS = {
+    "ru": "eslav_PP-OCRv5_mobile_rec",
+    "en": "en_PP-OCRv5_mobile_rec",
+}
+
+# Подкаталоги OCR_MODEL_DIR -> параметры PaddleOCR
+MODEL_SUBDIRS = {
+    "det": "text_detection_model_dir",
+    "rec": "text_recognition_model_dir",
+    "cls": "textline_orientation_model_dir",
+}
+
+
+def make_ocr(lang: str = "ru", det_limit_side_len: int = 1200,
+             cpu_threads: Optional[int] = None, model_dir: Optional[str] = None):
+    # paddleocr импортируем лениво: импорт модуля и /check не ждут загрузки моделей
+    from paddleocr import PaddleOCR
+    kwargs = {}
+    if cpu_threads:
+        kwargs["cpu_threads"] = int(cpu_threads)
+    if model_dir:
+        for sub, arg in MODEL_SUBDIRS.items():
+            if (Path(model_dir) / sub).is_dir():
+                kwargs[arg] = str(Path(model_dir) / sub)
+    # limit_type=max: длинная сторона не больше det_limit_side_len. По умолчанию в PaddleOCR 3.x — min
+    # (короткая сторона растягивается до лимита), тогда prescale бесполезен, а ONNX-движок мерил бы иначе
+    return PaddleOCR(
+        use_angle_cls=True,
+        lang=lang,
+        text_det_limit_side_len=det_limit_side_len,
+        text_det_limit_type="max",
+        **kwargs
+    )
+
+
+def make_rec(lang: str = "ru", cpu_threads: Optional[int] = None,
+             model_dir: Optional[str] = None, model_name: Optional[str] = None):
+    """Только распознавание строк (без детекции) — для вырезок по сохранённым боксам."""
+    from paddleocr import TextRecognition
+    kwargs = {}
+    if cpu_threads:
+        kwargs["cpu_threads"] = int(cpu_threads)
+    name = model_name or REC_MODELS.get(lang)
+    if name:
+        kwargs["model_name"] = name
+    if model_dir and (Path(model_dir) / "rec").is_dir():
+        kwargs["model_dir"] = str(Path(model_dir) / "rec")
+    return TextRecognition(**kwargs)
+
+
+def crop_quad(img_bgr: np.ndarray, poly) -> np.ndarray:
+    """Вырезка строки по четырёхугольнику с выпрямлением (как get_rotate_crop_image в PaddleOCR)."""
+    pts = np.asarray(poly, dtype=np.float32).reshape(-1, 2)
+    if len(pts) != 4:
+        (x0, y0), (x1, y1) = pts.min(axis=0), pts.max(axis=0)
+        pts = np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=np.float32)
+    w = int(round(max(np.linalg.norm(pts[0] - pts[1]), np.linalg.norm(pts[2] - pts[3])))) or 1
+    h = int(round(max(np.linalg.norm(pts[0] - pts[3]), np.linalg.norm(pts[1] - pts[2])))) or 1
+    m = cv2.getPerspectiveTransform(pts, np.float32([[0, 0], [w, 0], [w, h], [0, h]]))
+    crop = cv2.warpPerspective(img_bgr, m, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    # Вертикальная строка — повернуть, распознаватель ждёт горизонтальную
+    if h / w >= 1.5:
+        crop = np.ascontiguousarray(np.rot90(crop))
+    return crop
+
+
+def recognize_batch(engine, items):
+    """
+    items — по списку вырезок на картинку. Один predict на все вырезки батча,
+    на выходе по картинке (texts, scores).
+    """
+    flat = [c for crops in items for c in crops]
+    res = list(engine.predict(flat, batch_size=len(flat))) if flat else []
+    if len(res) != len(flat):
+        raise RuntimeError(f"predict вернул {len(res)} результатов на {len(flat)} вырезок")
+    out, i = [], 0
+    for crops in items:
+        part = res[i:i + len(crops)]
+        i += len(crops)
+        out.append(([str(r["rec_text"]) for r in part], [float(r["rec_score"]) for r in part]))
+    return out
+
+
+def predict_batch(engine, images):
+    # Декодированные ndarray сразу в predict, без PNG и диска; на список — по результату на картинку
+    return list(engine.predict(images))
+
+
+def read_image_to_bgr(file_bytes: bytes):
+    arr = np.frombuffer(file_bytes, np.uint8)
+    img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Не удалось декодировать изображение")
+    return img
+
+
+class OCRResult:
+    """
+    Результат одного изображения в общем для всех движков виде (backends.py):
+    строки rec_texts, их уверенность rec_scores (None — движок не дал) и
+    четырёхугольники rec_polys [[x, y] x4] в координатах поданной картинки.
+    Имена полей — как у PaddleOCR, поэтому объект читается и как dict.
+    """
+    __slots__ = ("rec_texts", "rec_scores", "rec_polys")
+
+    def __init__(self, texts: List[str], scores: List[Optional[float]], polys: Optional[list]):
+        self.rec_texts = texts
+        self.rec_scores = scores
+        self.rec_polys = polys
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __len__(self):
+        return len(self.rec_texts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'rec_texts': self.rec_texts, 'rec_scores': self.rec_scores, 'rec_polys': self.rec_polys}
+
+
+def _field(res, *names):
+    for name in names:
+        v = getattr(res, name, None)
+        if v is None and isinstance(res, dict):
+            v = res.get(name)
+        if v is not None:
+            return v
+    return None
+
+
+def _text(t) -> str:
+    if t is None:
+        return ""
+    if isinstance(t, bytes):
+        t = t.decode("utf-8", "ignore")
+    return str(t)
+
+
+def normalize_result(res) -> OCRResult:
+    """
+    Сырой результат predict (OCRResult PaddleOCR, dict, старые имена полей) -> OCRResult.
+    Поля rec_* предпочтительнее; texts/scores/dt_polys/boxes — фоллбек для старых версий.
+    """
+    if isinstance(res, OCRResult):
+        return res
+    if res is None:
+        return OCRResult([], [], None)
+    if not isinstance(res, dict) and _field(res, "rec_texts") is None and hasattr(res, "to_dict"):
+        res = res.to_dict()
+    texts = _field(res, "rec_texts", "texts")
+    if texts is None or len(texts) == 0:
+        return OCRResult([], [], None)
+    texts = [_text(t) for t in texts]
+    raw = _field(res, "rec_scores", "scores")
+    scores = [None] * len(texts)
+    if raw is not None:
+        for i, sc in enumerate(list(raw)[:len(texts)]):
+            scores[i] = float(sc) if sc is not None else None
+    polys = polys_to_list(_field(res, "rec_polys", "dt_polys", "boxes"))
+    return OCRResult(texts, scores, polys)
+
+
+def parse_predict_result(pred, score_thresh: float = 0.5):
+    """
+    Строки (box, text, conf) и full_text из результата predict: пустые строки
+    и строки с уверенностью ниже score_thresh отбрасываются.
+    """
+    if not pred:
+        return [], ""
+    res = normalize_result(pred[0] if isinstance(pred, list) else pred)
+    lines: List[Dict[str, Any]] = []
+    polys = res.rec_polys
+    for i, txt in enumerate(res.rec_texts):
+        t = txt.strip()
+        sc = res.rec_scores[i]
+        if t and (sc is None or sc >= score_thresh):
+            box = polys[i] if (polys is not None and i < len(polys)) else None
+            lines.append({"box": box, "text": t, "conf": sc if sc is not None else 1.0})
+    return lines, " ".join(ln["text"] for ln in lines).strip()
+
+
+def to_plain(res):
+    """Результат predict -> dict только с нужными полями (для передачи между процессами)."""
+    if isinstance(res, OCRResult):
+        return res
+    out = {}
+    for k in RESULT_FIELDS:
+        v = getattr(res, k, None)
+        if v is None:
+            try:
+                v = res[k]
+            except Exception:
+                v = None
+        if v is not None:
+            out[k] = v
+    return out
+
+
+def warmup_image() -> np.ndarray:
+    img = np.full((320, 640, 3), 255, np.uint8)
+    for i, text in enumerate(("WARM UP 0123456789", "TOTAL 1 234,56", "ABCDEFGHIJKLMNOP")):
+        cv2.putText(img, text, (20, 70 + 90 * i), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (0, 0, 0), 3)
+    return img
+
+
+def warmup_rec(engine, runs: int = 1):
+    img = warmup_image()
+    crops = [crop_quad(img, [[15, 40 + 90 * i], [560, 40 + 90 * i], [560, 85 + 90 * i], [15, 85 + 90 * i]])
+             for i in range(3)]
+    for _ in range(runs):
+        recognize_batch(engine, [crops])
+
+
+def warmup(engine, runs: int = 1, batch_size: int = 1):
+    img = warmup_image()
+    for _ in range(runs):
+        predict_batch(engine, [img])
+    # Ещё один прогон полным батчем — чтобы аллокации под батч тоже случились заранее
+    if runs and batch_size > 1:
+        predict_batch(engine, [img] * batch_size)
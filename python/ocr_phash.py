@@ -0,0 +1,241 @@
+"""
+Индекс перцептивных хэшей для поиска почти-дубликатов картинок.
+
+Telegram пережимает пересланные фото, байты меняются и точный sha256 в
+OCRCache промахивается. dHash (64 бита) от декодированной картинки при
+пережатии меняется на единицы битов, поэтому ищем ближайший хэш по
+расстоянию Хэмминга.
+
+Поиск — multi-index hashing: 64 бита режутся на 4 куска по 16. Если
+расстояние <= r, то хотя бы один кусок отличается не более чем на r // 4
+бит (принцип Дирихле), так что кандидатов берём из 4 таблиц по соседям
+куска, а точное расстояние проверяем векторно по массиву хэшей.
+
+Всё лежит в numpy-массивах (~65 байт на запись): хэши, ключи кэша, флаг
+живой записи и 4 таблицы — отсортированные значения куска с номерами
+записей (поиск соседей — searchsorted). Новые записи сначала копятся
+хвостом, который просматривается перебором, и вливаются в таблицы
+пересортировкой, когда хвост дорастает до четверти индекса. Записи
+дописываются в бинарный лог и поднимаются при рестарте; удалённые
+(discard — запись кэша уже вытеснена) только помечаются и выбрасываются
+вместе с перезаписью лога, когда мёртвых становится больше живых.
+
+dHash близок и у разных картинок одного шаблона (та же вёрстка, другие
+цифры), поэтому совпадение в индексе — только кандидат: перед выдачей
+чужого результата WK сверяет миниатюры (thumbnail / thumb_diff).
+"""
+import base64
+import functools
+import os
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import cv2
+
+_CHUNKS = 4
+_CHUNK_BITS = 16
+_KEY_BYTES = 32  # sha256 из OCRCache.key()
+_RECORD = np.dtype([('hash', '<u8'), ('key', 'u1', (_KEY_BYTES,))])
+_MIN_TAIL = 1024
+_THUMB_SIDE = 32
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(x: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(x)
+else:
+    _POP8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(x: np.ndarray) -> np.ndarray:
+        return _POP8[x.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+def dhash(img_bgr: np.ndarray) -> Optional[int]:
+    """
+    64-битный dHash: серый 9x8, сравнение соседних пикселей по строке.
+    Для почти однотонных картинок возвращает None — их хэш ни о чём не говорит.
+    """
+    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY) if img_bgr.ndim == 3 else img_bgr
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    if small.std() < 2.0:
+        return None
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def _thumb(img_bgr: np.ndarray) -> np.ndarray:
+    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY) if img_bgr.ndim == 3 else img_bgr
+    return cv2.resize(gray, (_THUMB_SIDE, _THUMB_SIDE), interpolation=cv2.INTER_AREA)
+
+
+def thumbnail(img_bgr: np.ndarray) -> str:
+    """Серая миниатюра 32x32 (base64, 1 КБ) для сверки почти-дубликатов; хранится в записи кэша."""
+    return base64.b64encode(_thumb(img_bgr).tobytes()).decode("ascii")
+
+
+def thumb_diff(img_bgr: np.ndarray, thumb: str) -> int:
+    """
+    Наибольшая разница яркости по клеткам миниатюр (0..255). Пережатие сдвигает
+    клетки на единицы, дописанные поверх картинки цифры и подписи — на десятки.
+    """
+    ref = np.frombuffer(base64.b64decode(thumb), dtype=np.uint8).reshape(_THUMB_SIDE, _THUMB_SIDE)
+    return int(np.abs(_thumb(img_bgr).astype(np.int16) - ref).max())
+
+
+def _chunk(hashes: np.ndarray, j: int) -> np.ndarray:
+    return ((hashes >> np.uint64(_CHUNK_BITS * j)) & np.uint64((1 << _CHUNK_BITS) - 1)).astype(np.uint16)
+
+
+@functools.lru_cache(maxsize=None)
+def _masks(radius: int) -> np.ndarray:
+    """Все 16-битные маски с не более чем radius единицами: соседи куска c — это c ^ маска."""
+    values = np.arange(1 << _CHUNK_BITS, dtype=np.uint32)
+    weight = _popcount(values.astype(np.uint64))
+    return values[weight <= radius].astype(np.uint16)
+
+
+class PHashIndex:
+    def __init__(self, path: Optional[Path] = None, capacity: int = 1024):
+        self.path = Path(path) if path else None
+        self._hashes = np.zeros(capacity, dtype=np.uint64)
+        self._keys = np.zeros((capacity, _KEY_BYTES), dtype=np.uint8)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._size = 0
+        self._live = 0
+        # Таблицы покрывают записи [0, _indexed), хвост [_indexed, _size) ищется перебором
+        self._indexed = 0
+        self._tab_vals = [np.zeros(0, dtype=np.uint16) for _ in range(_CHUNKS)]
+        self._tab_ids = [np.zeros(0, dtype=np.uint32) for _ in range(_CHUNKS)]
+        self._lock = threading.Lock()
+        if self.path and self.path.exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return self._live
+
+    def _reserve(self, n: int):
+        if n <= len(self._hashes):
+            return
+        cap = max(1024, len(self._hashes) * 2, n)
+        hashes = np.zeros(cap, dtype=np.uint64)
+        keys = np.zeros((cap, _KEY_BYTES), dtype=np.uint8)
+        alive = np.zeros(cap, dtype=bool)
+        hashes[:self._size] = self._hashes[:self._size]
+        keys[:self._size] = self._keys[:self._size]
+        alive[:self._size] = self._alive[:self._size]
+        self._hashes, self._keys, self._alive = hashes, keys, alive
+
+    def _reindex(self):
+        """Пересобирает таблицы по всем живым записям."""
+        ids = np.flatnonzero(self._alive[:self._size]).astype(np.uint32)
+        for j in range(_CHUNKS):
+            vals = _chunk(self._hashes[ids], j)
+            order = np.argsort(vals, kind="stable")
+            self._tab_vals[j] = vals[order]
+            self._tab_ids[j] = ids[order]
+        self._indexed = self._size
+
+    def _load(self):
+        recs = np.fromfile(self.path, dtype=_RECORD)
+        self._reserve(len(recs))
+        n = len(recs)
+        self._hashes[:n] = recs['hash']
+        self._keys[:n] = recs['key']
+        self._alive[:n] = True
+        self._size = self._live = n
+        self._reindex()
+
+    def add(self, h: int, key: str):
+        key_raw = bytes.fromhex(key)
+        with self._lock:
+            self._reserve(self._size + 1)
+            i = self._size
+            self._hashes[i] = h
+            self._keys[i] = np.frombuffer(key_raw, dtype=np.uint8)
+            self._alive[i] = True
+            self._size += 1
+            self._live += 1
+            if self._size - self._indexed >= max(_MIN_TAIL, self._indexed // 4):
+                self._reindex()
+            if self.path:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "ab") as f:
+                    f.write(self._records(np.array([i])).tobytes())
+
+    def _records(self, ids: np.ndarray) -> np.ndarray:
+        recs = np.zeros(len(ids), dtype=_RECORD)
+        recs['hash'] = self._hashes[ids]
+        recs['key'] = self._keys[ids]
+        return recs
+
+    def discard(self, key: str) -> int:
+        """Убирает все записи с ключом key (запись кэша вытеснена). Возвращает, сколько убрано."""
+        raw = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+        with self._lock:
+            n = self._size
+            ids = np.flatnonzero(self._alive[:n] & (self._keys[:n] == raw).all(axis=1))
+            if not len(ids):
+                return 0
+            self._alive[ids] = False
+            self._live -= len(ids)
+            if self._size - self._live > max(_MIN_TAIL, self._live):
+                self._compact()
+            return len(ids)
+
+    def _compact(self):
+        """Выбрасывает мёртвые записи из массивов, таблиц и лога."""
+        ids = np.flatnonzero(self._alive[:self._size])
+        n = len(ids)
+        self._hashes[:n] = self._hashes[ids]
+        self._keys[:n] = self._keys[ids]
+        self._alive[:n] = True
+        self._alive[n:self._size] = False
+        self._size = self._live = n
+        self._reindex()
+        if self.path:
+            tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+            self._records(np.arange(n)).tofile(tmp)
+            os.replace(tmp, self.path)
+
+    def search(self, h: int, max_dist: int, limit: int = 8) -> List[Tuple[str, int]]:
+        """
+        До limit разных ключей в пределах max_dist, ближайшие первыми: [(ключ, расстояние), ...].
+        Вызывающий перебирает их по порядку — ключ мог уже пропасть из кэша или не пройти сверку.
+        """
+        if max_dist < 0:
+            return []
+        masks = _masks(min(max_dist // _CHUNKS, _CHUNK_BITS))
+        h = np.uint64(h)
+        with self._lock:
+            if not self._live:
+                return []
+            parts = [np.arange(self._indexed, self._size, dtype=np.uint32)]
+            for j in range(_CHUNKS):
+                vals, tab_ids = self._tab_vals[j], self._tab_ids[j]
+                if not len(vals):
+                    continue
+                nb = _chunk(np.array([h]), j)[0] ^ masks
+                lo = np.searchsorted(vals, nb, side="left")
+                hi = np.searchsorted(vals, nb, side="right")
+                parts.extend(tab_ids[lo[k]:hi[k]] for k in np.flatnonzero(hi > lo))
+            ids = np.unique(np.concatenate(parts))
+            ids = ids[self._alive[ids]]
+            if not len(ids):
+                return []
+            dist = _popcount(self._hashes[ids] ^ h)
+            keep = dist <= max_dist
+            ids, dist = ids[keep], dist[keep]
+            order = np.argsort(dist, kind="stable")
+            keys = self._keys[ids[order]]
+            dist = dist[order]
+        found, seen = [], set()
+        for raw, d in zip(keys, dist):
+            key = raw.tobytes().hex()
+            if key in seen:
+                continue
+            seen.add(key)
+            found.append((key, int(d)))
+            if len(found) >= limit:
+                break
+        return found
@@ -0,0 +1,208 @@
+"""
+Пул воркеров для инференса OCR.
+
+Каждый воркер — отдельный поток со своим экземпляром модели (factory()),
+задачи попадают в ограниченную очередь. Если очередь заполнена, submit()
+сразу бросает QueueFullError, и эндпоинт отвечает 503 с Retry-After,
+а не копит запросы в памяти.
+
+Воркер собирает микро-батч: после первой задачи ждёт ещё до max_wait_ms
+или пока не наберётся max_batch задач, и делает один вызов predict на
+весь список — детектор/распознаватель лучше загружены батчем.
+
+Очередь — FairQueue (scheduler.py): приоритет, честная доля по источникам
+и дедлайны задаются в submit().
+"""
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+from scheduler import DeadlineExceededError, FairQueue, QueueFullError  # noqa: F401 (реэкспорт)
+
+
+class InferenceTicket:
+    """Задача в очереди: future с результатом + замеры для ответа."""
+    __slots__ = ("item", "future", "enqueued_at", "queue_depth", "wait_ms", "infer_ms", "worker",
+                 "batch_size", "priority", "source", "deadline")
+
+    def __init__(self, item, queue_depth: int, priority: str = "normal", source: Optional[str] = None,
+                 deadline: Optional[float] = None):
+        self.item = item
+        self.priority = priority
+        self.source = source
+        self.deadline = deadline
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.queue_depth = queue_depth
+        self.wait_ms = None
+        self.infer_ms = None
+        self.worker = None
+        self.batch_size = None
+
+
+class InferenceExecutor:
+    def __init__(self, factory, predict_batch, workers: int = 1, queue_size: int = 8,
+                 max_batch: int = 1, max_wait_ms: float = 0.0, name: str = "ocr",
+                 weights: Optional[Dict[str, float]] = None, source_share: float = 1.0):
+        """
+        factory() -> engine — создаёт модель (вызывается один раз на воркер).
+        predict_batch(engine, items) -> список результатов той же длины.
+        weights, source_share — веса классов приоритета и доля очереди на источник (FairQueue).
+        """
+        self._factory = factory
+        self._predict_batch = predict_batch
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self.name = name
+        self._batch_sizes = Counter()
+        self._queue = FairQueue(self.queue_size, weights, source_share)
+        self._threads = []
+        self._engines = []
+        self._started = False
+        self._ready = threading.Event()
+        self.ready_s = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: float = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def start(self, warmup=None):
+        """
+        Создаёт модели и запускает воркеры. warmup(engine) — прогон на
+        синтетической картинке, чтобы первый настоящий запрос не платил
+        за JIT/аллокации. ready становится True только после прогрева.
+        """
+        with self._lock:
+            if self._started:
+                return
+            t0 = time.perf_counter()
+            self._engines = [self._factory() for _ in range(self.workers)]
+            if warmup is not None:
+                for engine in self._engines:
+                    warmup(engine)
+            for i, engine in enumerate(self._engines):
+                t = threading.Thread(target=self._loop, args=(i, engine),
+                                     name=f"{self.name}-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._started = True
+            self.ready_s = round(time.perf_counter() - t0, 3)
+            self._ready.set()
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            sizes = dict(self._batch_sizes)
+        batches = sum(sizes.values())
+        images = sum(k * v for k, v in sizes.items())
+        return {
+            'mode': 'threads',
+            'workers': self.workers,
+            'ready': self.ready,
+            'queue_size': self.queue_size,
+            'queue_depth': self.depth(),
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait_ms,
+            'batches': batches,
+            'images': images,
+            'avg_batch': round(images / batches, 2) if batches else 0.0,
+            'batch_sizes': {str(k): sizes[k] for k in sorted(sizes)},
+            'scheduler': self._queue.stats(),
+        }
+
+    def submit(self, item, priority: str = "normal", source: Optional[str] = None,
+               deadline: Optional[float] = None) -> InferenceTicket:
+        """deadline — момент time.perf_counter(), после которого задачу уже не запускать."""
+        ticket = InferenceTicket(item, self._queue.qsize(), priority, source, deadline)
+        try:
+            self._queue.put_nowait(ticket)
+        except QueueFullError as e:
+            raise QueueFullError(f"{self.name}: {e}")
+        return ticket
+
+    def shutdown(self, timeout: float = 5.0):
+        with self._lock:
+            if not self._started:
+                return
+            self._queue.stop(len(self._threads))
+            for t in self._threads:
+                t.join(timeout)
+            self._threads = []
+            self._engines = []
+            self._started = False
+            self._ready.clear()
+
+    def _collect(self, first):
+        """Добирает задачи к first, пока не кончится окно max_wait_ms или не наберётся max_batch."""
+        batch = [first]
+        stop = False
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                ticket = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if ticket is None:
+                stop = True
+                break
+            batch.append(ticket)
+        return batch, stop
+
+    def _run(self, engine, batch):
+        items = [t.item for t in batch]
+        try:
+            results = self._predict_batch(engine, items)
+            if len(results) != len(items):
+                raise RuntimeError(f"predict вернул {len(results)} результатов на {len(items)} картинок")
+            return [(r, None) for r in results]
+        except BaseException as e:
+            if len(items) == 1:
+                return [(None, e)]
+        # Батч упал целиком — прогоняем по одной, чтобы ошибка досталась только «своему» запросу
+        out = []
+        for item in items:
+            try:
+                out.append((self._predict_batch(engine, [item])[0], None))
+            except BaseException as e:
+                out.append((None, e))
+        return out
+
+    def _loop(self, idx: int, engine):
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stop = self._collect(first)
+            batch = [t for t in batch if t.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            t0 = time.perf_counter()
+            for t in batch:
+                t.wait_ms = round((t0 - t.enqueued_at) * 1000, 2)
+                t.worker = idx
+                t.batch_size = len(batch)
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+            outcomes = self._run(engine, batch)
+            infer_ms = round((time.perf_counter() - t0) * 1000, 2)
+            for t, (res, err) in zip(batch, outcomes):
+                t.infer_ms = infer_ms
+                t.item = None  # кадр больше не нужен пулу — пусть запрос отпустит его раньше
+                if err is not None:
+                    t.future.set_exception(err)
+                else:
+                    t.future.set_result(res)
@@ -0,0 +1,392 @@
+"""
+Многопроцессный режим инференса: N процессов-шардов, у каждого своя модель.
+
+PaddleOCR упирается в CPU, а один процесс с потоками (ocr_pool) не всегда
+занимает все ядра. ShardedExecutor повторяет интерфейс InferenceExecutor,
+но воркеры — отдельные процессы:
+  * каждый шард привязан к своему набору ядер (sched_setaffinity) и
+    использует threads_per_worker потоков внутри инференса;
+  * запросы ждут в общей FairQueue (scheduler.py: приоритеты, доли
+    источников, дедлайны) на queue_size * workers мест; поток-диспетчер
+    отдаёт их шарду с наименьшим числом незавершённых задач, держа в
+    каждом не больше двух батчей — остальное ждёт в очереди по правилам
+    планировщика, а не в pipe в порядке прихода;
+  * внутри шарда тот же микро-батчинг, что и в ocr_pool.
+
+Процессы запускаются через spawn: Paddle не переживает fork после
+инициализации. Модели можно заранее скопировать в tmpfs (stage_models):
+все шарды читают файлы из одной страницы page cache, а не с диска каждый.
+Веса внутри Paddle всё равно копируются в память процесса, поэтому RSS
+шардов видно в stats() — по нему и подбирается число воркеров.
+"""
+import itertools
+import multiprocessing as mp
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ocr_engine import to_plain
+from ocr_pool import InferenceTicket, QueueFullError
+from scheduler import FairQueue
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cores(workers: int, threads_per_worker: int) -> List[List[int]]:
+    """Режет доступные ядра на непересекающиеся наборы по threads_per_worker (по кругу, если не хватает)."""
+    cores = available_cores()
+    out = []
+    for i in range(workers):
+        start = (i * threads_per_worker) % len(cores)
+        out.append([cores[(start + j) % len(cores)] for j in range(threads_per_worker)])
+    return out
+
+
+SHM_ROOT = "/dev/shm/ocr_models"
+
+
+def staged_path(src: str, dst_root: str = SHM_ROOT) -> str:
+    """Куда stage_models положит модели (или src, если tmpfs нет)."""
+    if not Path(dst_root).parent.is_dir():
+        return src
+    return str(Path(dst_root) / Path(src).name)
+
+
+def stage_models(src: str, dst_root: str = SHM_ROOT) -> str:
+    """Копирует каталог моделей в tmpfs (докопирует изменившиеся файлы) и возвращает новый путь."""
+    src_path = Path(src)
+    dst = Path(staged_path(src, dst_root))
+    if dst == src_path:
+        return src
+    for f in src_path.rglob("*"):
+        if f.is_file():
+            target = dst / f.relative_to(src_path)
+            if not target.exists() or target.stat().st_size != f.stat().st_size:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(f, target)
+    return str(dst)
+
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+@contextmanager
+def thread_env(threads: int):
+    """
+    OMP/MKL/OpenBLAS_NUM_THREADS = threads на время запуска дочерних процессов.
+    Пулы потоков BLAS/OpenMP читают их один раз при загрузке библиотеки, а
+    spawn-процесс импортирует numpy/cv2 раньше любого своего кода — поэтому
+    переменные должны быть в окружении родителя в момент start().
+    """
+    saved = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    os.environ.update({var: str(threads) for var in THREAD_ENV_VARS})
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+def _rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+def _shard_main(conn, factory, predict_batch, warmup, cores, threads, max_batch, max_wait_ms):
+    # OMP_NUM_THREADS и др. уже выставлены при запуске (thread_env), здесь — привязка к ядрам и потоки OpenCV
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+        engine = factory()
+        if warmup is not None:
+            warmup(engine)
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", os.getpid()))
+
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        batch = [msg]
+        deadline = time.perf_counter() + max_wait_ms / 1000.0
+        stop = False
+        while len(batch) < max_batch:
+            timeout = deadline - time.perf_counter()
+            if not conn.poll(max(timeout, 0)):
+                break
+            msg = conn.recv()
+            if msg is None:
+                stop = True
+                break
+            batch.append(msg)
+
+        t0 = time.perf_counter()
+        try:
+            results = predict_batch(engine, [img for _, img in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"predict вернул {len(results)} результатов на {len(batch)} картинок")
+            out = [(tid, True, to_plain(r)) for (tid, _), r in zip(batch, results)]
+        except Exception:
+            # Батч упал целиком — по одной, чтобы ошибка досталась только «своему» запросу
+            out = []
+            for tid, img in batch:
+                try:
+                    out.append((tid, True, to_plain(predict_batch(engine, [img])[0])))
+                except Exception as e:
+                    out.append((tid, False, f"{type(e).__name__}: {e}"))
+        infer_ms = round((time.perf_counter() - t0) * 1000, 2)
+        conn.send(("result", out, infer_ms, len(batch)))
+        if stop:
+            break
+
+
+class _Shard:
+    def __init__(self, idx: int, cores: List[int]):
+        self.idx = idx
+        self.cores = cores
+        self.process = None
+        self.conn = None
+        self.pid = None
+        self.alive = False
+        self.pending = {}
+        self.send_lock = threading.Lock()
+        self.reader = None
+        self.batches = 0
+        self.images = 0
+
+
+class ShardedExecutor:
+    def __init__(self, factory, predict_batch, workers: int = 2, threads_per_worker: int = 1,
+                 queue_size: int = 8, max_batch: int = 1, max_wait_ms: float = 0.0, name: str = "ocr",
+                 weights: Optional[Dict[str, float]] = None, source_share: float = 1.0):
+        """
+        factory и predict_batch — как у InferenceExecutor, но должны пикловаться
+        (функции модуля или functools.partial от них): их получают дочерние процессы.
+        """
+        self._factory = factory
+        self._predict_batch = predict_batch
+        self.workers = max(1, int(workers))
+        self.threads_per_worker = max(1, int(threads_per_worker))
+        self.queue_size = max(1, int(queue_size))
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self.name = name
+        self._shards = []
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        # Диспетчер ждёт на нём, пока у какого-нибудь шарда не освободится место
+        self._slots = threading.Condition(self._lock)
+        self._queue = FairQueue(self.queue_size * self.workers, weights, source_share)
+        self._dispatcher = None
+        # Сколько задач держать в шарде: текущий батч и следующий
+        self.inflight = max(2, 2 * self.max_batch)
+        self._ready = threading.Event()
+        self.ready_s = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: float = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def start(self, warmup=None, timeout: float = 600.0):
+        with self._lock:
+            if self._shards:
+                return
+            t0 = time.perf_counter()
+            ctx = mp.get_context("spawn")
+            shards = [_Shard(i, c) for i, c in enumerate(split_cores(self.workers, self.threads_per_worker))]
+            for sh in shards:
+                parent, child = ctx.Pipe()
+                sh.conn = parent
+                sh.process = ctx.Process(
+                    target=_shard_main, name=f"{self.name}-shard-{sh.idx}", daemon=True,
+                    args=(child, self._factory, self._predict_batch, warmup, sh.cores,
+                          self.threads_per_worker, self.max_batch, self.max_wait_ms))
+                with thread_env(self.threads_per_worker):
+                    sh.process.start()
+                child.close()
+            errors = []
+            for sh in shards:
+                if not sh.conn.poll(timeout):
+                    errors.append(f"шард {sh.idx}: нет ответа за {timeout} с")
+                    continue
+                kind, value = sh.conn.recv()
+                if kind != "ready":
+                    errors.append(f"шард {sh.idx}: {value}")
+                    continue
+                sh.pid, sh.alive = value, True
+                sh.reader = threading.Thread(target=self._read_loop, args=(sh,),
+                                             name=f"{self.name}-shard-{sh.idx}-reader", daemon=True)
+                sh.reader.start()
+            self._shards = shards
+            if errors:
+                self._stop_shards()
+                raise RuntimeError("; ".join(errors))
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name=f"{self.name}-dispatcher",
+                                                daemon=True)
+            self._dispatcher.start()
+            self.ready_s = round(time.perf_counter() - t0, 3)
+            self._ready.set()
+
+    def depth(self) -> int:
+        return self._queue.qsize() + sum(len(sh.pending) for sh in self._shards)
+
+    def submit(self, item, priority: str = "normal", source: Optional[str] = None,
+               deadline: Optional[float] = None) -> InferenceTicket:
+        if not any(sh.alive for sh in self._shards):
+            raise QueueFullError(f"{self.name}: нет живых шардов")
+        ticket = InferenceTicket(item, self.depth(), priority, source, deadline)
+        try:
+            self._queue.put_nowait(ticket)
+        except QueueFullError as e:
+            raise QueueFullError(f"{self.name}: {e}")
+        return ticket
+
+    def _dispatch_loop(self):
+        while True:
+            ticket = self._queue.get()
+            if ticket is None:
+                break
+            # Клиент ушёл, пока задача ждала очереди
+            if ticket.future.done():
+                continue
+            with self._slots:
+                while True:
+                    live = [sh for sh in self._shards if sh.alive]
+                    # Наименьшая незавершённая работа; при равенстве — первый
+                    shard = min(live, key=lambda sh: len(sh.pending)) if live else None
+                    if shard is None or len(shard.pending) < self.inflight:
+                        break
+                    self._slots.wait(0.5)
+                if shard is not None:
+                    tid = next(self._ids)
+                    shard.pending[tid] = ticket
+            if shard is None:
+                ticket.future.set_exception(RuntimeError(f"{self.name}: нет живых шардов"))
+                continue
+            try:
+                with shard.send_lock:
+                    shard.conn.send((tid, ticket.item))
+            except (OSError, ValueError) as e:
+                with self._lock:
+                    shard.pending.pop(tid, None)
+                if not ticket.future.done():
+                    ticket.future.set_exception(RuntimeError(f"{self.name}: шард {shard.idx} недоступен ({e})"))
+                continue
+            # Кадр уже ушёл в pipe — в основном процессе ссылку не держим
+            ticket.item = None
+            ticket.worker = shard.idx
+
+    def _read_loop(self, sh: _Shard):
+        while True:
+            try:
+                msg = sh.conn.recv()
+            except (EOFError, OSError):
+                break
+            _, out, infer_ms, batch_size = msg
+            sh.batches += 1
+            sh.images += batch_size
+            now = time.perf_counter()
+            for tid, ok, payload in out:
+                with self._slots:
+                    ticket = sh.pending.pop(tid, None)
+                    self._slots.notify()
+                # Отменённую задачу (клиент ушёл) просто выбрасываем
+                if ticket is None or ticket.future.done():
+                    continue
+                ticket.infer_ms = infer_ms
+                ticket.batch_size = batch_size
+                # Ожидание = всё время в полёте минус сам инференс (включает передачу по pipe)
+                ticket.wait_ms = round(max((now - ticket.enqueued_at) * 1000 - infer_ms, 0.0), 2)
+                if ok:
+                    ticket.future.set_result(payload)
+                else:
+                    ticket.future.set_exception(RuntimeError(payload))
+        # Процесс шарда умер — всем его задачам ошибка, новые туда не пойдут
+        sh.alive = False
+        with self._slots:
+            pending, sh.pending = sh.pending, {}
+            self._slots.notify_all()
+        for ticket in pending.values():
+            if not ticket.future.done():
+                ticket.future.set_exception(RuntimeError(f"шард {sh.idx} завершился"))
+
+    def stats(self) -> dict:
+        batches = sum(sh.batches for sh in self._shards)
+        images = sum(sh.images for sh in self._shards)
+        return {
+            'mode': 'processes',
+            'workers': self.workers,
+            'threads_per_worker': self.threads_per_worker,
+            'ready': self.ready,
+            'queue_size': self.queue_size,
+            'queue_depth': self.depth(),
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait_ms,
+            'batches': batches,
+            'images': images,
+            'avg_batch': round(images / batches, 2) if batches else 0.0,
+            'inflight_per_shard': self.inflight,
+            'scheduler': self._queue.stats(),
+            'shards': [{
+                'idx': sh.idx,
+                'pid': sh.pid,
+                'alive': sh.alive,
+                'cores': sh.cores,
+                'outstanding': len(sh.pending),
+                'batches': sh.batches,
+                'images': sh.images,
+                'rss_mb': _rss_mb(sh.pid) if sh.pid else None,
+            } for sh in self._shards],
+        }
+
+    def _stop_shards(self, timeout: float = 5.0):
+        for sh in self._shards:
+            if sh.process is None:
+                continue
+            try:
+                with sh.send_lock:
+                    sh.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for sh in self._shards:
+            if sh.process is None:
+                continue
+            sh.process.join(timeout)
+            if sh.process.is_alive():
+                sh.process.terminate()
+            sh.alive = False
+            sh.conn.close()
+        self._shards = []
+
+    def shutdown(self, timeout: float = 5.0):
+        with self._lock:
+            self._ready.clear()
+        if self._dispatcher is not None:
+            self._queue.stop(1)
+            self._dispatcher.join(timeout)
+            self._dispatcher = None
+        self._stop_shards(timeout)
@@ -0,0 +1,78 @@
+"""
+Адаптивное уменьшение картинки перед детекцией.
+
+Раньше каждая загрузка шла в predict в родном размере, а Paddle уже сам
+ужимал её под det_limit_side_len. Здесь размер выбирается под картинку:
+  * длинная сторона не больше det_limit_side_len (OCR_DET_LIMIT_SIDE_LEN);
+  * если текста мало (низкая плотность границ на миниатюре) — ещё меньше,
+    до SPARSE_FACTOR от лимита: крупный редкий текст детектор видит и так;
+  * не меньше min_side и никогда не больше родного размера;
+  * одно уменьшение быстрым интерполятором (INTER_LINEAR, при сильном
+    сжатии INTER_AREA — иначе строки «рвутся»).
+Боксы из predict возвращаются в координаты исходной картинки (unscale_lines).
+
+Точность / задержка на примерах — benchmarks/bench_resize.py.
+"""
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+import cv2
+
+# Плотность границ (доля пикселей Canny на миниатюре): ниже SPARSE — редкий текст, выше DENSE — плотный
+EDGE_SPARSE = 0.03
+EDGE_DENSE = 0.10
+SPARSE_FACTOR = 0.7
+THUMB_SIDE = 320
+# Если уменьшать почти не надо — не трогаем картинку вовсе
+MIN_SHRINK = 0.95
+
+
+def edge_density(img_bgr: np.ndarray) -> float:
+    h, w = img_bgr.shape[:2]
+    s = THUMB_SIDE / max(h, w)
+    thumb = cv2.resize(img_bgr, None, fx=s, fy=s, interpolation=cv2.INTER_AREA) if s < 1.0 else img_bgr
+    gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(gray, 100, 200)
+    return float(np.count_nonzero(edges)) / edges.size
+
+
+def target_side(h: int, w: int, density: float, limit: int, min_side: int = 640) -> int:
+    """Длинная сторона для детекции: от SPARSE_FACTOR*limit (редкий текст) до limit (плотный)."""
+    t = min(max((density - EDGE_SPARSE) / (EDGE_DENSE - EDGE_SPARSE), 0.0), 1.0)
+    factor = SPARSE_FACTOR + (1.0 - SPARSE_FACTOR) * t
+    side = max(int(round(limit * factor)), min_side)
+    return min(side, max(h, w))
+
+
+def prescale(img_bgr: np.ndarray, limit: int, side: Optional[int] = None,
+             min_side: int = 640) -> Tuple[np.ndarray, float]:
+    """
+    Уменьшает картинку перед predict. side: None — выбрать по плотности текста,
+    > 0 — длинная сторона явно, <= 0 — без уменьшения.
+    Возвращает (картинка, scale); scale == 1.0 — та же картинка без копии.
+    """
+    h, w = img_bgr.shape[:2]
+    if side is not None and side <= 0:
+        return img_bgr, 1.0
+    if side is None:
+        if max(h, w) <= min_side:
+            return img_bgr, 1.0
+        side = target_side(h, w, edge_density(img_bgr), limit, min_side)
+    scale = side / max(h, w)
+    if scale >= MIN_SHRINK:
+        return img_bgr, 1.0
+    interp = cv2.INTER_AREA if scale < 0.5 else cv2.INTER_LINEAR
+    return cv2.resize(img_bgr, None, fx=scale, fy=scale, interpolation=interp), scale
+
+
+def unscale_lines(lines: List[Dict[str, Any]], sx: float, sy: float) -> List[Dict[str, Any]]:
+    """
+    Боксы строк -> координаты исходной картинки (sx, sy — во сколько её уменьшили по осям).
+    Координаты округляются до целых — как у боксов predict без уменьшения.
+    """
+    if sx == 1.0 and sy == 1.0:
+        return lines
+    for ln in lines:
+        if ln.get("box") is not None:
+            ln["box"] = [[round(x / sx), round(y / sy)] for x, y in ln["box"]]
+    return lines
@@ -0,0 +1,186 @@
+"""
+Сэмплирующий профайлер и сохранение медленных запросов.
+
+Работа одного /ocr размазана по потокам: event loop, threadpool (декод,
+обводка), воркеры пула (predict). Поэтому профиль снимается со всего
+процесса: поток-сэмплер раз в interval_ms читает sys._current_frames() и
+складывает стеки всех потоков (кроме простаивающих) в кольцевой буфер за
+последние window_s секунд. Профиль запроса — сэмплы между его началом и
+концом, так что он есть и у запроса, который стал медленным «внезапно»:
+решать, профилировать ли, заранее не нужно. Параллельные запросы в этот
+профиль тоже попадают — поток (первый кадр стека) подсказывает, чей он.
+
+Формат профиля — collapsed stacks («кадр;кадр;кадр N» на строку): его
+понимают flamegraph.pl, speedscope и inferno.
+
+Запрос сохраняется (capture), если он медленнее slow_ms, попал в долю
+rate или пришёл с заголовком X-OCR-Profile: 1. В каталоге — <id>.json
+(ключ картинки, размеры, число строк, этапы, параметры) и <id>.folded.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+PROFILE_HEADER = "x-ocr-profile"
+
+# Листовые кадры ожидания: поток спит на локе/очереди/сокете — в профиле это шум
+_IDLE = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"), ("queue.py", "get"),
+    ("connection.py", "_recv"), ("connection.py", "_poll"), ("connection.py", "poll"),
+    ("scheduler.py", "get"),
+}
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profiler:
+    def __init__(self, root: Path, interval_ms: float = 10.0, window_s: float = 120.0,
+                 slow_ms: float = 0.0, rate: float = 0.0, keep: int = 200):
+        self.root = Path(root)
+        self.interval_s = max(float(interval_ms), 1.0) / 1000.0
+        self.slow_ms = float(slow_ms)
+        self.rate = max(0.0, min(1.0, float(rate)))
+        self.keep = max(1, int(keep))
+        self._samples = deque(maxlen=max(1, int(window_s / self.interval_s)))
+        self._names = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.captured = 0
+        self.sample_cost_s = 0.0
+        self.ticks = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="ocr-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(1.0)
+        self._thread = None
+
+    def _stack(self, frame, thread_name: str) -> Optional[str]:
+        leaf = frame.f_code
+        if (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE:
+            return None
+        parts = []
+        while frame is not None:
+            parts.append(_frame_name(frame.f_code))
+            frame = frame.f_back
+        parts.append(thread_name)
+        return ";".join(reversed(parts))
+
+    def _loop(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            t0 = time.perf_counter()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                s = self._stack(frame, names.get(ident, f"thread-{ident}"))
+                if s is not None:
+                    stacks.append(s)
+            t1 = time.perf_counter()
+            with self._lock:
+                self._samples.append((t0, tuple(stacks)))
+                self.ticks += 1
+                self.sample_cost_s += t1 - t0
+
+    def profile(self, started: float, finished: float) -> Counter:
+        """Collapsed stacks между моментами perf_counter started и finished."""
+        with self._lock:
+            window = [stacks for ts, stacks in self._samples if started <= ts <= finished]
+        out = Counter()
+        for stacks in window:
+            out.update(stacks)
+        return out
+
+    def reason(self, header: Optional[str]) -> Optional[str]:
+        """Профилировать ли запрос заранее: 'header' / 'sampled' или None (решит порог slow_ms)."""
+        if not self.enabled:
+            return None
+        if header and header.strip().lower() in ("1", "true", "yes"):
+            return "header"
+        if self.rate and random.random() < self.rate:
+            return "sampled"
+        return None
+
+    def is_slow(self, duration_ms: float) -> bool:
+        return self.enabled and self.slow_ms > 0 and duration_ms >= self.slow_ms
+
+    def capture(self, started: float, finished: float, reason: str, meta: Dict[str, Any],
+                content: Optional[bytes] = None, ext: str = "bin") -> str:
+        """Пишет <id>.json и <id>.folded (и входную картинку, если передана); возвращает id."""
+        cid = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        prof = self.profile(started, finished)
+        with open(self.root / f"{cid}.folded", "w", encoding="utf-8") as f:
+            for stack, n in prof.most_common():
+                f.write(f"{stack} {n}\n")
+        record = dict(meta, id=cid, reason=reason, ts=time.time(),
+                      duration_ms=round((finished - started) * 1000, 2),
+                      samples=sum(prof.values()), interval_ms=round(self.interval_s * 1000, 2),
+                      profile=f"{cid}.folded")
+        if content is not None:
+            record['input'] = f"{cid}.{ext}"
+            with open(self.root / record['input'], "wb") as f:
+                f.write(content)
+        with open(self.root / f"{cid}.json", "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        with self._lock:
+            self.captured += 1
+        self._trim()
+        return cid
+
+    def _trim(self):
+        metas = sorted(self.root.glob("*.json"))
+        for old in metas[:max(0, len(metas) - self.keep)]:
+            for path in self.root.glob(f"{old.stem}.*"):
+                path.unlink(missing_ok=True)
+
+    def recent(self, limit: int = 50) -> List[dict]:
+        out = []
+        for path in sorted(self.root.glob("*.json"), reverse=True)[:max(0, limit)]:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    out.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return out
+
+    def folded_path(self, cid: str) -> Optional[Path]:
+        path = self.root / f"{Path(cid).name}.folded"
+        return path if path.is_file() else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'interval_ms': round(self.interval_s * 1000, 2),
+                'slow_ms': self.slow_ms,
+                'rate': self.rate,
+                'window_samples': len(self._samples),
+                'captured': self.captured,
+                'avg_sample_us': round(self.sample_cost_s / self.ticks * 1e6, 1) if self.ticks else None,
+            }
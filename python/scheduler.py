@@ -0,0 +1,213 @@
+"""
+Очередь инференса с приоритетами, честной долей по источникам и дедлайнами.
+
+Обычная FIFO-очередь пула отдаёт задачи в порядке прихода: один активный
+канал забивает её целиком, и все остальные ждут за ним или получают 503.
+FairQueue заменяет её в InferenceExecutor и ShardedExecutor:
+
+  * класс приоритета (high / normal / low) — у каждого вес, классы
+    обслуживаются взвешенно (виртуальное время served / weight), так что
+    high почти всегда следующий, но и low не голодает совсем;
+  * внутри класса — круговой обход по источникам (source — например, id
+    канала): за ход каждый источник отдаёт одну задачу, и длинный хвост
+    одного канала не задерживает одиночные запросы других;
+  * один источник занимает не больше source_share очереди — остальным
+    всегда остаётся место (только для запросов с source: анонимные не
+    складываются в один общий «источник»; 1.0 — без ограничения);
+  * очередь полна, а пришла задача приоритетом выше — вытесняется самая
+    свежая задача самого низкого класса (ей QueueFullError, т.е. 503);
+  * задача с истёкшим дедлайном при выдаче воркеру не отдаётся, а
+    завершается DeadlineExceededError — клиент её уже не ждёт.
+
+Счётчики и задержки ожидания (avg/p95) — по каждому классу, в stats().
+"""
+import math
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from typing import Dict, Optional
+
+PRIORITIES = ("high", "normal", "low")
+DEFAULT_WEIGHTS = {"high": 8, "normal": 3, "low": 1}
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+def parse_mapping(spec: Optional[str]) -> Dict[str, str]:
+    """'a=1,b=2' -> {'a': '1', 'b': '2'} (для настроек из переменных окружения)."""
+    out = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            out[k.strip()] = v.strip()
+    return out
+
+
+def _pct(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    s = sorted(values)
+    return round(s[min(len(s) - 1, int(math.ceil(q * len(s))) - 1)], 2)
+
+
+class _Class:
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = max(float(weight), 1e-3)
+        self.sources = OrderedDict()  # source -> deque задач, порядок — очередь обхода
+        self.depth = 0
+        self.vtime = 0.0
+        self.enqueued = 0
+        self.served = 0
+        self.rejected = 0
+        self.evicted = 0
+        self.expired = 0
+        self.waits = deque(maxlen=1024)
+
+    def stats(self) -> dict:
+        waits = list(self.waits)
+        return {
+            'weight': self.weight,
+            'depth': self.depth,
+            'sources': len(self.sources),
+            'enqueued': self.enqueued,
+            'served': self.served,
+            'rejected': self.rejected,
+            'evicted': self.evicted,
+            'expired': self.expired,
+            'avg_wait_ms': round(sum(waits) / len(waits), 2) if waits else None,
+            'p95_wait_ms': _pct(waits, 0.95),
+        }
+
+
+class FairQueue:
+    """
+    Замена queue.Queue для пула: put_nowait(ticket) / get(block, timeout) /
+    qsize(). У тикета — priority, source, deadline (perf_counter или None),
+    enqueued_at и future. stop(n) — n воркеров получат None, когда очередь опустеет.
+    """
+
+    def __init__(self, maxsize: int, weights: Optional[Dict[str, float]] = None, source_share: float = 1.0):
+        self.maxsize = max(1, int(maxsize))
+        weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.source_cap = max(1, int(math.ceil(self.maxsize * min(max(source_share, 0.0), 1.0))))
+        self._classes = OrderedDict((p, _Class(p, float(weights[p]))) for p in PRIORITIES)
+        self._per_source = Counter()
+        self._size = 0
+        self._stops = 0
+        self._vclock = 0.0
+        self._cond = threading.Condition()
+
+    def qsize(self) -> int:
+        return self._size
+
+    def put_nowait(self, ticket):
+        evicted = None
+        with self._cond:
+            cls = self._classes.get(ticket.priority) or self._classes["normal"]
+            if ticket.source is not None and self._per_source[ticket.source] >= self.source_cap:
+                cls.rejected += 1
+                raise QueueFullError(f"Источник {ticket.source or '-'} занял свою долю очереди ({self.source_cap})")
+            if self._size >= self.maxsize:
+                evicted = self._evict_below(cls)
+                if evicted is None:
+                    cls.rejected += 1
+                    raise QueueFullError(f"Очередь заполнена ({self.maxsize})")
+            if not cls.depth:
+                # Класс простаивал — без накопленного «кредита» за время простоя
+                cls.vtime = max(cls.vtime, self._vclock)
+            cls.sources.setdefault(ticket.source, deque()).append(ticket)
+            cls.depth += 1
+            cls.enqueued += 1
+            if ticket.source is not None:
+                self._per_source[ticket.source] += 1
+            self._size += 1
+            self._cond.notify()
+        if evicted is not None and not evicted.future.done():
+            evicted.future.set_exception(QueueFullError("Вытеснено запросом с более высоким приоритетом"))
+
+    def _evict_below(self, cls: _Class):
+        for name in reversed(PRIORITIES):
+            low = self._classes[name]
+            if low is cls:
+                return None
+            if not low.depth:
+                continue
+            # Самая свежая задача самого длинного источника — она и так ждала бы дольше всех
+            source = max(low.sources, key=lambda s: len(low.sources[s]))
+            ticket = low.sources[source].pop()
+            self._remove(low, source)
+            low.evicted += 1
+            return ticket
+        return None
+
+    def _remove(self, cls: _Class, source):
+        if not cls.sources[source]:
+            del cls.sources[source]
+        cls.depth -= 1
+        if source is not None:
+            self._per_source[source] -= 1
+            if not self._per_source[source]:
+                del self._per_source[source]
+        self._size -= 1
+
+    def _pop(self):
+        cls = min((c for c in self._classes.values() if c.depth), key=lambda c: c.vtime)
+        source, q = next(iter(cls.sources.items()))
+        ticket = q.popleft()
+        cls.sources.move_to_end(source)
+        self._remove(cls, source)
+        self._vclock = cls.vtime
+        cls.vtime += 1.0 / cls.weight
+        return cls, ticket
+
+    def get(self, block: bool = True, timeout: Optional[float] = None):
+        expired = []
+        end = None if (not block or timeout is None) else time.perf_counter() + timeout
+        try:
+            with self._cond:
+                while True:
+                    if self._size:
+                        cls, ticket = self._pop()
+                        now = time.perf_counter()
+                        if ticket.deadline is not None and now > ticket.deadline:
+                            cls.expired += 1
+                            expired.append(ticket)
+                            continue
+                        cls.served += 1
+                        cls.waits.append((now - ticket.enqueued_at) * 1000)
+                        return ticket
+                    if self._stops:
+                        self._stops -= 1
+                        return None
+                    left = None if end is None else end - time.perf_counter()
+                    if not block or (left is not None and left <= 0):
+                        raise queue.Empty
+                    self._cond.wait(left)
+        finally:
+            for t in expired:
+                if not t.future.done():
+                    t.future.set_exception(DeadlineExceededError("Запрос не дождался очереди OCR (дедлайн истёк)"))
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def stop(self, n: int = 1):
+        with self._cond:
+            self._stops += n
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'source_cap': self.source_cap,
+                'classes': {name: c.stats() for name, c in self._classes.items()},
+                'sources': {s: n for s, n in self._per_source.most_common(20)},
+            }
@@ -0,0 +1,114 @@
+"""
+Сериализация ответа OCR.
+
+На плотном чеке (сотни строк) ответ собирался трижды: _to_py рекурсивно
+обходил каждый бокс, jsonable_encoder — весь payload, затем JSONResponse
+кодировал его ещё раз. Здесь боксы из predict переводятся в списки одним
+tolist() на весь массив, а тело пишет dumps: orjson, если он установлен
+(numpy-массивы кодирует сам, без копии в списки), иначе json.
+
+Схема ответа (поле формы response_schema):
+  full    — как раньше: ocr.boxes = [{box: [[x, y] x4], text, conf}, ...];
+  compact — параллельные массивы ocr.texts, ocr.confs и ocr.boxes —
+            плоский int32 по 8 чисел на строку (x1 y1 ... x4 y4, -1 — бокса нет).
+include_boxes=false — без координат: в full у строк нет box, в compact нет boxes.
+"""
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SCHEMAS = ("full", "compact")
+
+
+def _default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, Path):
+        return str(obj)
+    raise TypeError(f"{type(obj).__name__} не сериализуется в JSON")
+
+
+def dumps(obj) -> bytes:
+    """JSON в UTF-8 без пробелов; numpy-типы кодируются как списки и числа."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _plain(obj):
+    # Рекурсивно переводит numpy-типы в чистые Python-типы (для рваных боксов)
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    if isinstance(obj, (list, tuple)):
+        return [_plain(x) for x in obj]
+    return obj
+
+
+def _poly(p):
+    p = _plain(p)
+    if isinstance(p, list) and len(p) == 8 and all(isinstance(x, (int, float)) for x in p):
+        return [[p[0], p[1]], [p[2], p[3]], [p[4], p[5]], [p[6], p[7]]]
+    return p
+
+
+def polys_to_list(polys) -> Optional[list]:
+    """Боксы predict -> [[[x, y] x4], ...] одним tolist(); рваные и нестандартные — поштучно."""
+    if polys is None:
+        return None
+    try:
+        arr = np.asarray(polys)
+    except ValueError:
+        arr = None
+    if arr is not None and arr.dtype.kind in "iuf":
+        if arr.size == 0:
+            return []
+        if arr.ndim == 2 and arr.shape[1] == 8:
+            arr = arr.reshape(-1, 4, 2)
+        if arr.ndim == 3 and arr.shape[2] == 2:
+            return arr.tolist()
+    return [_poly(p) for p in polys]
+
+
+def flat_boxes(lines: List[Dict[str, Any]]) -> np.ndarray:
+    """Боксы строк -> int32 по 8 чисел на строку; -1 у строк без бокса."""
+    out = np.full((len(lines), 8), -1, np.int32)
+    boxes = [ln.get("box") for ln in lines]
+    if lines and all(b is not None and len(b) == 4 for b in boxes):
+        out[:] = np.rint(np.asarray(boxes, np.float64).reshape(len(lines), 8))
+        return out.ravel()
+    for i, b in enumerate(boxes):
+        if b is not None and len(b) == 4:
+            out[i] = np.rint(np.asarray(b, np.float64).reshape(8))
+    return out.ravel()
+
+
+def shape_payload(payload: Dict[str, Any], schema: str = "full", include_boxes: bool = True) -> Dict[str, Any]:
+    """Payload по схеме ответа; исходный не меняется (его ещё читают профайлер и кэш)."""
+    if schema == "full" and include_boxes:
+        return payload
+    ocr = payload['ocr']
+    lines = ocr['boxes']
+    if schema == "compact":
+        shaped = {k: v for k, v in ocr.items() if k != 'boxes'}
+        shaped['texts'] = [ln['text'] for ln in lines]
+        shaped['confs'] = [ln['conf'] for ln in lines]
+        if include_boxes:
+            shaped['boxes'] = flat_boxes(lines)
+    else:
+        shaped = dict(ocr, boxes=[{k: v for k, v in ln.items() if k != 'box'} for ln in lines])
+    return dict(payload, ocr=shaped, schema=schema)
@@ -0,0 +1,115 @@
+"""
+OCR длинных скриншотов и лент по перекрывающимся тайлам.
+
+Лента 1080x8000 целиком ужимается под det_limit_side_len до ~160 px в
+ширину — мелкий текст пропадает, а один predict на всю картинку долгий.
+Вместо этого картинка режется на тайлы не больше tile_side по каждой
+стороне (в родном разрешении), с перекрытием overlap: строка, разрезанная
+границей, целиком попадает в соседний тайл. Тайлы уходят в пул отдельными
+картинками — микро-батчинг и шарды обрабатывают их вместе.
+
+Склейка (merge_tiles): боксы переводятся в координаты картинки, дубли из
+зон перекрытия убираются (из двух пересекающихся строк остаётся более
+полная), full_text собирается заново в порядке чтения: строки по рядам
+сверху вниз, в ряду слева направо.
+"""
+import math
+from typing import List, Dict, Any, Tuple
+
+import numpy as np
+
+# Строки считаются одной, если пересечение их bbox — не меньше этой доли меньшего из них
+DUP_OVERLAP = 0.6
+
+
+def should_tile(h: int, w: int, tile_side: int, min_aspect: float) -> bool:
+    """
+    Резать длинные узкие картинки: длинная сторона больше tile_side и во столько
+    раз больше короткой не меньше min_aspect (<= 0 — никогда). Обычные большие
+    фото (4:3, 16:9) не режутся — их уменьшает prescale.
+    """
+    return min_aspect > 0 and max(h, w) > tile_side and max(h, w) >= min_aspect * max(min(h, w), 1)
+
+
+def _starts(length: int, tile: int, overlap: int) -> List[int]:
+    if length <= tile:
+        return [0]
+    n = math.ceil((length - overlap) / (tile - overlap))
+    step = (length - tile) / (n - 1)
+    return [int(round(i * step)) for i in range(n)]
+
+
+def plan_tiles(h: int, w: int, tile_side: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+    """Тайлы (x0, y0, x1, y1), равномерно покрывающие картинку, перекрытие не меньше overlap."""
+    overlap = min(overlap, tile_side // 2)
+    return [(x, y, min(x + tile_side, w), min(y + tile_side, h))
+            for y in _starts(h, tile_side, overlap) for x in _starts(w, tile_side, overlap)]
+
+
+def _bbox(box) -> np.ndarray:
+    p = np.asarray(box, dtype=np.float64).reshape(-1, 2)
+    return np.array([p[:, 0].min(), p[:, 1].min(), p[:, 0].max(), p[:, 1].max()])
+
+
+def _dedupe(lines: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    boxed = [ln for ln in lines if ln["box"] is not None]
+    if len(boxed) < 2:
+        return lines
+    bb = np.stack([_bbox(ln["box"]) for ln in boxed])
+    area = np.maximum(bb[:, 2] - bb[:, 0], 1) * np.maximum(bb[:, 3] - bb[:, 1], 1)
+    # Сначала более полные строки (длиннее текст, больше площадь, выше уверенность) — они и остаются
+    order = sorted(range(len(boxed)), key=lambda i: (-len(boxed[i]["text"]), -area[i], -boxed[i]["conf"]))
+    kept = []
+    for i in order:
+        dup = False
+        for j in kept:
+            if boxed[i]["tile"] == boxed[j]["tile"]:
+                continue
+            iw = min(bb[i, 2], bb[j, 2]) - max(bb[i, 0], bb[j, 0])
+            ih = min(bb[i, 3], bb[j, 3]) - max(bb[i, 1], bb[j, 1])
+            if iw > 0 and ih > 0 and iw * ih >= DUP_OVERLAP * min(area[i], area[j]):
+                dup = True
+                break
+        if not dup:
+            kept.append(i)
+    return [boxed[i] for i in kept] + [ln for ln in lines if ln["box"] is None]
+
+
+def reading_order(lines: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Ряды сверху вниз (строки, чьи центры по y ближе половины высоты строки), в ряду — слева направо."""
+    boxed = [(ln, _bbox(ln["box"])) for ln in lines if ln["box"] is not None]
+    if not boxed:
+        return lines
+    heights = [b[3] - b[1] for _, b in boxed]
+    tol = max(float(np.median(heights)) * 0.5, 1.0)
+    boxed.sort(key=lambda t: (t[1][1] + t[1][3]) / 2)
+    rows, row, row_y = [], [], None
+    for ln, b in boxed:
+        cy = (b[1] + b[3]) / 2
+        if row and cy - row_y > tol:
+            rows.append(row)
+            row = []
+        if not row:
+            row_y = cy
+        row.append((ln, b))
+    rows.append(row)
+    out = [ln for r in rows for ln, _ in sorted(r, key=lambda t: t[1][0])]
+    return out + [ln for ln in lines if ln["box"] is None]
+
+
+def merge_tiles(tile_lines: List[Tuple[List[Dict[str, Any]], int, int]]):
+    """
+    tile_lines — [(строки тайла, x0, y0)] в координатах тайлов.
+    Возвращает (lines, full_text) в координатах картинки.
+    """
+    lines = []
+    for idx, (tl, x0, y0) in enumerate(tile_lines):
+        for ln in tl:
+            if ln["box"] is not None:
+                ln["box"] = [[x + x0, y + y0] for x, y in ln["box"]]
+            ln["tile"] = idx
+            lines.append(ln)
+    lines = reading_order(_dedupe(lines))
+    for ln in lines:
+        del ln["tile"]
+    return lines, " ".join(ln["text"] for ln in lines).strip()
@@ -15,15 +15,91 @@ const stringSession = new StringSession(process.env.SESSION);
 
 // const OCR_URL = process.env.OCR_URL || 'http://localhost:8000/ocr';
 
-async function sendToOCR(buffer, { focus = 'full' } = {}) {
+async function sendToOCR(buffer, { focus = 'full', source } = {}) {
   const form = new FormData();
    const blob = new Blob([buffer], { type: 'image/jpeg' });
   form.append('image', blob, { filename: `image_${Date.now()}.jpg`, contentType: 'image/jpeg' });
   form.append('focus', focus);
+  // source — канал: планировщик OCR делит очередь между каналами поровну
+  if (source) form.append('source', source);
 
   const res = await axios.post(process.env.OCR_URL, form);
   return res.data;
 }
+
+// Альбом одним запросом: /ocr/batch отвечает NDJSON, строка на картинку (index — порядок в запросе)
+const OCR_BATCH_URL = process.env.OCR_BATCH_URL || `${(process.env.OCR_URL || '').replace(/\/+$/, '')}/batch`;
+// Фото альбома приходят отдельными сообщениями с общим groupedId — ждём хвост альбома
+const ALBUM_WAIT_MS = parseInt(process.env.ALBUM_WAIT_MS || '800');
+
+async function sendBatchToOCR(buffers, { focus = 'full', source } = {}) {
+  const form = new FormData();
+  buffers.forEach((buffer, i) => {
+    const blob = new Blob([buffer], { type: 'image/jpeg' });
+    form.append('image', blob, `image_${Date.now()}_${i}.jpg`);
+  });
+  form.append('focus', focus);
+  if (source) form.append('source', source);
+
+  const res = await axios.post(OCR_BATCH_URL, form, { responseType: 'text' });
+  return res.data
+    .split('\n')
+    .filter(Boolean)
+    .map((line) => JSON.parse(line))
+    .sort((a, b) => a.index - b.index);
+}
+
+// OCR_JOBS=1: одиночные фото через очередь /ocr/jobs — обработчик не ждёт OCR, результат забирается опросом
+const OCR_JOBS = process.env.OCR_JOBS === '1';
+const OCR_JOBS_URL = `${(process.env.OCR_URL || '').replace(/\/+$/, '')}/jobs`;
+const OCR_JOBS_POLL_MS = parseInt(process.env.OCR_JOBS_POLL_MS || '1000');
+// Сколько ждать результат задачи (по умолчанию 15 мин — три попытки по аренде в 5 мин на стороне сервиса)
+const OCR_JOBS_TIMEOUT_MS = parseInt(process.env.OCR_JOBS_TIMEOUT_MS || '900000');
+
+async function enqueueOCR(buffer, { focus = 'full', source } = {}) {
+  const form = new FormData();
+  const blob = new Blob([buffer], { type: 'image/jpeg' });
+  form.append('image', blob, `image_${Date.now()}.jpg`);
+  form.append('focus', focus);
+  if (source) form.append('source', source);
+
+  const res = await axios.post(OCR_JOBS_URL, form);
+  return res.data.job_id;
+}
+
+async function waitJob(jobId) {
+  const deadline = Date.now() + OCR_JOBS_TIMEOUT_MS;
+  while (Date.now() < deadline) {
+    const { data } = await axios.get(`${OCR_JOBS_URL}/${jobId}`);
+    if (data.status === 'done') return data.result;
+    if (data.status === 'error') return { status: 'error', detail: data.error };
+    await new Promise((resolve) => setTimeout(resolve, OCR_JOBS_POLL_MS));
+  }
+  return { status: 'error', detail: `задача ${jobId} не готова за ${OCR_JOBS_TIMEOUT_MS} мс` };
+}
+
+const albums = new Map();
+
+function collectAlbum(groupId, buffer, onFlush) {
+  const album = albums.get(groupId) || { buffers: [], timer: null };
+  album.buffers.push(buffer);
+  clearTimeout(album.timer);
+  album.timer = setTimeout(() => {
+    albums.delete(groupId);
+    onFlush(album.buffers).catch((err) => console.error("Ошибка при обработке альбома:", err));
+  }, ALBUM_WAIT_MS);
+  albums.set(groupId, album);
+}
+
+function formatOCR(channel, ocrRes) {
+  if (ocrRes.status !== 'ok') return `Канал: ${channel.title}\nошибка OCR: ${ocrRes.detail || '-'}`;
+  return (
+    `Канал: ${channel.title}\n` +
+    `full_text: ${ocrRes.ocr.full_text || '-'}\n` +
+    `highlighted: ${ocrRes.ocr.highlighted_text || '-'}\n` +
+    `mask_present: ${ocrRes.ocr.mask_present}`
+  );
+}
 // Основной клиент
 (async () => {
   const client = new TelegramClient(stringSession, apiId, apiHash, { connectionRetries: 5 });
@@ -46,23 +122,33 @@ async function sendToOCR(buffer, { focus = 'full' } = {}) {
             const buffer = await client.downloadMedia(msg);
             const type = await fileType.fileTypeFromBuffer(buffer);
             if (!type || !type.mime.startsWith('image/')) return;
+            const source = channel.id.toString();
+
+            if (msg.groupedId) {
+              // Фото из альбома: копим и отправляем всё одним /ocr/batch
+              collectAlbum(msg.groupedId.toString(), buffer, async (buffers) => {
+                const results = await sendBatchToOCR(buffers, { focus: 'both', source });
+                await client.sendMessage("me", {
+                  message: results.map((r) => formatOCR(channel, r)).join('\n\n')
+                });
+              });
+              return;
+            }
+
+            if (OCR_JOBS) {
+              const jobId = await enqueueOCR(buffer, { focus: 'both', source });
+              waitJob(jobId)
+                .then((ocrRes) => client.sendMessage("me", { message: formatOCR(channel, ocrRes) }))
+                .catch((err) => console.error("Ошибка задачи OCR:", jobId, err));
+              return;
+            }
 
-            // Отправляем в Python: сначала обычный OCR
-            const ocrFull = await sendToOCR(buffer, { focus: 'full' });
-            // При необходимости — распознать только обведённую область
-             const ocrHighlight = await sendToOCR(buffer, { focus: 'highlight' });
-             console.log(ocrFull)
-            console.log("OCR full_text:", ocrFull.ocr.full_text);
-            // console.log("OCR highlighted_text:", ocrHighlight.highlighted_text);
+            // Один запрос: full_text и highlighted_text из одного прогона OCR
+            const ocrRes = await sendToOCR(buffer, { focus: 'both', source });
+            console.log("OCR full_text:", ocrRes.ocr.full_text);
 
             // Пример: переслать себе результат
-            await client.sendMessage("me", {
-              message:
-                `Канал: ${channel.title}\n` +
-                `full_text: ${ocrFull.full_text || '-'}\n` +
-                `highlighted: ${ocrHighlight.highlighted_text || '-'}\n` +
-                `mask_present: ${ocrHighlight.mask_present}`
-            });
+            await client.sendMessage("me", { message: formatOCR(channel, ocrRes) });
 
           } catch (err) {
             console.error("Ошибка при обработке изображения:", err);